@@ -1,8 +1,25 @@
 // scroll bar on top as well for visibility
 $(document).ready(function(){
   $('.table-responsive').doubleScroll();
+  preselectSuggestions();
 });
 
+// the trained model's guesses - mains are pre-selected in the page, subs here
+async function preselectSuggestions() {
+    let suggestions = JSON.parse($("#suggestions").text());
+    for (let [i, suggestion] of suggestions.entries()) {
+        if (suggestion === null) {
+            continue
+        }
+        await loadOptions(suggestion.main, `sub-div-${i}`, i);
+        if (suggestion.sub !== null) {
+            let sub = $(`#sub-div-${i} [data-value="${suggestion.sub}"]`);
+            sub.addClass("active");
+            sub.find("input").prop("checked", true);
+        }
+    }
+}
+
 async function postData(url = '', data = {}) {
     let body = JSON.stringify(data);
     // Default options are marked with *
@@ -22,27 +39,29 @@ async function postData(url = '', data = {}) {
     return await response.json(); // parses JSON response into native JavaScript objects
 }
 
-async function loadOptions(mainId, subDivId, parentLoopCounter) {
-    let link = "/classify/load-subs/";
+// the whole main/sub tree, fetched once - the browser caches it between pages
+const classificationTree = fetch("/classify/tree/", {credentials: 'same-origin'})
+    .then(response => response.json());
 
+async function loadOptions(mainId, subDivId, parentLoopCounter) {
     try {
-        const data = await postData(link, {id: mainId});
-        setOptions(data, subDivId, parentLoopCounter)
+        const tree = await classificationTree;
+        setOptions(tree.subs[mainId] || [], subDivId, parentLoopCounter)
     } catch (error) {
         console.error(error);
     }
 }
 
-function setOptions(optionObject, subDivId, parentLoopCounter) {
+function setOptions(options, subDivId, parentLoopCounter) {
     let subDiv = $(`#${subDivId}`);
     subDiv.empty();
-    for (let key in optionObject) {
+    for (let [key, label] of options) {
         let lbl = document.createElement("label");
         let btnId = `sub-${parentLoopCounter}`;
         lbl.setAttribute("class", "btn btn-xs btn-outline-secondary");
         lbl.setAttribute("id", btnId);
         lbl.setAttribute("data-value", key);
-        lbl.innerHTML = optionObject[key];
+        lbl.innerHTML = label;
 
         let inpt = document.createElement("input");
         inpt.setAttribute("type", "radio");
@@ -79,6 +98,12 @@ async function sendFormData(numColumns) {
 
     try {
         const reply = await postData(link, data);
+        if (reply["error"]) {
+            // ie. the lease on this source ran out - start again on a fresh claim
+            alert(reply["error"]);
+            window.location.reload();
+            return;
+        }
         window.location.replace(reply["location"])
     } catch (error) {
         console.error(error);
@@ -0,0 +1,91 @@
+"""
+Time `import classifier.utils`, cold and warm, and what the gazetteers add to it
+
+    python -m benchmarks.asset_loading [--repeat N]
+
+Each measurement runs in a fresh interpreter, with Django set up and pandas and
+numpy imported before the timer starts. A cold import compiles the classifier
+package from source (its bytecode cache is cleared first), a warm one loads the
+cached bytecode. AssetHolder reads no list until one is used, so the lists are
+timed on their own: one of them, and all of them - what every import used to pay.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PACKAGE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "classifier")
+
+SETUP = (
+    "import os\n"
+    "import time\n"
+    "import django\n"
+    "import numpy\n"
+    "import pandas\n"
+    "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'columnclasses.settings')\n"
+    "django.setup()\n"
+)
+
+CASES = {
+    "import_cold": "import classifier.utils\n",
+    "import_warm": "import classifier.utils\n",
+    "one_list": "from classifier.profiler import assets\nassets.states\n",
+    "all_lists": (
+        "from classifier.assets import LISTS\n"
+        "from classifier.profiler import assets\n"
+        "for name in LISTS:\n"
+        "    getattr(assets, name)\n"
+    ),
+}
+
+
+def run(body: str, pycache: str, setup: str = "") -> float:
+    code = (
+        SETUP
+        + setup
+        + "start = time.perf_counter()\n"
+        + body
+        + "print(time.perf_counter() - start)\n"
+    )
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+    # (the warm runs need the bytecode written)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    return float(out.stdout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # a bytecode cache of its own, so the package's can be cleared without
+    # recompiling everything else each time
+    with tempfile.TemporaryDirectory() as pycache:
+        package_cache = pycache + os.path.abspath(PACKAGE)
+        run(CASES["import_warm"], pycache)
+        results = {}
+        for name, body in CASES.items():
+            # the lists are timed once the modules are imported
+            setup = "" if name.startswith("import") else "import classifier.utils\n"
+            times = []
+            for _ in range(args.repeat):
+                if name == "import_cold":
+                    shutil.rmtree(package_cache, ignore_errors=True)
+                times.append(run(body, pycache, setup))
+            results[name] = {"median_ms": statistics.median(times) * 1000}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Count queries and time for a classification submit as the number of columns grows
+
+    python -m benchmarks.classify_submit [--columns 10 100 300 1000]
+
+Runs against a throwaway test database. On sqlite the column inserts are split into
+batches of 999 parameters (about 140 columns), so the count only steps up there -
+on other databases it stays flat.
+"""
+import argparse
+import json
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "columnclasses.settings")
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    CaptureQueriesContext,
+    setup_test_environment,
+)
+from django.urls import reverse  # noqa: E402
+
+from classifier.models import Classification, Source  # noqa: E402
+
+
+def submit(client: Client, columns: int, main: Classification) -> dict:
+    source = Source.objects.create(document=f"bench-{columns}.csv")
+    body = {i: {"main": str(main.id), "sub": ""} for i in range(columns)}
+    body["sourceId"] = source.id
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        client.post(
+            reverse("classify:classify"),
+            json.dumps(body),
+            content_type="application/json",
+        )
+        seconds = time.perf_counter() - start
+    return {"queries": len(queries), "ms": seconds * 1000}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--columns", type=int, nargs="+", default=[10, 100, 300, 1000])
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        client = Client()
+        main_class = Classification.objects.filter(main=True).first()
+        # the first request also creates the session
+        submit(client, 1, main_class)
+        results = {n: submit(client, n, main_class) for n in args.columns}
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
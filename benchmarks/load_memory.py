@@ -0,0 +1,96 @@
+"""
+Compare the memory of object and compact (categorical) CSV loading and profiling
+
+    python -m benchmarks.load_memory [--rows N] [--columns N] [--seed N]
+
+A synthetic CSV is profiled four ways: loaded whole with load_csv and streamed in
+chunks with iter_csv, each with and without compact=True. Every case runs in a
+fresh process, and the resident memory it added (see batch.MemorySampler) and the
+time taken are printed as JSON, along with how many columns ended up categorical.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "columnclasses.settings")
+django.setup()
+
+import pandas as pd  # noqa: E402
+from django.core.files import File  # noqa: E402
+
+from benchmarks.synthetic import generate  # noqa: E402
+from classifier.batch import MemorySampler  # noqa: E402
+from classifier.profiler import profile_chunks, profile_dataframe  # noqa: E402
+from classifier.utils import iter_csv, load_csv  # noqa: E402
+
+
+def measure_load(path: str, compact: bool) -> dict:
+    with MemorySampler() as loading:
+        start = time.perf_counter()
+        with open(path) as f:
+            df = load_csv(File(f), compact=compact)
+        loaded = time.perf_counter() - start
+    with MemorySampler() as profiling:
+        start = time.perf_counter()
+        [p.finalize() for p in profile_dataframe(df)]
+        profiled = time.perf_counter() - start
+    return {
+        "frame_mb": df.memory_usage(deep=True).sum() / 2**20,
+        "load_rss_mb": loading.report()["rss_delta_mb"],
+        "profile_rss_mb": profiling.report()["rss_delta_mb"],
+        "load_seconds": loaded,
+        "profile_seconds": profiled,
+        "categorical_columns": sum(
+            isinstance(d, pd.CategoricalDtype) for d in df.dtypes
+        ),
+    }
+
+
+def measure_stream(path: str, compact: bool) -> dict:
+    with MemorySampler() as streaming:
+        start = time.perf_counter()
+        with open(path) as f:
+            [p.finalize() for p in profile_chunks(iter_csv(File(f), compact=compact))]
+        seconds = time.perf_counter() - start
+    return {"rss_mb": streaming.report()["rss_delta_mb"], "seconds": seconds}
+
+
+def run_alone(fn, *args) -> dict:
+    """run `fn` in a fresh process, so memory freed by one case can't hide another's"""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--columns", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "synthetic.csv")
+        generate(path, args.rows, args.columns, args.seed)
+        report = {
+            "rows": args.rows,
+            "columns": args.columns,
+            "file_mb": os.path.getsize(path) / 2**20,
+            "load": {
+                "object": run_alone(measure_load, path, False),
+                "compact": run_alone(measure_load, path, True),
+            },
+            "stream": {
+                "object": run_alone(measure_stream, path, False),
+                "compact": run_alone(measure_stream, path, True),
+            },
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
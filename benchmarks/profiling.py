@@ -0,0 +1,206 @@
+"""
+Time and measure the profiling hot path on a synthetic CSV
+
+    python -m benchmarks.profiling [--rows N] [--columns N] [--output run.json]
+                                   [--compare baseline.json [--tolerance 0.25]]
+
+Cases are load_csv, each metric in classifier.pd_operations over every column,
+analyze_dataframe and batch_analysis end to end (against a throwaway test
+database). Each is timed `--repeat` times for the median, then run once more under
+tracemalloc for its peak Python/numpy memory. Results are JSON; with --compare, any
+case more than `--tolerance` slower or hungrier than the baseline is listed and the
+exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "columnclasses.settings")
+django.setup()
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from django.core.files import File  # noqa: E402
+
+from benchmarks.synthetic import generate  # noqa: E402
+from classifier import pd_operations as ops  # noqa: E402
+from classifier.patterns import PATTERNS  # noqa: E402
+from classifier.profiler import GAZETTEERS, assets  # noqa: E402
+from classifier.utils import analyze_dataframe, load_csv  # noqa: E402
+
+
+def metric_cases(df: pd.DataFrame) -> Dict[str, Callable[[], object]]:
+    """each pd_operations metric applied to every column, as profiled before fusing"""
+    cases = {
+        "mean_token_count": lambda: df.apply(ops.mean_token_count),
+        "mean_token_length": lambda: df.apply(ops.mean_token_length),
+        "frac_digit": lambda: df.apply(lambda r: ops.frac_fxn(ops.count_digits, r)),
+        "frac_alpha": lambda: df.apply(lambda r: ops.frac_fxn(ops.count_letters, r)),
+        "frac_space": lambda: df.apply(lambda r: ops.frac_fxn(ops.count_spaces, r)),
+        "frac_other": lambda: df.apply(lambda r: ops.frac_fxn(ops.count_other_text, r)),
+        "frac_chars": lambda: [ops.frac_chars(df[c]) for c in df.columns],
+        "mean_line_length": lambda: df.apply(lambda r: ops.avg_len(np.mean, r)),
+        "median_line_length": lambda: df.apply(lambda r: ops.avg_len(np.median, r)),
+        "std_line_length": lambda: df.apply(lambda r: ops.avg_len(np.std, r)),
+        "unq_char_count": lambda: df.apply(ops.unq_char_count),
+        "unq_token_count": lambda: df.apply(ops.unq_token_count),
+    }
+    for feature, asset, left in GAZETTEERS:
+        words = getattr(assets, asset)
+        cases[feature] = lambda words=words, left=left: df.apply(
+            lambda r: ops.frac_token(r, words, left=left)
+        )
+    for feature, raw in PATTERNS:
+        cases[feature] = lambda raw=raw: df.apply(
+            lambda r: ops.frac_regex(r, raw, sep="|")
+        )
+    return {f"pd_operations.{name}": case for name, case in cases.items()}
+
+
+def measure(case: Callable[[], object], repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        case()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "peak_mb": peak / 2**20,
+    }
+
+
+def batch_case(path: str, columns: int, workdir: str) -> Callable[[], object]:
+    """batch_analysis of one classified Source holding the CSV, from scratch each time"""
+    from django.conf import settings
+    from django.core.files.base import ContentFile
+
+    from classifier.models import Column, Source
+    from classifier.utils import batch_analysis
+
+    settings.MEDIA_ROOT = workdir
+    source = Source(time_classified=pd.Timestamp.now(tz="UTC"))
+    with open(path, "rb") as f:
+        source.document.save("bench.csv", ContentFile(f.read()))
+    Column.objects.bulk_create(Column(source=source, index=i) for i in range(columns))
+
+    def run():
+        # forget the stored features so every run profiles the whole file
+        Column.objects.update(analysis="")
+        Source.objects.update(content_hash="")
+        return batch_analysis(approximate=False, workers=1)
+
+    return run
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """the cases that got slower or bigger than the baseline allows"""
+    regressions = []
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for key in ("median_ms", "peak_mb"):
+            if before[key] and now[key] > before[key] * (1 + tolerance):
+                regressions.append(
+                    f"{name} {key}: {before[key]:.2f} -> {now[key]:.2f} "
+                    f"({now[key] / before[key] - 1:+.0%})"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--columns", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results here as well as stdout")
+    parser.add_argument("--compare", help="results of an earlier run to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--skip-metrics",
+        action="store_true",
+        help="leave out the one-metric-at-a-time pd_operations cases",
+    )
+    args = parser.parse_args()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "synthetic.csv")
+        generate(path, args.rows, args.columns, args.seed)
+
+        def load() -> pd.DataFrame:
+            with open(path) as f:
+                return load_csv(File(f))
+
+        df = load()
+        labels = {k: [""] * args.columns for k in ("main", "sub", "label")}
+
+        cases = {
+            "load_csv": load,
+            "analyze_dataframe": lambda: analyze_dataframe(df, labels),
+        }
+        if not args.skip_metrics:
+            cases.update(metric_cases(df))
+
+        # the analysis output and matrix store land under the working directory
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            cases["batch_analysis"] = batch_case(path, args.columns, workdir)
+            results = {name: measure(case, args.repeat) for name, case in cases.items()}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            os.chdir(cwd)
+
+    report = {
+        "meta": {
+            "rows": args.rows,
+            "columns": args.columns,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
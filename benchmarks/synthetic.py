@@ -0,0 +1,129 @@
+"""
+Generate synthetic CSVs for benchmarks from the gazetteers in assets/lists
+
+    python -m benchmarks.synthetic out.csv [--rows N] [--columns N] [--seed N]
+
+Columns cycle through COLUMN_KINDS - real names, places, ZIPs and FIPS codes plus
+patterned values and noise - so every feature has something to match. The same
+seed always gives the same file.
+"""
+import argparse
+import csv
+import functools
+import os
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from classifier.assets import LISTS, LISTS_DIR
+
+
+@functools.lru_cache(maxsize=None)
+def _read_list(name: str) -> np.ndarray:
+    with open(os.path.join(LISTS_DIR, LISTS[name])) as f:
+        return np.array([line.strip() for line in f if line.strip()], dtype=object)
+
+
+def _pick(name: str) -> Callable[[np.random.Generator, int], np.ndarray]:
+    def values(rng: np.random.Generator, n: int) -> np.ndarray:
+        return rng.choice(_read_list(name), n)
+
+    return values
+
+
+def _full_name(rng: np.random.Generator, n: int) -> np.ndarray:
+    given = _pick("given")(rng, n)
+    surnames = _pick("surnames")(rng, n)
+    return np.array([f"{g.title()} {s.title()}" for g, s in zip(given, surnames)])
+
+
+def _phone(rng: np.random.Generator, n: int) -> np.ndarray:
+    digits = rng.integers(200, 999, (n, 3))
+    return np.array([f"({a}) {b}-{c:04d}" for a, b, c in digits])
+
+
+def _email(rng: np.random.Generator, n: int) -> np.ndarray:
+    given = _pick("given")(rng, n)
+    return np.array([f"{g}{i % 97}@example.com" for i, g in enumerate(given)])
+
+
+def _street(rng: np.random.Generator, n: int) -> np.ndarray:
+    numbers = rng.integers(1, 9999, n)
+    surnames = _pick("surnames")(rng, n)
+    kinds = rng.choice(["St", "Ave", "Rd", "Court", "Blvd"], n)
+    return np.array(
+        [f"{a} {s.title()} {k}" for a, s, k in zip(numbers, surnames, kinds)]
+    )
+
+
+def _integers(rng: np.random.Generator, n: int) -> np.ndarray:
+    return rng.integers(0, 1_000_000, n).astype(str)
+
+
+def _floats(rng: np.random.Generator, n: int) -> np.ndarray:
+    return np.char.mod("%.4f", rng.normal(0, 1000, n))
+
+
+def _noise(rng: np.random.Generator, n: int) -> np.ndarray:
+    alphabet = np.array(list("abcdefghijklmnopqrstuvwxyz0123456789 -#/"))
+    lengths = rng.integers(0, 24, n)
+    return np.array(["".join(rng.choice(alphabet, k)) for k in lengths])
+
+
+def _sparse(rng: np.random.Generator, n: int) -> np.ndarray:
+    """mostly blank, like an optional field"""
+    values = _pick("cities")(rng, n)
+    values[rng.random(n) < 0.8] = ""
+    return values
+
+
+COLUMN_KINDS: Dict[str, Callable[[np.random.Generator, int], np.ndarray]] = {
+    "given": _pick("given"),
+    "surname": _pick("surnames"),
+    "full_name": _full_name,
+    "street": _street,
+    "city": _pick("cities"),
+    "county": _pick("counties"),
+    "state": _pick("states"),
+    "zip": _pick("zipcodes"),
+    "fips": _pick("fips"),
+    "canada": _pick("canada"),
+    "phone": _phone,
+    "email": _email,
+    "integer": _integers,
+    "float": _floats,
+    "noise": _noise,
+    "sparse": _sparse,
+}
+
+
+def column_kinds(columns: int) -> List[str]:
+    kinds = list(COLUMN_KINDS)
+    return [kinds[i % len(kinds)] for i in range(columns)]
+
+
+def generate(path: str, rows: int, columns: int, seed: int = 0) -> List[str]:
+    """write a rows x columns CSV to `path`, returning the header"""
+    rng = np.random.default_rng(seed)
+    kinds = column_kinds(columns)
+    header = [f"{kind}_{i}" for i, kind in enumerate(kinds)]
+    data = [COLUMN_KINDS[kind](rng, rows) for kind in kinds]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(zip(*data))
+    return header
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--columns", type=int, default=len(COLUMN_KINDS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.path, args.rows, args.columns, args.seed)
+
+
+if __name__ == "__main__":
+    main()
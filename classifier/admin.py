@@ -1,5 +1,5 @@
 from django.contrib import admin
-from classifier.models import Source, Classification, Column
+from classifier.models import Source, Classification, Column, ProfileJob
 
 
 class ColumnInline(admin.TabularInline):
@@ -9,6 +9,9 @@ class ColumnInline(admin.TabularInline):
 @admin.register(Source)
 class SourceAdmin(admin.ModelAdmin):
     inlines = [ColumnInline]
+    list_display = ("document", "status", "duplicate_of", "created")
+    list_filter = ("status",)
+    raw_id_fields = ("duplicate_of",)
 
 
 @admin.register(Column)
@@ -19,3 +22,9 @@ class ColumnAdmin(admin.ModelAdmin):
 @admin.register(Classification)
 class ClassificationAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(ProfileJob)
+class ProfileJobAdmin(admin.ModelAdmin):
+    list_display = ("source", "status", "attempts", "modified")
+    list_filter = ("status",)
@@ -1,5 +1,30 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+
+LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """the tree and progress caches have to be shared between processes"""
+    if settings.CACHES["default"]["BACKEND"] in LOCAL_CACHES:
+        return [
+            checks.Error(
+                "The default cache is local to each process, so a Classification "
+                "change or new upload in one process isn't seen by the others.",
+                hint="Use a shared backend (database, file or memcached) in CACHES.",
+                id="classifier.E001",
+            )
+        ]
+    return []
 
 
 class ClassifierConfig(AppConfig):
-    name = 'classifier'
+    name = "classifier"
+
+    def ready(self):
+        from classifier import signals  # noqa: F401
@@ -1,15 +1,40 @@
+import os
+
+LISTS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "lists"
+)
+
+# AssetHolder attribute -> file under LISTS_DIR
+LISTS = {
+    "given": "given-names",
+    "surnames": "surnames",
+    "states": "states",
+    "canada": "canada",
+    "cities": "cities",
+    "counties": "counties",
+    "zipcodes": "zipcodes",
+    "fips": "fips",
+}
+
+
 class AssetHolder:
-    """class to allow instantiating our lists so we don't have to reload"""
-
-    def __init__(self):
-        self.given = self._load_as_set("assets/lists/given-names")
-        self.surnames = self._load_as_set("assets/lists/surnames")
-        self.states = self._load_as_set("assets/lists/states")
-        self.canada = self._load_as_set("assets/lists/canada")
-        self.cities = self._load_as_set("assets/lists/cities")
-        self.counties = self._load_as_set("assets/lists/counties")
-        self.zipcodes = self._load_as_set("assets/lists/zipcodes")
-        self.fips = self._load_as_set("assets/lists/fips")
+    """
+    class to allow instantiating our lists so we don't have to reload
+
+    Nothing is read until a list is first used, so importing the profiler costs
+    nothing and a profile only reads the lists it needs.
+    """
+
+    def __init__(self, lists_dir: str = LISTS_DIR):
+        self.lists_dir = lists_dir
+
+    def __getattr__(self, name: str) -> set:
+        # only called for attributes that aren't set yet, ie. lists not loaded so far
+        if name not in LISTS:
+            raise AttributeError(name)
+        value = self._load_as_set(os.path.join(self.lists_dir, LISTS[name]))
+        setattr(self, name, value)
+        return value
 
     @staticmethod
     def _load_as_set(filepath) -> set:
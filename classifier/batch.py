@@ -0,0 +1,351 @@
+"""Run the analysis of many Sources over a pool of worker processes"""
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections
+
+from classifier.row_index import RowIndex
+
+
+class Job(NamedTuple):
+    """everything a worker needs to analyze one Source without touching the database"""
+
+    source_id: int
+    name: str
+    # None for a Source that isn't classified yet
+    labels: Optional[Dict[str, List[str]]]
+    # the Source's known content hash and its columns' stored analysis payloads
+    content_hash: str = ""
+    stored: Tuple[dict, ...] = ()
+    # also write the labeled results as analysis/<name>.json
+    write_json: bool = False
+    # the document's row offsets, if built - lets one file be split across workers
+    row_index: Optional[RowIndex] = None
+    # skip the expensive features of columns with a confident header (see
+    # header_index.profile_cascade) - for a quick first profile
+    cascade: bool = False
+    # profile only until the fractions settle (see sampling.profile_adaptive)
+    adaptive: bool = False
+    # the features to compute for each column, rather than the stale ones for all
+    plan: Optional[Tuple[Tuple[str, ...], ...]] = None
+
+
+class JobResult(NamedTuple):
+    """the outcome of one Job - `error` is empty when it succeeded"""
+
+    source_id: int
+    name: str
+    rows: int = 0
+    seconds: float = 0.0
+    error: str = ""
+    content_hash: str = ""
+    # every feature of every column, or empty if nothing had to be recomputed
+    features: Tuple[Dict[str, float], ...] = ()
+    skipped: bool = False
+    # profiler.timing_report of the run, when timed
+    timing: Optional[dict] = None
+    # the features were profiled from a sample of the rows
+    sampled: bool = False
+
+
+def _init_worker() -> None:
+    """make sure Django is set up in worker processes (for spawn start methods)"""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "columnclasses.settings")
+    django.setup()
+
+
+def _process_peak_rss_mb() -> Optional[float]:
+    """
+    this process' peak resident memory over its whole life so far, where the
+    platform reports it - a worker's includes every job it ran before
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def _rss_mb() -> Optional[float]:
+    """this process' resident memory right now, where /proc reports it"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+class MemorySampler:
+    """
+    sample this process' resident memory in a background thread while in use
+
+        with MemorySampler() as memory:
+            profile_chunks(...)
+        memory.report()
+
+    so a report can say what one file added on top of what was resident before it,
+    rather than the process' lifetime peak. A spike shorter than `interval` can be
+    missed, and memory of other processes (ie. profile_ranges') isn't counted.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start_mb = self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> None:
+        while True:
+            rss = _rss_mb()
+            if rss is not None and (self.peak_mb is None or rss > self.peak_mb):
+                self.peak_mb = rss
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self) -> "MemorySampler":
+        self.start_mb = self.peak_mb = _rss_mb()
+        if self.start_mb is not None:
+            self._thread = threading.Thread(
+                target=self._sample, name="memory-sampler", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    __enter__ = start
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def report(self) -> Dict[str, Optional[float]]:
+        """resident memory before, its peak since and the difference, in MB"""
+        delta = None
+        if self.start_mb is not None:
+            delta = self.peak_mb - self.start_mb
+        return {
+            "rss_start_mb": self.start_mb,
+            "rss_peak_mb": self.peak_mb,
+            "rss_delta_mb": delta,
+            "process_peak_rss_mb": _process_peak_rss_mb(),
+        }
+
+
+def _profile_range(
+    index: RowIndex,
+    start: int,
+    stop: int,
+    features: List[str],
+    approximate: bool,
+    timed: bool,
+) -> list:
+    """profile rows start to stop of a document, read through its row index"""
+    from classifier.profiler import profile_chunks
+    from classifier.utils import compact_frame
+
+    chunksize = settings.CLASSIFIER_CHUNKSIZE
+    chunks = (
+        compact_frame(index.read(row, min(row + chunksize, stop)))
+        for row in range(start, stop, chunksize)
+    )
+    return profile_chunks(chunks, features, approximate, timed)
+
+
+def profile_ranges(
+    index: RowIndex,
+    parts: int,
+    features: List[str] = None,
+    approximate: bool = False,
+    timed: bool = False,
+) -> list:
+    """
+    profile one document as `parts` row ranges in as many worker processes
+
+    Each worker seeks straight to its own byte range, and the profiles of the
+    ranges are merged back in order.
+    """
+    ranges = index.ranges(parts)
+    args = [(index, a, b, features, approximate, timed) for a, b in ranges]
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=len(ranges), initializer=_init_worker) as pool:
+        profiled = list(pool.map(_profile_range, *zip(*args)))
+    profiles = profiled[0]
+    for part in profiled[1:]:
+        for profile, other in zip(profiles, part):
+            profile.merge(other)
+    return profiles
+
+
+def analyze_job(
+    job: Job, approximate: bool = False, timed: bool = False, split: int = 1
+) -> JobResult:
+    """
+    analyze one Source document and write its results - never raises
+
+    Only the features that are missing or stale in `job.stored` are computed. When
+    none are, the document isn't even parsed. With `timed`, a profiler.timing_report
+    and the memory the run took (see MemorySampler) are written next to the
+    analysis output and returned in the result. With `split`
+    and a row index, the document is profiled over that many processes (see
+    profile_ranges). A `job.cascade` profile leaves out the features that
+    header_index.profile_cascade skips, a `job.adaptive` one profiles only until
+    the fractions settle, and one with a `job.plan` computes just what it lists.
+    """
+    from classifier.feature_store import file_hash, merge_features, stale_features
+    from classifier.header_index import profile_cascade
+    from classifier.profiler import profile_chunks, timing_report
+    from classifier.sampling import ADAPTIVE_BATCH, profile_adaptive
+    from classifier.utils import (
+        iter_csv,
+        json_fp,
+        results_frame,
+        timing_fp,
+        write_data,
+        write_timing,
+    )
+
+    start = time.perf_counter()
+    memory = MemorySampler().start() if timed else None
+    try:
+        content_hash = job.content_hash or file_hash(
+            default_storage.open(job.name, "rb")
+        )
+        needed = stale_features(job.stored, content_hash, approximate, job.adaptive)
+        if not needed:
+            rows = max((p["features"]["row_count"] for p in job.stored), default=0)
+            return JobResult(
+                job.source_id,
+                job.name,
+                rows,
+                time.perf_counter() - start,
+                content_hash=content_hash,
+                skipped=True,
+            )
+        document = default_storage.open(job.name, "rb")
+        if job.plan is not None:
+            profiles = profile_chunks(
+                iter_csv(document, compact=True),
+                approximate=approximate,
+                timed=timed,
+                plan=job.plan,
+            )
+            fresh = [p.finalize() for p in profiles]
+        elif job.cascade:
+            fresh, profiles = profile_cascade(
+                lambda: iter_csv(default_storage.open(job.name, "rb"), compact=True),
+                needed,
+                approximate,
+                timed,
+            )
+        elif job.adaptive:
+            profiles, row_count = profile_adaptive(
+                iter_csv(document, ADAPTIVE_BATCH),
+                features=needed,
+                approximate=approximate,
+                timed=timed,
+                row_count=None if job.row_index is None else len(job.row_index),
+            )
+            fresh = [dict(p.finalize(), row_count=row_count) for p in profiles]
+        else:
+            if split > 1 and job.row_index is not None and len(job.row_index) >= split:
+                profiles = profile_ranges(
+                    job.row_index, split, needed, approximate, timed
+                )
+            else:
+                profiles = profile_chunks(
+                    iter_csv(document, compact=True), needed, approximate, timed
+                )
+            fresh = [p.finalize() for p in profiles]
+        features = merge_features(job.stored, fresh)
+        if job.write_json:
+            write_data(results_frame(features, job.labels), json_fp(document))
+        rows = int(max((f["row_count"] for f in features), default=0))
+        timing = None
+        if timed:
+            timing = dict(
+                timing_report(profiles),
+                source=job.name,
+                wall_seconds=time.perf_counter() - start,
+                memory=memory.report(),
+            )
+            write_timing(timing, timing_fp(document))
+    except Exception:
+        return JobResult(
+            job.source_id,
+            job.name,
+            seconds=time.perf_counter() - start,
+            error=traceback.format_exc(),
+        )
+    finally:
+        if memory is not None:
+            memory.stop()
+    return JobResult(
+        job.source_id,
+        job.name,
+        rows,
+        time.perf_counter() - start,
+        content_hash=content_hash,
+        features=tuple(features),
+        timing=timing,
+        sampled=job.adaptive,
+    )
+
+
+def run_jobs(
+    jobs: List[Job],
+    workers: int = 1,
+    approximate: bool = False,
+    progress: Callable[[JobResult, int, int], None] = None,
+    timed: bool = False,
+    split: int = 1,
+) -> List[JobResult]:
+    """
+    analyze every Job, in-process for a single worker or over a process pool
+
+    A failing Source is reported in its JobResult instead of stopping the run.
+    `progress` is called with each result, the number done so far and the total.
+    `split` spreads each file over that many processes instead (see analyze_job),
+    so it only applies with a single worker.
+    """
+    results = []
+    total = len(jobs)
+
+    def done(result: JobResult) -> None:
+        results.append(result)
+        if progress is not None:
+            progress(result, len(results), total)
+
+    if workers <= 1:
+        for job in jobs:
+            done(analyze_job(job, approximate, timed, split))
+        return results
+
+    # forked workers must not share the parent's database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(analyze_job, job, approximate, timed): job for job in jobs
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                done(future.result())
+            except Exception:
+                # the worker process itself died (OOM kill, segfault...)
+                done(JobResult(job.source_id, job.name, error=traceback.format_exc()))
+    return results
@@ -0,0 +1,156 @@
+"""
+Recognize uploads that were seen before, by their bytes or by their header
+
+An upload with the same sha256 as an earlier Source becomes a duplicate of it: the
+document isn't kept, no profile is queued, and it never joins the labeling queue or
+batch analysis - the original's analysis and labels stand for both, and deleting
+the original deletes its duplicates. An
+upload with new bytes but the same (normalized) header row as a classified Source
+gets that Source's labels suggested on the classify page.
+"""
+import hashlib
+import json
+from typing import Dict, List, Optional, Tuple
+
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+
+from classifier.feature_store import hash_chunks
+from classifier.models import Source
+from classifier.utils import read_preview
+
+
+def header_fingerprint(headers: List[str]) -> str:
+    """sha256 of a header row, ignoring case and surrounding whitespace"""
+    normalized = [h.strip().lower() for h in headers]
+    return hashlib.sha256(json.dumps(normalized).encode("utf-8")).hexdigest()
+
+
+class HashingFile(File):
+    """an upload that takes its own sha256 as storage reads it in chunks"""
+
+    def __init__(self, upload: UploadedFile):
+        super().__init__(upload, upload.name)
+        self.digest = hashlib.sha256()
+        self.hashed = 0
+
+    def chunks(self, chunk_size: int = None):
+        for chunk in super().chunks(chunk_size):
+            self.digest.update(chunk)
+            self.hashed += len(chunk)
+            yield chunk
+
+
+def store_upload(upload: UploadedFile) -> Tuple[Source, str]:
+    """
+    an unsaved Source with the upload stored as its document, and the upload's
+    sha256 - taken while it's written, unless the storage didn't read it in chunks
+    """
+    source = Source()
+    content = HashingFile(upload)
+    source.document.save(upload.name, content, save=False)
+    if content.hashed != upload.size:
+        return source, hash_chunks(upload.chunks())
+    return source, content.digest.hexdigest()
+
+
+def create_sources(files: List[UploadedFile]) -> Tuple[List[Source], List[Source]]:
+    """
+    store uploads as Sources, linking exact duplicates instead of storing them again
+
+    Returns the new Sources and the duplicates. Duplicates within the same upload
+    are linked to the first copy. Uploads scanned on the way in (see
+    uploads.StreamingUploadHandler) already have their hash and preview. Others are
+    hashed as they're stored, and removed again if they turn out to be duplicates.
+    """
+    scans = [getattr(f, "scan", None) for f in files]
+    stored: List[Optional[Source]] = []
+    hashes = []
+    for f, scan in zip(files, scans):
+        if scan:
+            stored.append(None)
+            hashes.append(scan.content_hash)
+        else:
+            source, content_hash = store_upload(f)
+            stored.append(source)
+            hashes.append(content_hash)
+    known = dict(
+        Source.objects.filter(
+            content_hash__in=set(hashes), duplicate_of__isnull=True
+        ).values_list("content_hash", "id")
+    )
+    new: Dict[str, Source] = {}
+    for f, scan, source, content_hash in zip(files, scans, stored, hashes):
+        if content_hash in known or content_hash in new:
+            if source is not None:
+                source.document.delete(save=False)
+            continue
+        preview = scan.preview if scan else read_preview(f, rows=0)
+        source = source or Source(document=f)
+        source.content_hash = content_hash
+        if preview is not None:
+            # (a scan whose preview failed leaves it to utils.source_preview)
+            source.header_fingerprint = header_fingerprint(preview["headers"])
+            source.preview = json.dumps(preview) if scan else ""
+        new[content_hash] = source
+    created = list(new.values())
+    with transaction.atomic():
+        # saved one by one for their primary keys - bulk_create doesn't set them on
+        # every database, and looking them up again could find another upload's
+        for source in created:
+            source.save()
+    originals = {
+        s.content_hash: s for s in Source.objects.filter(id__in=known.values())
+    }
+    originals.update((s.content_hash, s) for s in created)
+    duplicates = []
+    seen = set()
+    for content_hash in hashes:
+        if content_hash in new and content_hash not in seen:
+            # the stored copy
+            seen.add(content_hash)
+            continue
+        original = originals[content_hash]
+        duplicates.append(
+            Source(
+                document=original.document.name,
+                content_hash=content_hash,
+                header_fingerprint=original.header_fingerprint,
+                duplicate_of=original,
+            )
+        )
+    Source.objects.bulk_create(duplicates)
+    return created, duplicates
+
+
+def reused_labels(source: Source, columns: int) -> Optional[List[Optional[dict]]]:
+    """
+    the main/sub Classification ids of the latest classified Source with the same
+    header, as suggestions for each column - None if there's no such Source
+    """
+    if not source.header_fingerprint:
+        return None
+    match = (
+        Source.objects.filter(
+            header_fingerprint=source.header_fingerprint, status=Source.CLASSIFIED
+        )
+        .exclude(id=source.id)
+        .order_by("-time_classified")
+        .first()
+    )
+    if match is None:
+        return None
+    labels = {
+        index: (main, sub)
+        for index, main, sub in match.column_set.values_list(
+            "index", "main_class_id", "sub_class_id"
+        )
+    }
+    suggestions = []
+    for index in range(columns):
+        main, sub = labels.get(index, (None, None))
+        suggestions.append(
+            None if main is None else {"main": main, "sub": sub, "reused": match.id}
+        )
+    return suggestions
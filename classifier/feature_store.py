@@ -0,0 +1,112 @@
+"""Versioned column features as persisted in Column.analysis"""
+import hashlib
+import json
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from django.core.files import File
+
+from classifier.profiler import FEATURE_VERSIONS, FEATURES
+
+# bump to invalidate every stored analysis at once (ie. when the payload layout changes)
+FEATURE_SET_VERSION = 1
+
+
+def hash_chunks(chunks: Iterable[bytes]) -> str:
+    """sha256 hex digest of a stream of bytes (ie. an upload's chunks())"""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_hash(document: File, chunk_size: int = 1 << 20) -> str:
+    """sha256 hex digest of a document's bytes, read in chunks"""
+    with document.open("rb") as f:
+        return hash_chunks(iter(lambda: f.read(chunk_size), b""))
+
+
+def column_payload(
+    features: Dict[str, float],
+    content_hash: str,
+    approximate: bool,
+    sampled: bool = False,
+) -> str:
+    """
+    serialize one column's features for Column.analysis - `sampled` if they were
+    profiled from part of the rows (see sampling.profile_adaptive)
+    """
+    return json.dumps(
+        {
+            "feature_set": FEATURE_SET_VERSION,
+            "content_hash": content_hash,
+            "approximate": approximate,
+            "sampled": sampled,
+            "versions": {f: FEATURE_VERSIONS[f] for f in features},
+            "features": features,
+        }
+    )
+
+
+def load_payload(analysis: str) -> dict:
+    """parse a Column.analysis value - anything blank or unreadable counts as empty"""
+    try:
+        payload = json.loads(analysis)
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def is_current(
+    payload: dict, content_hash: str, approximate: bool, sampled: bool = False
+) -> bool:
+    """
+    whether a column's payload was stored for this file and these settings - and
+    not from a sample, unless this run is sampled too
+    """
+    return (
+        payload.get("feature_set") == FEATURE_SET_VERSION
+        and payload.get("content_hash") == content_hash
+        and payload.get("approximate") == approximate
+        and not (payload.get("sampled") and not sampled)
+    )
+
+
+def stale_features(
+    payloads: Sequence[dict],
+    content_hash: str,
+    approximate: bool,
+    sampled: bool = False,
+) -> Tuple[str, ...]:
+    """
+    the features that need (re)computing for a source, given its columns' payloads
+
+    Everything is stale if the file or the settings changed, or if the features
+    were sampled and this run isn't. Otherwise only the features that are missing
+    (or were skipped, see header_index.profile_cascade) or whose definition version
+    moved on.
+    """
+    if not payloads:
+        return FEATURES
+    needed = set()
+    for payload in payloads:
+        if not is_current(payload, content_hash, approximate, sampled):
+            return FEATURES
+        versions = payload.get("versions", {})
+        stored = payload.get("features", {})
+        needed.update(
+            f
+            for f in FEATURES
+            if stored.get(f) is None or versions.get(f) != FEATURE_VERSIONS[f]
+        )
+    return tuple(f for f in FEATURES if f in needed)
+
+
+def merge_features(
+    payloads: Sequence[dict], fresh: List[Dict[str, float]]
+) -> List[Dict[str, float]]:
+    """overlay freshly computed features on top of the stored ones, column by column"""
+    merged = []
+    for index, features in enumerate(fresh):
+        stored = payloads[index].get("features", {}) if index < len(payloads) else {}
+        merged.append({f: features.get(f, stored.get(f)) for f in FEATURES})
+    return merged
@@ -0,0 +1,84 @@
+"""Match whole columns against every gazetteer list at once"""
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+class GazetteerMatcher:
+    """
+    a token trie over every list, so each cell is scanned once for all of them
+
+    Entries are lowercased and split on whitespace, so multi-word entries ("rock
+    island") match runs of tokens inside a cell, and stray whitespace in the lists
+    doesn't matter. Lists with a `left` width are matched on the first `left`
+    characters of single tokens instead (ie. 5 digit zips against ZIP+4 values).
+
+    Each list gets one bit. A token counts as a match for a list when any entry of
+    that list covers it.
+    """
+
+    def __init__(self, lists: Sequence[Tuple[str, Iterable[str], int]]):
+        self.names = [name for name, _, _ in lists]
+        # token -> [bit mask of lists ending here, child level]
+        self.trie: Dict[str, list] = {}
+        # left width -> {prefix: bit mask}
+        self.prefixed: Dict[int, Dict[str, int]] = {}
+        for bit, (_, entries, left) in enumerate(lists):
+            mask = 1 << bit
+            if left:
+                table = self.prefixed.setdefault(left, {})
+                for entry in entries:
+                    key = entry.strip().lower()
+                    table[key] = table.get(key, 0) | mask
+                continue
+            for entry in entries:
+                level, node = self.trie, None
+                for token in entry.lower().split():
+                    node = level.setdefault(token, [0, {}])
+                    level = node[1]
+                if node is not None:
+                    node[0] |= mask
+
+    def cover(self, tokens: List[str]) -> List[int]:
+        """the bit mask of lists matching each token of one cell"""
+        lowered = [t.lower() for t in tokens]
+        covered = [0] * len(tokens)
+        for i in range(len(tokens)):
+            level = self.trie
+            for j in range(i, len(tokens)):
+                node = level.get(lowered[j])
+                if node is None:
+                    break
+                if node[0]:
+                    for k in range(i, j + 1):
+                        covered[k] |= node[0]
+                level = node[1]
+        for left, table in self.prefixed.items():
+            for k, t in enumerate(tokens):
+                covered[k] |= table.get(t[:left].lower(), 0)
+        return covered
+
+    def count(
+        self, cells: Iterable[List[str]], weights: Iterable[int] = None
+    ) -> Counter:
+        """
+        tally the list masks of every token across tokenized cells
+
+        `weights` counts each cell that many times (ie. distinct values and their
+        number of occurrences).
+        """
+        masks = Counter()
+        if weights is None:
+            for tokens in cells:
+                masks.update(self.cover(tokens))
+            return masks
+        for tokens, weight in zip(cells, weights):
+            for mask in self.cover(tokens):
+                masks[mask] += int(weight)
+        return masks
+
+    def matches(self, masks: Counter) -> Dict[str, int]:
+        """number of tokens matched by each list, from a tally of masks"""
+        return {
+            name: sum(n for mask, n in masks.items() if mask & (1 << bit))
+            for bit, name in enumerate(self.names)
+        }
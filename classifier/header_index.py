@@ -0,0 +1,284 @@
+"""
+Classify columns from their header name alone, where past labels agree
+
+`manage.py train_classifier` learns a HeaderIndex from the labeled Columns: how
+often each normalized header name ("zip_code" and "ZipCode" are both "zip code")
+was given each (main, sub) label, and the range of the CHECKED_FEATURES among the
+columns of each label.
+
+profile_cascade uses it to skip work. A column whose header is confidently one
+label gets only the cheap features, which are checked against that label's ranges.
+Only a column without a confident header, or one that fails the check, gets every
+feature. The skipped features are missing from the results (NaN in a results
+frame), and a later batch analysis fills them in. An upload gets the same first
+pass as it arrives (see uploads.UploadScan), and its ProfileJob then profiles only
+the columns that didn't fit (see remaining_plan).
+"""
+import itertools
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from django.conf import settings
+
+from classifier.profiler import FEATURES, ColumnProfile, profile_chunks
+
+# (main label, sub label)
+Label = Tuple[str, str]
+
+# features that are cheap to compute - no gazetteer, pattern or character scans
+CHEAP_FEATURES = (
+    "mean_token_count",
+    "mean_token_length",
+    "mean_line_length",
+    "median_line_length",
+    "std_line_length",
+    "row_count",
+)
+
+# the cheap features a confident column must fall in its label's range of
+CHECKED_FEATURES = ("mean_token_count", "mean_token_length", "mean_line_length")
+
+# how far past the seen range a checked feature may fall, as a fraction of the range
+# (and never less than 1 token or character)
+MARGIN = 0.5
+
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_header(name: str) -> str:
+    """lowercase words of a header name, however they were separated"""
+    words = _NON_WORD.split(_CAMEL.sub(r"\1 \2", str(name)).lower())
+    return " ".join(w for w in words if w)
+
+
+class HeaderIndex:
+    """label counts per normalized header name, and cheap feature ranges per label"""
+
+    def __init__(
+        self,
+        counts: Dict[str, Counter],
+        ranges: Dict[Label, Dict[str, Tuple[float, float]]],
+    ):
+        self.counts = counts
+        self.ranges = ranges
+
+    @classmethod
+    def learn(
+        cls, columns: Iterable[Tuple[str, Label, Optional[Dict[str, float]]]]
+    ) -> "HeaderIndex":
+        """from (header name, label, features or None) for each labeled column"""
+        counts = defaultdict(Counter)
+        seen = defaultdict(lambda: defaultdict(list))
+        for name, label, features in columns:
+            counts[normalize_header(name)][label] += 1
+            for f in CHECKED_FEATURES:
+                value = (features or {}).get(f)
+                if value is not None and not math.isnan(value):
+                    seen[label][f].append(value)
+        ranges = {
+            label: {f: (min(v), max(v)) for f, v in values.items()}
+            for label, values in seen.items()
+        }
+        return cls(dict(counts), ranges)
+
+    def match(self, name: str) -> Optional[Tuple[str, str, float]]:
+        """
+        the most common label for a header, with its confidence - its share of the
+        header's labels, counting one extra unseen label so that a header seen once
+        is only 50% sure
+        """
+        counts = self.counts.get(normalize_header(name))
+        if not counts:
+            return None
+        label, n = counts.most_common(1)[0]
+        return (*label, n / (sum(counts.values()) + 1))
+
+    def confident(self, name: str) -> Optional[Label]:
+        """the label of a header at or above CLASSIFIER_HEADER_CONFIDENCE, if any"""
+        match = self.match(name)
+        if match is None or match[2] < settings.CLASSIFIER_HEADER_CONFIDENCE:
+            return None
+        return match[:2]
+
+    def fits(self, label: Label, features: Dict[str, float]) -> bool:
+        """whether a column's cheap features are in the range seen for a label"""
+        ranges = self.ranges.get(label, {})
+        for f in CHECKED_FEATURES:
+            value = features.get(f)
+            if f not in ranges or value is None or math.isnan(value):
+                return False
+            lo, hi = ranges[f]
+            pad = max(MARGIN * (hi - lo), 1.0)
+            if not lo - pad <= value <= hi + pad:
+                return False
+        return True
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {
+            "counts": {
+                name: [[*label, n] for label, n in counts.items()]
+                for name, counts in self.counts.items()
+            },
+            "ranges": [[*label, r] for label, r in self.ranges.items()],
+        }
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "HeaderIndex":
+        with open(path) as f:
+            data = json.load(f)
+        return cls(
+            {
+                name: Counter({(main, sub): n for main, sub, n in counts})
+                for name, counts in data["counts"].items()
+            },
+            {
+                (main, sub): {f: tuple(r) for f, r in ranges.items()}
+                for main, sub, ranges in data["ranges"]
+            },
+        )
+
+
+def learn_from_columns() -> HeaderIndex:
+    """a HeaderIndex of every labeled Column, named from its Source's preview"""
+    from classifier.feature_store import load_payload
+    from classifier.models import Source
+    from classifier.utils import classified_columns, source_preview
+
+    rows = list(
+        classified_columns().values_list(
+            "source_id", "index", "main_class__label", "sub_class__label", "analysis"
+        )
+    )
+    headers = {
+        source.id: source_preview(source)["headers"]
+        for source in Source.objects.filter(id__in={r[0] for r in rows})
+    }
+    return HeaderIndex.learn(
+        (
+            headers[source_id][index],
+            (main or "", sub or ""),
+            load_payload(analysis).get("features"),
+        )
+        for source_id, index, main, sub, analysis in rows
+        if index < len(headers[source_id])
+    )
+
+
+_index: Optional[HeaderIndex] = None
+_stamp: Optional[Tuple[int, int]] = None
+_lock = threading.Lock()
+
+
+def get_header_index() -> Optional[HeaderIndex]:
+    """the HeaderIndex at CLASSIFIER_HEADER_INDEX_PATH, reloaded when it changes"""
+    global _index, _stamp
+    try:
+        stat = os.stat(settings.CLASSIFIER_HEADER_INDEX_PATH)
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    if stamp != _stamp:
+        with _lock:
+            if stamp != _stamp:
+                _index = HeaderIndex.load(settings.CLASSIFIER_HEADER_INDEX_PATH)
+                _stamp = stamp
+    return _index
+
+
+def first_pass(
+    names: Sequence[str], features: Sequence[str] = None, index: HeaderIndex = None
+) -> Tuple[List[Optional[Label]], List[Tuple[str, ...]]]:
+    """
+    the confident label of each column's header (if any), and the features to
+    compute for it first - only the cheap ones for a confidently named column
+    """
+    features = tuple(FEATURES if features is None else features)
+    labels = [index.confident(name) if index else None for name in names]
+    plan = [
+        tuple(f for f in features if f in CHEAP_FEATURES) if label else features
+        for label in labels
+    ]
+    return labels, plan
+
+
+def misfits(
+    index: Optional[HeaderIndex],
+    labels: Sequence[Optional[Label]],
+    results: Sequence[Dict[str, float]],
+) -> List[int]:
+    """the columns with a confident label whose cheap features don't fit it"""
+    return [
+        i
+        for i, (label, result) in enumerate(zip(labels, results))
+        if label and not index.fits(label, result)
+    ]
+
+
+def remaining_plan(
+    names: Sequence[str],
+    stored: Sequence[Dict[str, float]],
+    index: HeaderIndex = None,
+) -> List[Tuple[str, ...]]:
+    """
+    the features each column still needs after a first pass (see first_pass) that
+    stored `stored` - nothing for a column that fit its header's label, and the
+    missing ones for any other
+    """
+    index = index or get_header_index()
+    labels, _ = first_pass(names, index=index)
+    unfit = set(misfits(index, labels, stored))
+    return [
+        ()
+        if label and i not in unfit
+        else tuple(f for f in FEATURES if values.get(f) is None)
+        for i, (label, values) in enumerate(zip(labels, stored))
+    ]
+
+
+def profile_cascade(
+    read: Callable[[], Iterable[pd.DataFrame]],
+    features: Sequence[str] = None,
+    approximate: bool = False,
+    timed: bool = False,
+    index: HeaderIndex = None,
+) -> Tuple[List[Dict[str, float]], List[ColumnProfile]]:
+    """
+    profile_chunks, skipping the expensive features of confidently named columns
+
+    `read` gives the chunks of the file, and is called again only if some columns
+    fail the cheap check. Returns each column's features (without the skipped ones)
+    and the profiles of the first pass.
+    """
+    index = index or get_header_index()
+    features = tuple(FEATURES if features is None else features)
+    chunks = iter(read())
+    first = next(chunks, None)
+    if first is None:
+        return [], []
+    labels, plan = first_pass(first.columns, features, index)
+    profiles = profile_chunks(
+        itertools.chain([first], chunks),
+        approximate=approximate,
+        timed=timed,
+        plan=plan,
+    )
+    results = [p.finalize() for p in profiles]
+    unfit = misfits(index, labels, results)
+    if unfit:
+        redo = [features if i in unfit else () for i in range(len(results))]
+        again = profile_chunks(read(), approximate=approximate, plan=redo)
+        for i in unfit:
+            results[i].update(again[i].finalize())
+    return results, profiles
@@ -0,0 +1,98 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from classifier.batch import JobResult
+from classifier.matrix_store import FeatureMatrix
+from classifier.utils import batch_analysis
+
+
+class Command(BaseCommand):
+    help = "Analyze the columns of every classified Source into the feature matrix"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="number of worker processes (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--approximate",
+            action="store_true",
+            default=None,
+            help="use bounded-memory sketches for unique counts and medians",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="also write each Source's results to analysis/<name>.json",
+        )
+        parser.add_argument(
+            "--timing",
+            action="store_true",
+            default=None,
+            help="write a timing (by column and feature) and memory report per Source",
+        )
+        parser.add_argument(
+            "--split",
+            type=int,
+            default=1,
+            help="profile each indexed file over this many processes (one worker only)",
+        )
+        parser.add_argument(
+            "--adaptive",
+            action="store_true",
+            help="profile each changed file only until its fractions settle",
+        )
+        parser.add_argument(
+            "--compact",
+            action="store_true",
+            help="rewrite the feature matrix without superseded rows afterwards",
+        )
+
+    def handle(self, *args, **options):
+        if options["split"] > 1 and options["workers"] > 1:
+            raise CommandError("--split needs --workers 1")
+        if options["split"] > 1 and options["adaptive"]:
+            raise CommandError("--split and --adaptive can't be combined")
+        start = time.perf_counter()
+        results = batch_analysis(
+            approximate=options["approximate"],
+            workers=options["workers"],
+            progress=self.report,
+            write_json=options["json"],
+            timed=options["timing"],
+            split=options["split"],
+            adaptive=options["adaptive"],
+        )
+        if options["compact"]:
+            FeatureMatrix().compact()
+        elapsed = time.perf_counter() - start
+
+        failed = [r for r in results if r.error]
+        unchanged = sum(r.skipped for r in results)
+        rows = sum(r.rows for r in results if not r.skipped)
+        self.stdout.write(
+            f"Analyzed {len(results) - len(failed)}/{len(results)} sources "
+            f"({unchanged} unchanged), "
+            f"{rows} rows in {elapsed:.1f}s with {options['workers']} worker(s): "
+            f"{len(results) / elapsed if elapsed else 0:.2f} files/s, "
+            f"{rows / elapsed if elapsed else 0:.0f} rows/s"
+        )
+        for r in failed:
+            self.stderr.write(self.style.ERROR(f"{r.name} failed:\n{r.error}"))
+
+    def report(self, result: JobResult, done: int, total: int) -> None:
+        """print one progress line per finished Source"""
+        if result.error:
+            status = self.style.ERROR("FAILED")
+        elif result.skipped:
+            status = "unchanged"
+        else:
+            status = self.style.SUCCESS("ok")
+        self.stdout.write(
+            f"[{done}/{total}] {result.name} {status} "
+            f"({result.rows} rows, {result.seconds:.2f}s)"
+        )
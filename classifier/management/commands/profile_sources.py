@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from classifier import profile_jobs
+from classifier.models import ProfileJob
+
+
+class Command(BaseCommand):
+    help = "Run queued profiling jobs, queueing any Source that was never profiled"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=max(settings.CLASSIFIER_PROFILE_WORKERS, 1),
+            help="number of worker threads (default: CLASSIFIER_PROFILE_WORKERS)",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="give jobs that ran out of attempts another go",
+        )
+
+    def handle(self, *args, **options):
+        queued = profile_jobs.enqueue_unprofiled()
+        if options["retry_failed"]:
+            ProfileJob.objects.filter(status=ProfileJob.FAILED).update(
+                status=ProfileJob.QUEUED, attempts=0
+            )
+        start = time.perf_counter()
+        workers = options["workers"]
+        with ThreadPoolExecutor(workers, thread_name_prefix="profile") as pool:
+            futures = [pool.submit(profile_jobs.drain_worker) for _ in range(workers)]
+            ran = sum(f.result() for f in futures)
+        elapsed = time.perf_counter() - start
+
+        failed = ProfileJob.objects.filter(status=ProfileJob.FAILED)
+        self.stdout.write(
+            f"Queued {len(queued)} new job(s), ran {ran} in {elapsed:.1f}s "
+            f"with {workers} worker(s), {failed.count()} failed"
+        )
+        for job in failed.select_related("source"):
+            self.stderr.write(self.style.ERROR(f"{job.source} failed:\n{job.error}"))
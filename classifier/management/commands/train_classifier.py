@@ -0,0 +1,68 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from classifier.header_index import learn_from_columns
+from classifier.matrix_store import FeatureMatrix
+from classifier.predictor import ColumnModel
+from classifier.profiler import FEATURES
+
+
+class Command(BaseCommand):
+    help = (
+        "Train the column classifier from the feature matrix store, and the header "
+        "index from the labeled Columns"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--holdout",
+            type=float,
+            default=0.2,
+            help="fraction of Sources held out to report accuracy (default: 0.2)",
+        )
+        parser.add_argument("--steps", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        frame = FeatureMatrix().frame(FEATURES)
+        if frame.empty:
+            raise CommandError("the feature matrix is empty - run batch_analyze first")
+        X = frame[list(FEATURES)].to_numpy()
+        y = list(zip(frame["main"], frame["sub"]))
+
+        # hold out whole Sources, so columns of one CSV aren't on both sides
+        sources = frame["source_id"].unique()
+        rng = np.random.default_rng(options["seed"])
+        held = rng.choice(
+            sources, size=int(len(sources) * options["holdout"]), replace=False
+        )
+        test = frame["source_id"].isin(held).to_numpy()
+        if test.any() and not test.all():
+            model = ColumnModel.fit(
+                X[~test], [c for c, t in zip(y, test) if not t], steps=options["steps"]
+            )
+            predicted = [p[:2] for p in model.predict(X[test])]
+            actual = [c for c, t in zip(y, test) if t]
+            accuracy = np.mean([p == a for p, a in zip(predicted, actual)])
+            self.stdout.write(
+                f"Held-out accuracy: {accuracy:.3f} "
+                f"on {test.sum()} columns of {len(held)} sources"
+            )
+
+        model = ColumnModel.fit(X, y, steps=options["steps"])
+        model.save(settings.CLASSIFIER_MODEL_PATH)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Trained on {len(frame)} columns, {len(model.classes)} classes: "
+                f"{settings.CLASSIFIER_MODEL_PATH}"
+            )
+        )
+        headers = learn_from_columns()
+        headers.save(settings.CLASSIFIER_HEADER_INDEX_PATH)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {len(headers.counts)} header names: "
+                f"{settings.CLASSIFIER_HEADER_INDEX_PATH}"
+            )
+        )
@@ -0,0 +1,209 @@
+"""
+Every analyzed column's features in one columnar store of .npy blocks
+
+    analysis/matrix/
+        index.json          the blocks, their features and a label row per column
+        block-000001.npy    float64, one row per feature, one column per CSV column
+
+Blocks are feature-major, so reading one feature for every column is a contiguous
+slice of a memory-mapped file. Appending writes a new block and rewrites the index;
+blocks are never modified. A Source that is analyzed again supersedes its rows in
+older blocks, which are only dropped from disk by compact(). Labels change without
+the features changing, so relabel() brings every row's up to date.
+"""
+import json
+import os
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+MATRIX_DIR = os.path.join("analysis", "matrix")
+INDEX_FILE = "index.json"
+
+# per-column metadata kept in the index, next to each column's block and position
+LABEL_COLUMNS = ("source_id", "name", "index", "main", "sub", "label")
+
+
+class FeatureMatrix:
+    """
+    read and append to a feature store directory
+
+        store = FeatureMatrix()
+        store.add(source_id, name, labels, features)  # buffered
+        store.flush()                                 # one new block
+        store.frame(["frac_digit", "row_count"])      # only those features are read
+    """
+
+    def __init__(self, path: str = MATRIX_DIR):
+        self.path = path
+        self.index = self._read_index()
+        self.pending: List[tuple] = []
+
+    def _read_index(self) -> dict:
+        try:
+            with open(os.path.join(self.path, INDEX_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self._empty_index()
+
+    @staticmethod
+    def _empty_index(next_file: int = 1) -> dict:
+        return {
+            "next_file": next_file,
+            "blocks": [],
+            "columns": {c: [] for c in LABEL_COLUMNS + ("block",)},
+        }
+
+    def _write_index(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+    def _live(self) -> np.ndarray:
+        """mask of the rows from each Source's latest block"""
+        columns = self.index["columns"]
+        latest = {}
+        for source_id, block in zip(columns["source_id"], columns["block"]):
+            latest[source_id] = max(block, latest.get(source_id, block))
+        return np.array(
+            [latest[s] == b for s, b in zip(columns["source_id"], columns["block"])],
+            dtype=bool,
+        )
+
+    @property
+    def features(self) -> List[str]:
+        """every feature in the store, in the order of the newest block first"""
+        seen = {}
+        for block in reversed(self.index["blocks"]):
+            seen.update((f, None) for f in block["features"] if f not in seen)
+        return list(seen)
+
+    def sources(self) -> set:
+        """ids of the Sources in the store"""
+        return set(self.index["columns"]["source_id"])
+
+    def labels(self) -> pd.DataFrame:
+        """one row of LABEL_COLUMNS per stored CSV column"""
+        columns = self.index["columns"]
+        df = pd.DataFrame({c: columns[c] for c in LABEL_COLUMNS})
+        return df[self._live()].reset_index(drop=True)
+
+    def matrix(self, features: Sequence[str] = None) -> np.ndarray:
+        """
+        a (columns x features) array, read from memory-mapped blocks
+
+        Only the requested features are read. A feature missing from an older block
+        (ie. added since it was written) comes back as NaN for that block's rows.
+        """
+        features = list(features or self.features)
+        live = self._live()
+        blocks = np.asarray(self.index["columns"]["block"], dtype=int)
+        parts = []
+        for number, block in enumerate(self.index["blocks"]):
+            rows = live[blocks == number]
+            if not rows.any():
+                continue
+            data = np.load(os.path.join(self.path, block["file"]), mmap_mode="r")
+            part = np.full((len(features), int(rows.sum())), np.nan)
+            position = {f: i for i, f in enumerate(block["features"])}
+            for i, feature in enumerate(features):
+                if feature in position:
+                    part[i] = data[position[feature]][rows]
+            parts.append(part)
+        if not parts:
+            return np.empty((0, len(features)))
+        return np.concatenate(parts, axis=1).T
+
+    def frame(self, features: Sequence[str] = None) -> pd.DataFrame:
+        """the labels and the requested features as one DataFrame"""
+        features = list(features or self.features)
+        data = pd.DataFrame(self.matrix(features), columns=features)
+        return pd.concat([self.labels(), data], axis=1)
+
+    def add(
+        self,
+        source_id: int,
+        name: str,
+        labels: Dict[str, List[str]],
+        features: List[Dict[str, float]],
+    ) -> None:
+        """buffer one Source's columns - they're written on flush()"""
+        for index, values in enumerate(features):
+            label = [
+                labels[key][index] if index < len(labels[key]) else ""
+                for key in ("main", "sub", "label")
+            ]
+            self.pending.append(((source_id, name, index, *label), values))
+
+    def relabel(self, labels: Dict[int, Dict[str, List[str]]]) -> None:
+        """
+        set each row's main, sub and label to the current ones for its Source (see
+        utils.load_all_labels) - a Source missing from `labels` has none any more
+        """
+        columns = self.index["columns"]
+        changed = False
+        for row, (source_id, index) in enumerate(
+            zip(columns["source_id"], columns["index"])
+        ):
+            source_labels = labels.get(source_id, {})
+            for key in ("main", "sub", "label"):
+                values = source_labels.get(key, [])
+                value = values[index] if index < len(values) else ""
+                if columns[key][row] != value:
+                    columns[key][row] = value
+                    changed = True
+        if changed:
+            self._write_index()
+
+    def flush(self) -> None:
+        """write the buffered columns as a new block"""
+        if not self.pending:
+            return
+        features = list(self.pending[0][1])
+        data = np.array(
+            [
+                [np.nan if v.get(f) is None else v[f] for _, v in self.pending]
+                for f in features
+            ],
+            dtype=np.float64,
+        )
+        self._write_block(features, data, [meta for meta, _ in self.pending])
+        self.pending = []
+
+    def _write_block(
+        self, features: List[str], data: np.ndarray, meta: List[tuple]
+    ) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        name = f"block-{self.index['next_file']:06d}.npy"
+        # blocks are written first, so the index never points at a partial file
+        tmp = os.path.join(self.path, name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp, os.path.join(self.path, name))
+        number = len(self.index["blocks"])
+        self.index["next_file"] += 1
+        self.index["blocks"].append({"file": name, "features": features})
+        columns = self.index["columns"]
+        for values in meta:
+            for column, value in zip(LABEL_COLUMNS, values):
+                columns[column].append(value)
+            columns["block"].append(number)
+        self._write_index()
+
+    def compact(self) -> None:
+        """rewrite the store as a single block without superseded rows"""
+        features = self.features
+        data = self.matrix(features).T.copy()
+        meta = [tuple(row) for row in self.labels().to_dict("split")["data"]]
+        old = [b["file"] for b in self.index["blocks"]]
+        self.index = self._empty_index(self.index["next_file"])
+        if meta:
+            self._write_block(features, data, meta)
+        else:
+            self._write_index()
+        # only once the new index is in place
+        for name in old:
+            os.remove(os.path.join(self.path, name))
@@ -0,0 +1,14 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("classifier", "0002_default_classifications")]
+
+    operations = [
+        migrations.AddField(
+            model_name="source",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        )
+    ]
@@ -0,0 +1,12 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("classifier", "0003_source_content_hash")]
+
+    operations = [
+        migrations.AddField(
+            model_name="source", name="preview", field=models.TextField(blank=True)
+        )
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+def set_status(apps, schema_editor):
+    """mark Sources that were classified before the queue existed"""
+    Source = apps.get_model("classifier", "Source")
+    Source.objects.filter(time_classified__isnull=False).update(status="classified")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("classifier", "0004_source_preview")]
+
+    operations = [
+        migrations.AddField(
+            model_name="source",
+            name="status",
+            field=models.CharField(
+                choices=[("pending", "Pending"), ("classified", "Classified")],
+                default="pending",
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="source",
+            name="claimed_by",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="source",
+            name="lease_expires",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="source",
+            index=models.Index(
+                fields=["status", "lease_expires", "id"],
+                name="classifier__status_3fe889_idx",
+            ),
+        ),
+        migrations.RunPython(set_status, migrations.RunPython.noop),
+    ]
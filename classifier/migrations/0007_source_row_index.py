@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("classifier", "0006_profilejob")]
+
+    operations = [
+        migrations.AddField(
+            model_name="source",
+            name="row_index",
+            field=models.FileField(blank=True, upload_to="row_index"),
+        ),
+        migrations.AddField(
+            model_name="source",
+            name="row_count",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="source",
+            name="encoding",
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name="source", name="dialect", field=models.TextField(blank=True)
+        ),
+    ]
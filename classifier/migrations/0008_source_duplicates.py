@@ -0,0 +1,26 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("classifier", "0007_source_row_index")]
+
+    operations = [
+        migrations.AddField(
+            model_name="source",
+            name="duplicate_of",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="duplicates",
+                to="classifier.Source",
+            ),
+        ),
+        migrations.AddField(
+            model_name="source",
+            name="header_fingerprint",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,21 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("classifier", "0008_source_duplicates")]
+
+    operations = [
+        migrations.AlterField(
+            model_name="source",
+            name="duplicate_of",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="duplicates",
+                to="classifier.Source",
+            ),
+        )
+    ]
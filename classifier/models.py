@@ -8,12 +8,52 @@ from columnclasses.models import TimeStampedModel
 class Source(TimeStampedModel):
     """The CSV linking model from the file to Columns"""
 
+    PENDING = "pending"
+    CLASSIFIED = "classified"
+    STATUS_CHOICES = ((PENDING, "Pending"), (CLASSIFIED, "Classified"))
+
     # The actual file
     document = models.FileField(upload_to="uploads")
 
     # time that we classified the Columns for this Source
     time_classified = models.DateTimeField(blank=True, null=True)
 
+    # where this Source is in the labeling queue (see classifier.work_queue)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+
+    # the labeler (session key) holding this Source, and until when
+    claimed_by = models.CharField(max_length=40, blank=True)
+    lease_expires = models.DateTimeField(blank=True, null=True)
+
+    # sha256 of the document, filled in the first time it's analyzed
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+
+    # header and first rows as JSON, so pages never have to parse the document
+    preview = models.TextField(blank=True)
+
+    # byte offset of every row (see classifier.row_index), and what it found
+    row_index = models.FileField(upload_to="row_index", blank=True)
+    row_count = models.PositiveIntegerField(blank=True, null=True)
+    encoding = models.CharField(max_length=32, blank=True)
+    # delimiter and quote character as JSON
+    dialect = models.TextField(blank=True)
+
+    # the earlier upload of the same bytes - a duplicate is never labeled or
+    # analyzed itself (see views.SourceUploadView), so it goes with the original
+    duplicate_of = models.ForeignKey(
+        "self",
+        blank=True,
+        null=True,
+        on_delete=models.CASCADE,
+        related_name="duplicates",
+    )
+
+    # sha256 of the normalized header row, to find files with the same columns
+    header_fingerprint = models.CharField(max_length=64, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "lease_expires", "id"])]
+
     def __str__(self) -> str:
         return self.document.name
 
@@ -65,6 +105,7 @@ class Column(TimeStampedModel):
 
     # Descriptive stats as a JSON object (sqlite doesn't have JSONField)
     # analysis = JSONField(blank=True)
+    # see classifier.feature_store for the layout
     analysis = models.TextField(blank=True)
 
     @staticmethod
@@ -79,3 +120,37 @@ class Column(TimeStampedModel):
 
     def __str__(self) -> str:
         return f"{self.source.document.name[:10]} - Column {self.index}"
+
+
+class ProfileJob(TimeStampedModel):
+    """a queued profile of one Source's document (see classifier.profile_jobs)"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    source = models.OneToOneField(
+        "Source", on_delete=models.CASCADE, related_name="profile_job"
+    )
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+
+    # runs so far, and until when the current run holds the job
+    attempts = models.PositiveIntegerField(default=0)
+    lease_expires = models.DateTimeField(blank=True, null=True)
+
+    # traceback of the last failed run
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "lease_expires", "id"])]
+
+    def __str__(self) -> str:
+        return f"{self.source} - {self.status}"
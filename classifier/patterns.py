@@ -0,0 +1,86 @@
+"""Regular expression features, all evaluated by a single compiled expression"""
+import re
+from collections import Counter
+from typing import Dict, Iterable, Sequence, Tuple
+
+# cells are split on a pipe rather than whitespace because a lot of these values
+# (Canadian zips, phone numbers, unit designators) have spaces in them
+SEP = "|"
+
+# (feature name, pattern matching a whole token) - matching ignores case
+PATTERNS = (
+    ("frac_can_zip_patt", r"^\w\d\w *\d\w\d$"),
+    (
+        "frac_phone_patt",
+        r"^\s*(?:\+?1[\s.-]?)?\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4}"
+        r"(?:\s*(?:x|ext\.?)\s*\d+)?\s*$",
+    ),
+    ("frac_email_patt", r"^\s*[\w.+-]+@[\w-]+(?:\.[\w-]+)+\s*$"),
+    ("frac_zip4_patt", r"^\s*\d{5}-?\d{4}\s*$"),
+    # dash, dot or space separated digit groups: 123-456-789, 12-34-567-890-000...
+    # but not phone numbers (3-3-4, maybe after a 1) or dates with a 19xx/20xx year
+    # at either end, which the other features already account for
+    (
+        "frac_apn_patt",
+        r"^\s*(?!1?\d{3}[-. ]\d{3}[-. ]\d{4}\s*$)"
+        r"(?!(?:19|20)\d\d[-. ]\d\d?[-. ]\d\d?\s*$)"
+        r"(?!\d\d?[-. ]\d\d?[-. ](?:19|20)\d\d\s*$)"
+        r"\d{2,4}(?:[-. ]\d{1,5}){2,5}\s*$",
+    ),
+    (
+        "frac_unit_patt",
+        r"^\s*(?:#\s*\w+|(?:apt|apartment|unit|ste|suite|bldg|building|fl|floor|rm"
+        r"|room|lot|spc|space|trlr|trailer|dept)\.?\s*#?\s*[\w-]+)\s*$",
+    ),
+)
+
+
+class PatternMatcher:
+    """
+    every pattern folded into one expression of optional lookaheads at position 0
+
+    One match call per token tries each pattern and reports all of the ones that
+    match through their named groups - adding a pattern doesn't add a scan. Columns
+    repeat the same few values a lot, so count() matches each distinct token once.
+    """
+
+    def __init__(self, patterns: Sequence[Tuple[str, str]] = PATTERNS):
+        self.names = [name for name, _ in patterns]
+        self.regex = re.compile(
+            "".join(f"(?:(?=(?P<{name}>{raw})))?" for name, raw in patterns),
+            re.IGNORECASE,
+        )
+        # group numbers, in case a pattern brings capturing groups of its own
+        self.groups = [self.regex.groupindex[name] for name in self.names]
+
+    def mask(self, token: str) -> int:
+        """bit mask of the patterns matching a token"""
+        m = self.regex.match(token)
+        return sum(
+            1 << bit for bit, g in enumerate(self.groups) if m.group(g) is not None
+        )
+
+    def count(self, tokens: Iterable[str], weights: Iterable[int] = None) -> Counter:
+        """
+        tally the pattern masks of many tokens
+
+        `weights` counts each token that many times (ie. tokens of distinct values and
+        their number of occurrences).
+        """
+        if weights is None:
+            distinct = Counter(tokens)
+        else:
+            distinct = Counter()
+            for token, weight in zip(tokens, weights):
+                distinct[token] += int(weight)
+        masks = Counter()
+        for token, n in distinct.items():
+            masks[self.mask(token)] += n
+        return masks
+
+    def matches(self, masks: Counter) -> Dict[str, int]:
+        """number of tokens matched by each pattern, from a tally of masks"""
+        return {
+            name: sum(n for mask, n in masks.items() if mask & (1 << bit))
+            for bit, name in enumerate(self.names)
+        }
@@ -1,12 +1,35 @@
 """Small functions to clean up readability of the dataframe processing"""
+import functools
 import itertools
 import re
-from typing import Callable, List
+from typing import Callable, Iterator, List, Optional, Pattern, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
 
 
+def distinct_cells(rows: pd.Series) -> Tuple[List[str], Optional[np.ndarray]]:
+    """
+    a column's cells as strings, and how many times each one occurs
+
+    A categorical column (see utils.load_csv's compact mode) gives every distinct
+    value once with its count, without expanding back to an object array. Anything
+    else gives every cell, with None for the counts (ie. once each).
+    """
+    if not isinstance(getattr(rows, "dtype", None), pd.CategoricalDtype):
+        return [str(r) for r in rows], None
+    codes = rows.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(rows.cat.categories))
+    used = np.flatnonzero(counts)
+    cells = [str(c) for c in rows.cat.categories[used]]
+    counts = counts[used]
+    missing = int((codes < 0).sum())
+    if missing:
+        cells.append(str(np.nan))
+        counts = np.append(counts, missing)
+    return cells, counts
+
+
 def aggregate_rows(rows: pd.Series, sep: str = None) -> str:
     """aggregate all row contents as a string"""
     if sep is None:
@@ -26,13 +49,19 @@ def tokenize(s: str, sep: str = None) -> List[str]:
 
 def mean_token_count(rows: pd.Series, sep: str = None) -> float:
     """get the mean token count for each cell in a column"""
-    result = np.mean([len(tokenize(s, sep)) for s in rows])
+    cells, counts = distinct_cells(rows)
+    result = np.average([len(tokenize(s, sep)) for s in cells], weights=counts)
     return result
 
 
 def mean_token_length(rows: pd.Series, sep: str = None) -> float:
     """get the mean token length for each cell in a column"""
-    tokenized = [tokenize(s) for s in rows]
+    cells, counts = distinct_cells(rows)
+    tokenized = [tokenize(s) for s in cells]
+    if counts is not None:
+        n = sum(len(t) * c for t, c in zip(tokenized, counts))
+        chars = sum(sum(len(x) for x in t) * c for t, c in zip(tokenized, counts))
+        return chars / n if n else -1
     tokens = list(itertools.chain.from_iterable(tokenized))
     if not tokens:
         return -1
@@ -42,7 +71,12 @@ def mean_token_length(rows: pd.Series, sep: str = None) -> float:
 
 def avg_len(avg_fxn: Callable, rows: pd.Series) -> float:
     """compute the average line length according to a passed averaging function"""
-    return avg_fxn([len(str(s)) for s in rows])
+    cells, counts = distinct_cells(rows)
+    lengths = [len(s) for s in cells]
+    if counts is not None:
+        # a plain int array, however many rows
+        lengths = np.repeat(lengths, counts)
+    return avg_fxn(lengths)
 
 
 def extract_chars(item) -> set:
@@ -58,11 +92,14 @@ def extract_chars(item) -> set:
 
 def unq_char_count(rows: pd.Series) -> int:
     """count the number of unique characters across an entire column"""
-    return len(extract_chars(rows))
+    return len(extract_chars(distinct_cells(rows)[0]))
 
 
 def unq_token_count(rows: pd.Series, sep=None) -> int:
     """count the number of unique tokens across an entire column"""
+    if sep is None:
+        # distinct cells have the same distinct whitespace tokens
+        rows = distinct_cells(rows)[0]
     aggregated = aggregate_rows(rows, sep)
     tokens = tokenize(aggregated)
     return len(set(tokens))
@@ -98,7 +135,18 @@ def frac_fxn(fxn, rows, sep: str = "") -> float:
     4. Return that result
 
     Note: An empty column will produce a ZeroDivisionError - so let's just return -1
+
+    For a categorical column each distinct value is counted once and weighted
+    instead, which gives the same answer for counting functions like count_digits.
     """
+    cells, counts = distinct_cells(rows)
+    if counts is not None:
+        separators = max(int(counts.sum()) - 1, 0)
+        total = sum(len(c) * n for c, n in zip(cells, counts)) + len(sep) * separators
+        if not total:
+            return -1
+        found = sum(fxn(c) * n for c, n in zip(cells, counts))
+        return (found + fxn(sep) * separators) / total
     aggregated = aggregate_rows(rows, sep)
     fxn_result = fxn(aggregated)
     try:
@@ -108,8 +156,129 @@ def frac_fxn(fxn, rows, sep: str = "") -> float:
     return result
 
 
+# bit flags for the character class lookup table
+DIGIT, ALPHA, SPACE = 1, 2, 4
+
+_char_table = None
+
+
+def char_class_table() -> np.ndarray:
+    """build (once) the class flags of every Basic Multilingual Plane codepoint"""
+    global _char_table
+    if _char_table is None:
+        chars = [chr(i) for i in range(0x10000)]
+        table = np.zeros(0x10000, dtype=np.uint8)
+        table[[c.isdigit() for c in chars]] |= DIGIT
+        table[[c.isalpha() for c in chars]] |= ALPHA
+        table[[c.isspace() for c in chars]] |= SPACE
+        _char_table = table
+    return _char_table
+
+
+def char_flags(cp: int) -> int:
+    """class flags for a single codepoint (used outside the BMP lookup table)"""
+    c = chr(cp)
+    return DIGIT * c.isdigit() | ALPHA * c.isalpha() | SPACE * c.isspace()
+
+
+def indexed_codepoint_blocks(
+    cells: Sequence[str], block: int = 4096
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """codepoint_blocks along with the positions in `cells` of each block's rows"""
+    lengths = np.fromiter((len(c) for c in cells), dtype=np.int64, count=len(cells))
+    order = np.argsort(lengths, kind="stable")
+    for start in range(0, len(order), block):
+        idx = order[start : start + block]
+        arr = np.array([cells[i] for i in idx], dtype=np.str_)
+        yield idx, arr.view(np.uint32).reshape(len(idx), -1)
+
+
+def codepoint_blocks(cells: Sequence[str], block: int = 4096) -> Iterator[np.ndarray]:
+    """
+    yield zero-padded 2-D uint32 codepoint arrays for a column's cells
+
+    Cells are grouped by length before padding so one long cell can't blow up the
+    size of every row in its block. A 0 codepoint is always padding - count
+    characters with len() rather than from these arrays.
+    """
+    for _, cps in indexed_codepoint_blocks(cells, block):
+        yield cps
+
+
+def char_class_counts(
+    blocks: Iterator[np.ndarray], weights: Iterator[np.ndarray] = None
+) -> np.ndarray:
+    """
+    count digit, alpha and space codepoints across codepoint blocks in one sweep
+
+    `weights` are per-row counts for each block - each row is counted that often.
+    """
+    if weights is not None:
+        return _weighted_char_class_counts(blocks, weights)
+    table = char_class_table()
+    flag_counts = np.zeros(8, dtype=np.int64)
+    for cps in blocks:
+        bmp = cps < 0x10000
+        flag_counts += np.bincount(table[cps[bmp]], minlength=8)
+        for cp, n in zip(*np.unique(cps[~bmp], return_counts=True)):
+            flag_counts[char_flags(int(cp))] += n
+    # padding has no flags, so it only ever lands in flag_counts[0]
+    flags = np.arange(8)
+    return np.array([flag_counts[flags & f > 0].sum() for f in (DIGIT, ALPHA, SPACE)])
+
+
+def _weighted_char_class_counts(
+    blocks: Iterator[np.ndarray], weights: Iterator[np.ndarray]
+) -> np.ndarray:
+    table = char_class_table()
+    counts = np.zeros(3, dtype=np.int64)
+    for cps, w in zip(blocks, weights):
+        flags = np.zeros(cps.shape, dtype=np.uint8)
+        bmp = cps < 0x10000
+        flags[bmp] = table[cps[bmp]]
+        flags[~bmp] = [char_flags(int(cp)) for cp in cps[~bmp]]
+        for i, f in enumerate((DIGIT, ALPHA, SPACE)):
+            counts[i] += ((flags & f) > 0).sum(axis=1) @ w
+    return counts
+
+
+def frac_chars(rows: pd.Series) -> dict:
+    """
+    vectorized frac_fxn for all four character classes at once
+
+    Equivalent to frac_fxn with count_digits, count_letters, count_spaces and
+    count_other_text, but without building the aggregated string.
+    """
+    cells, counts = distinct_cells(rows)
+    if counts is None:
+        total = sum(len(c) for c in cells)
+        blocks, weights = codepoint_blocks(cells), None
+    else:
+        total = sum(len(c) * n for c, n in zip(cells, counts))
+        indexed = list(indexed_codepoint_blocks(cells))
+        blocks = [cps for _, cps in indexed]
+        weights = [counts[idx] for idx, _ in indexed]
+    if not total:
+        return {"digit": -1, "alpha": -1, "space": -1, "other": -1}
+    digits, letters, spaces = char_class_counts(blocks, weights)
+    return {
+        "digit": digits / total,
+        "alpha": letters / total,
+        "space": spaces / total,
+        "other": (total - digits - letters - spaces) / total,
+    }
+
+
 def frac_token(rows: pd.Series, asset: set, sep: str = None, left: int = None) -> float:
     """get the fraction of tokens that match a set of canonical tokens"""
+    cells, counts = distinct_cells(rows)
+    if counts is not None and sep is None:
+        total = match = 0
+        for cell, n in zip(cells, counts):
+            tokens = tokenize(cell)
+            total += len(tokens) * n
+            match += sum((t[:left] if left else t).lower() in asset for t in tokens) * n
+        return match / total if total else -1
     aggregated = aggregate_rows(rows, sep)
     tokens = tokenize(aggregated)
     if not tokens:  # guard against empty column
@@ -122,12 +291,34 @@ def frac_token(rows: pd.Series, asset: set, sep: str = None, left: int = None) -
     return match / len(tokens)
 
 
+@functools.lru_cache(maxsize=None)
+def compile_pattern(raw_string: str) -> Pattern:
+    """compile a case insensitive pattern once per process"""
+    return re.compile(raw_string, re.IGNORECASE)
+
+
 def frac_regex(
     rows: pd.Series, raw_string: str, sep: str = None, search: bool = False
 ) -> float:
-    """get the fraction of tokens that match a regular expression"""
-    pattern = re.compile(raw_string, re.IGNORECASE)
-    aggregated = aggregate_rows(rows, sep)
-    tokens = tokenize(aggregated, sep)
+    """
+    get the fraction of tokens that match a regular expression
+
+    Empty tokens (ie. blank cells split on a sep) aren't counted, so a column
+    without any text gives -1 like the character class fractions.
+    """
+    pattern = compile_pattern(raw_string)
     re_fxn = pattern.match if not search else pattern.search
+    cells, counts = distinct_cells(rows)
+    if counts is not None:
+        # joining on sep and splitting on it again is the same as splitting each cell
+        total = match = 0
+        for cell, n in zip(cells, counts):
+            tokens = [t for t in tokenize(cell, sep) if t]
+            total += len(tokens) * n
+            match += sum(bool(re_fxn(t)) for t in tokens) * n
+        return match / total if total else -1
+    aggregated = aggregate_rows(rows, sep)
+    tokens = [t for t in tokenize(aggregated, sep) if t]
+    if not tokens:  # guard against empty or blank column
+        return -1
     return sum([int(bool(re_fxn(t))) for t in tokens])/len(tokens)
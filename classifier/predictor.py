@@ -0,0 +1,165 @@
+"""
+Suggest column classifications from profiled features
+
+A multinomial logistic regression over the features in classifier.profiler, trained
+from the feature matrix store by `manage.py train_classifier`. Each class is a
+(main, sub) label pair, with ("", "") for rejected columns. Counts and lengths are
+log-scaled and every feature standardized, so one learning rate suits them all.
+"""
+import os
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from classifier.profiler import FEATURES, FRACTIONS
+
+# (main label, sub label, probability)
+Prediction = Tuple[str, str, float]
+
+
+def transform(X: np.ndarray, features: Sequence[str]) -> np.ndarray:
+    """log-scale the count and length features and zero anything missing"""
+    X = np.array(X, dtype=np.float64)
+    counts = [i for i, f in enumerate(features) if f not in FRACTIONS]
+    X[:, counts] = np.log1p(np.clip(X[:, counts], 0, None))
+    return np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+class ColumnModel:
+    """softmax regression from a (columns x features) matrix to label pairs"""
+
+    def __init__(
+        self,
+        features: Sequence[str],
+        classes: Sequence[Tuple[str, str]],
+        mean: np.ndarray,
+        scale: np.ndarray,
+        weights: np.ndarray,
+        bias: np.ndarray,
+    ):
+        self.features = list(features)
+        self.classes = [tuple(c) for c in classes]
+        self.mean = mean
+        self.scale = scale
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def fit(
+        cls,
+        X: np.ndarray,
+        y: Sequence[Tuple[str, str]],
+        features: Sequence[str] = FEATURES,
+        l2: float = 1e-3,
+        steps: int = 500,
+        learning_rate: float = 0.5,
+    ) -> "ColumnModel":
+        """full-batch gradient descent on the L2-regularized cross entropy"""
+        classes = sorted(set(map(tuple, y)))
+        target = np.array([classes.index(tuple(c)) for c in y])
+        X = transform(X, features)
+        mean = X.mean(axis=0)
+        scale = X.std(axis=0)
+        scale[scale == 0] = 1.0
+        X = (X - mean) / scale
+
+        onehot = np.eye(len(classes))[target]
+        weights = np.zeros((X.shape[1], len(classes)))
+        bias = np.zeros(len(classes))
+        for _ in range(steps):
+            error = _softmax(X @ weights + bias) - onehot
+            weights -= learning_rate * (X.T @ error / len(X) + l2 * weights)
+            bias -= learning_rate * error.mean(axis=0)
+        return cls(features, classes, mean, scale, weights, bias)
+
+    def probabilities(self, X: np.ndarray) -> np.ndarray:
+        """(columns x classes) probabilities for raw feature rows"""
+        X = (transform(X, self.features) - self.mean) / self.scale
+        return _softmax(X @ self.weights + self.bias)
+
+    def predict(self, X: np.ndarray) -> List[Prediction]:
+        """the most likely label pair of every row, in one vectorized call"""
+        if not len(X):
+            return []
+        probabilities = self.probabilities(X)
+        best = probabilities.argmax(axis=1)
+        return [
+            (*self.classes[b], float(probabilities[i, b])) for i, b in enumerate(best)
+        ]
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # swapped in whole, so a web process never loads half a model
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                features=np.array(self.features),
+                classes=np.array(self.classes, dtype=str).reshape(-1, 2),
+                mean=self.mean,
+                scale=self.scale,
+                weights=self.weights,
+                bias=self.bias,
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ColumnModel":
+        with np.load(path) as data:
+            return cls(
+                data["features"].tolist(),
+                [tuple(c) for c in data["classes"].tolist()],
+                data["mean"],
+                data["scale"],
+                data["weights"],
+                data["bias"],
+            )
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+_model: Optional[ColumnModel] = None
+_stamp: Optional[Tuple[int, int]] = None
+_lock = threading.Lock()
+
+
+def get_model() -> Optional[ColumnModel]:
+    """
+    the trained model at CLASSIFIER_MODEL_PATH, loaded once per process
+
+    It's loaded again only when the file changes (ie. after retraining), and None
+    until a model has been trained.
+    """
+    global _model, _stamp
+    try:
+        stat = os.stat(settings.CLASSIFIER_MODEL_PATH)
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    if stamp != _stamp:
+        with _lock:
+            if stamp != _stamp:
+                _model = ColumnModel.load(settings.CLASSIFIER_MODEL_PATH)
+                _stamp = stamp
+    return _model
+
+
+def predict_features(features: Sequence[dict]) -> List[Optional[Prediction]]:
+    """predictions for a CSV's columns from their feature dicts, None without a model"""
+    model = get_model()
+    if model is None:
+        return [None] * len(features)
+    X = np.array(
+        [
+            [np.nan if f.get(n) is None else f[n] for n in model.features]
+            for f in features
+        ],
+        dtype=np.float64,
+    ).reshape(len(features), len(model.features))
+    return model.predict(X)
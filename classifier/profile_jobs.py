@@ -0,0 +1,273 @@
+"""
+Profile uploaded Sources in the background, queued in the ProfileJob table
+
+Uploads that weren't profiled as they arrived (see classifier.uploads), or that
+have columns left over from it, add a ProfileJob per Source and start draining the
+queue on a small thread pool in the web process - no broker needed. The pool is the
+concurrency limit: CLASSIFIER_PROFILE_WORKERS jobs run at once and the rest wait
+their turn. Jobs are leased like Sources in classifier.work_queue, and the lease
+is renewed while a job runs, so only one left running by a process that died is
+picked up again. A failing job is retried after a growing delay, up to
+CLASSIFIER_PROFILE_ATTEMPTS times - once the pool runs out of jobs it sets a timer
+for the earliest retry, so that doesn't wait for the next upload.
+`manage.py profile_sources` drains the same queue from the command line - with
+CLASSIFIER_PROFILE_WORKERS = 0, profiling (CPU bound, so it holds the GIL) stays out
+of the web process altogether.
+"""
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from classifier.batch import Job, analyze_job
+from classifier.feature_store import is_current, load_payload
+from classifier.header_index import remaining_plan
+from classifier.models import ProfileJob, Source
+from classifier.row_index import RowIndex, index_source
+from classifier.utils import source_preview, store_analysis
+
+_pool: Optional[ThreadPoolExecutor] = None
+# when start() is next due to run by itself (see wake_for_retries), and its timer
+_wake: Optional[Tuple[datetime, threading.Timer]] = None
+_wake_lock = threading.Lock()
+
+
+def enqueue(sources: Iterable[Source]) -> List[ProfileJob]:
+    """queue a profile of each Source - except duplicates, which go with the original"""
+    return ProfileJob.objects.bulk_create(
+        ProfileJob(source=s) for s in sources if s.duplicate_of_id is None
+    )
+
+
+def needs_profile(source: Source) -> bool:
+    """
+    whether a Source has yet to be indexed, or has columns whose features weren't
+    stored for its current file and settings
+
+    (Features left out by the header index's first pass don't count - see
+    uploads.store_scans, which queues a job itself when some are still needed.)
+    """
+    if not source.row_index or not source.content_hash:
+        return True
+    payloads = [
+        load_payload(a) for a in source.column_set.values_list("analysis", flat=True)
+    ]
+    approximate = settings.CLASSIFIER_APPROXIMATE
+    return not payloads or not all(
+        is_current(p, source.content_hash, approximate) for p in payloads
+    )
+
+
+def enqueue_unprofiled() -> List[ProfileJob]:
+    """
+    queue a profile of every Source that never had one and still needs it - not
+    uploads profiled as they arrived, nor duplicates
+    """
+    return enqueue(
+        s
+        for s in Source.objects.filter(
+            profile_job__isnull=True, duplicate_of__isnull=True
+        )
+        if needs_profile(s)
+    )
+
+
+def _claimable(now) -> Q:
+    """
+    queued (and past any retry delay), or running under a lease that has run out
+    """
+    return Q(status__in=(ProfileJob.QUEUED, ProfileJob.RUNNING)) & (
+        Q(lease_expires__isnull=True) | Q(lease_expires__lte=now)
+    )
+
+
+def claim_job(attempts: int = 5) -> Optional[ProfileJob]:
+    """take the oldest claimable job, or None if there's nothing to do"""
+    for _ in range(attempts):
+        now = timezone.now()
+        candidate = (
+            ProfileJob.objects.filter(_claimable(now))
+            .order_by("id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if candidate is None:
+            return None
+        won = ProfileJob.objects.filter(_claimable(now), id=candidate).update(
+            status=ProfileJob.RUNNING,
+            attempts=F("attempts") + 1,
+            lease_expires=now
+            + timedelta(seconds=settings.CLASSIFIER_PROFILE_LEASE_SECONDS),
+        )
+        if won:
+            return ProfileJob.objects.select_related("source").get(id=candidate)
+    return None
+
+
+def renew_lease(job_id: int, stop: threading.Event) -> None:
+    """
+    keep extending a running job's lease until `stop` is set, so a long profile
+    isn't taken over by another worker while it's still going
+    """
+    lease = settings.CLASSIFIER_PROFILE_LEASE_SECONDS
+    while not stop.wait(lease / 3):
+        ProfileJob.objects.filter(id=job_id, status=ProfileJob.RUNNING).update(
+            lease_expires=timezone.now() + timedelta(seconds=lease)
+        )
+
+
+def _heartbeat(job_id: int, stop: threading.Event) -> None:
+    try:
+        renew_lease(job_id, stop)
+    finally:
+        # the thread's own connection
+        connection.close()
+
+
+def run_job(job: ProfileJob) -> None:
+    """
+    hash and profile a job's Source, store its preview, features and row index -
+    never raises
+    """
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(job.id, stop), name="profile-lease", daemon=True
+    )
+    heartbeat.start()
+    try:
+        _run_job(job)
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def _run_job(job: ProfileJob) -> None:
+    source = job.source
+    approximate = settings.CLASSIFIER_APPROXIMATE
+    stored = tuple(
+        load_payload(a)
+        for a in source.column_set.order_by("index").values_list("analysis", flat=True)
+    )
+    plan = None
+    index = RowIndex.for_source(source)
+    if (
+        stored
+        and index is not None
+        and all(is_current(p, source.content_hash, approximate) for p in stored)
+    ):
+        # the upload was profiled on the way in - only its misfits are left
+        plan = tuple(
+            remaining_plan(index.columns, [p.get("features", {}) for p in stored])
+        )
+    result = analyze_job(
+        Job(
+            source.id,
+            source.document.name,
+            None,
+            source.content_hash,
+            stored,
+            cascade=True,
+            plan=plan,
+        ),
+        approximate,
+    )
+    error = result.error
+    if not error:
+        try:
+            store_analysis(result, approximate)
+            source_preview(source)
+            if index is None:
+                # (uploads scanned on arrival, and earlier attempts, already have one)
+                index_source(source)
+        except Exception:
+            error = traceback.format_exc()
+    job.lease_expires = None
+    if not error:
+        job.status = ProfileJob.DONE
+    elif job.attempts < settings.CLASSIFIER_PROFILE_ATTEMPTS:
+        # back off before the retry: the retry delay, then twice that, ...
+        job.status = ProfileJob.QUEUED
+        delay = settings.CLASSIFIER_PROFILE_RETRY_SECONDS * 2 ** (job.attempts - 1)
+        job.lease_expires = timezone.now() + timedelta(seconds=delay)
+    else:
+        job.status = ProfileJob.FAILED
+    job.error = error
+    job.save()
+
+
+def drain() -> int:
+    """run jobs until the queue is empty, returning how many ran"""
+    ran = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            return ran
+        run_job(job)
+        ran += 1
+
+
+def wake_for_retries() -> Optional[datetime]:
+    """
+    set a timer to start() the pool when the earliest job waiting out its retry
+    delay is due, and return when that is - None if no job is waiting
+    """
+    global _wake
+    due = (
+        ProfileJob.objects.filter(
+            status=ProfileJob.QUEUED, lease_expires__gt=timezone.now()
+        )
+        .order_by("lease_expires")
+        .values_list("lease_expires", flat=True)
+        .first()
+    )
+    if due is None:
+        return None
+    with _wake_lock:
+        if _wake is not None and _wake[1].is_alive() and _wake[0] <= due:
+            # already due to wake up in time
+            return due
+        if _wake is not None:
+            _wake[1].cancel()
+        delay = max((due - timezone.now()).total_seconds(), 0)
+        timer = threading.Timer(delay, start, (1,))
+        timer.daemon = True
+        timer.start()
+        _wake = (due, timer)
+    return due
+
+
+def drain_worker(wake: bool = False) -> int:
+    """
+    drain() for a pool thread - errors are printed rather than lost in a Future.
+    With `wake`, the pool is started again for the retries left waiting.
+    """
+    try:
+        ran = drain()
+        if wake:
+            wake_for_retries()
+        return ran
+    except Exception:
+        # (the database went away or similar) - the lease returns the job to the queue
+        traceback.print_exc()
+        return 0
+    finally:
+        # each pool thread has its own connection - don't leave it open
+        connection.close()
+
+
+def start(jobs: int) -> None:
+    """drain the queue in the background with up to CLASSIFIER_PROFILE_WORKERS threads"""
+    global _pool
+    workers = settings.CLASSIFIER_PROFILE_WORKERS
+    if workers < 1 or jobs < 1:
+        return
+    if _pool is None:
+        _pool = ThreadPoolExecutor(workers, thread_name_prefix="profile")
+    for _ in range(min(jobs, workers)):
+        _pool.submit(drain_worker, True)
@@ -0,0 +1,701 @@
+"""Fused column profiling - walk each column once and feed every metric together"""
+import math
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from classifier.assets import AssetHolder
+from classifier.gazetteer import GazetteerMatcher
+from classifier.patterns import PATTERNS, SEP, PatternMatcher
+from classifier.pd_operations import (
+    char_class_counts,
+    distinct_cells,
+    indexed_codepoint_blocks,
+    tokenize,
+)
+from classifier.sketches import HyperLogLog, QuantileSketch
+
+assets = AssetHolder()
+
+# (feature name, AssetHolder attribute, left-most characters to compare)
+GAZETTEERS = (
+    ("frac_given", "given", None),
+    ("frac_surnames", "surnames", None),
+    ("frac_states", "states", None),
+    ("frac_canada", "canada", None),
+    ("frac_cities", "cities", None),
+    ("frac_counties", "counties", None),
+    ("frac_us_zip", "zipcodes", 5),
+    ("frac_fips", "fips", None),
+)
+
+# every feature in the order analyze_dataframe writes them
+FEATURES = (
+    "mean_token_count",
+    "mean_token_length",
+    "frac_digit",
+    "frac_alpha",
+    "frac_space",
+    "frac_other",
+    "mean_line_length",
+    "median_line_length",
+    "std_line_length",
+    "unq_char_count",
+    "unq_token_count",
+    *[g[0] for g in GAZETTEERS],
+    *[p[0] for p in PATTERNS],
+    "row_count",
+)
+
+# the features that are a fraction of characters or tokens (or -1 for empty columns)
+FRACTIONS = tuple(f for f in FEATURES if f.startswith("frac_"))
+
+
+_matcher = None
+
+
+def gazetteer_matcher() -> GazetteerMatcher:
+    """the matcher over every GAZETTEERS list, built on first use"""
+    global _matcher
+    if _matcher is None:
+        _matcher = GazetteerMatcher(
+            [(f, getattr(assets, a), left) for f, a, left in GAZETTEERS]
+        )
+    return _matcher
+
+
+class Chunk:
+    """
+    a batch of cells from one column, tokenized at most once for all accumulators
+
+    A categorical batch (see utils.load_csv's compact mode) holds each distinct value
+    once, with `weights` giving how many rows it stands for - accumulators count each
+    cell that many times. Otherwise `weights` is None and every cell is one row, and
+    `distinct` gives the distinct values and their counts for the accumulators that
+    cost the same for every occurrence of a value.
+    """
+
+    def __init__(self, rows: Iterable):
+        self.cells, self.weights = distinct_cells(rows)
+        self.rows = len(self.cells) if self.weights is None else int(self.weights.sum())
+        self._tokens = None
+        self._codepoints = None
+        self._block_rows = None
+        self._distinct = None
+        self._first_rows = None
+
+    @property
+    def tokens(self) -> List[List[str]]:
+        if self._tokens is None:
+            self._tokens = [tokenize(c) for c in self.cells]
+        return self._tokens
+
+    @property
+    def codepoints(self) -> List[np.ndarray]:
+        if self._codepoints is None:
+            self._decode()
+        return self._codepoints
+
+    def _decode(self) -> None:
+        blocks = list(indexed_codepoint_blocks(self.cells))
+        self._block_rows = [idx for idx, _ in blocks]
+        self._codepoints = [cps for _, cps in blocks]
+
+    @property
+    def block_weights(self) -> Optional[List[np.ndarray]]:
+        """the weights of each codepoints block's rows, or None if unweighted"""
+        if self.weights is None:
+            return None
+        if self._block_rows is None:
+            self._decode()
+        return [self.weights[idx] for idx in self._block_rows]
+
+    @property
+    def distinct(self) -> Tuple[List[str], np.ndarray]:
+        """each distinct cell once, and how many rows it stands for"""
+        if self.weights is not None:
+            return self.cells, self.weights
+        if self._distinct is None:
+            self._factorize()
+        return self._distinct
+
+    def _factorize(self) -> None:
+        codes, uniques = pd.factorize(np.asarray(self.cells, dtype=object))
+        self._distinct = (
+            uniques.tolist(),
+            np.bincount(codes, minlength=len(uniques)),
+        )
+        # codes are numbered in order of first appearance
+        self._first_rows = np.unique(codes, return_index=True)[1]
+
+    @property
+    def distinct_tokens(self) -> List[List[str]]:
+        """the tokens of each of the `distinct` cells"""
+        if self.weights is not None:
+            return self.tokens
+        if self._distinct is None:
+            self._factorize()
+        tokens = self.tokens
+        return [tokens[i] for i in self._first_rows]
+
+    def counts(self) -> List[int]:
+        """how many rows each cell stands for"""
+        if self.weights is None:
+            return [1] * len(self.cells)
+        return self.weights.tolist()
+
+
+class TimedChunk(Chunk):
+    """a Chunk that adds the time spent splitting its cells to `timings`"""
+
+    def __init__(self, rows: Iterable, timings: Dict[str, float]):
+        start = time.perf_counter()
+        super().__init__(rows)
+        self.timings = timings
+        timings["cells"] += time.perf_counter() - start
+
+    @property
+    def tokens(self) -> List[List[str]]:
+        if self._tokens is None:
+            start = time.perf_counter()
+            Chunk.tokens.fget(self)
+            self.timings["tokens"] += time.perf_counter() - start
+        return self._tokens
+
+    def _decode(self) -> None:
+        start = time.perf_counter()
+        super()._decode()
+        self.timings["codepoints"] += time.perf_counter() - start
+
+    def _factorize(self) -> None:
+        start = time.perf_counter()
+        super()._factorize()
+        self.timings["distinct"] += time.perf_counter() - start
+
+
+# the Chunk work shared by accumulators, timed on its own rather than charged to
+# whichever accumulator happens to ask first
+SHARED_TIMINGS = ("cells", "tokens", "codepoints", "distinct")
+
+
+class Accumulator:
+    """running state for a group of features that are computed together"""
+
+    features: Tuple[str, ...] = ()
+
+    # bump whenever the definition of these features changes, so stored values are
+    # recomputed by the next batch analysis
+    version: int = 1
+
+    def update(self, chunk: Chunk) -> None:
+        raise NotImplementedError
+
+    def merge(self, other: "Accumulator") -> None:
+        raise NotImplementedError
+
+    def finalize(self) -> Dict[str, float]:
+        raise NotImplementedError
+
+
+class TokenStats(Accumulator):
+    """mean token count per cell and mean token length"""
+
+    features = ("mean_token_count", "mean_token_length")
+
+    def __init__(self):
+        self.cells = 0
+        self.tokens = 0
+        self.token_chars = 0
+
+    def update(self, chunk: Chunk) -> None:
+        self.cells += chunk.rows
+        for tokens, n in zip(chunk.tokens, chunk.counts()):
+            self.tokens += len(tokens) * n
+            self.token_chars += sum(len(t) for t in tokens) * n
+
+    def merge(self, other: "TokenStats") -> None:
+        self.cells += other.cells
+        self.tokens += other.tokens
+        self.token_chars += other.token_chars
+
+    def finalize(self) -> Dict[str, float]:
+        return {
+            "mean_token_count": self.tokens / self.cells if self.cells else np.nan,
+            "mean_token_length": self.token_chars / self.tokens if self.tokens else -1,
+        }
+
+
+class CharClasses(Accumulator):
+    """fractions of digit, alpha, whitespace and other characters"""
+
+    features = ("frac_digit", "frac_alpha", "frac_space", "frac_other")
+
+    def __init__(self):
+        self.digits = 0
+        self.letters = 0
+        self.spaces = 0
+        self.total = 0
+
+    def update(self, chunk: Chunk) -> None:
+        self.total += sum(len(s) * n for s, n in zip(chunk.cells, chunk.counts()))
+        digits, letters, spaces = char_class_counts(
+            chunk.codepoints, chunk.block_weights
+        )
+        self.digits += int(digits)
+        self.letters += int(letters)
+        self.spaces += int(spaces)
+
+    def merge(self, other: "CharClasses") -> None:
+        self.digits += other.digits
+        self.letters += other.letters
+        self.spaces += other.spaces
+        self.total += other.total
+
+    def finalize(self) -> Dict[str, float]:
+        if not self.total:
+            return {f: -1 for f in self.features}
+        other = self.total - self.digits - self.letters - self.spaces
+        return {
+            "frac_digit": self.digits / self.total,
+            "frac_alpha": self.letters / self.total,
+            "frac_space": self.spaces / self.total,
+            "frac_other": other / self.total,
+        }
+
+
+class LineLengths(Accumulator):
+    """mean, median and standard deviation of cell lengths, kept as a histogram"""
+
+    features = ("mean_line_length", "median_line_length", "std_line_length")
+
+    def __init__(self):
+        self.lengths = Counter()
+
+    def update(self, chunk: Chunk) -> None:
+        if chunk.weights is None:
+            self.lengths.update(len(s) for s in chunk.cells)
+            return
+        for s, n in zip(chunk.cells, chunk.counts()):
+            self.lengths[len(s)] += n
+
+    def merge(self, other: "LineLengths") -> None:
+        self.lengths.update(other.lengths)
+
+    def finalize(self) -> Dict[str, float]:
+        if not self.lengths:
+            return {f: np.nan for f in self.features}
+        values = np.array(sorted(self.lengths), dtype=float)
+        counts = np.array([self.lengths[v] for v in sorted(self.lengths)])
+        n = counts.sum()
+        mean = (values * counts).sum() / n
+        # the median is the mean of the two middle values of the expanded list
+        cumulative = np.cumsum(counts)
+        lo = values[np.searchsorted(cumulative, (n - 1) // 2, side="right")]
+        hi = values[np.searchsorted(cumulative, n // 2, side="right")]
+        std = np.sqrt((counts * (values - mean) ** 2).sum() / n)
+        return {
+            "mean_line_length": mean,
+            "median_line_length": (lo + hi) / 2,
+            "std_line_length": std,
+        }
+
+
+class ApproxLineLengths(Accumulator):
+    """line length stats from running moments and a quantile sketch (approximate)"""
+
+    features = ("mean_line_length", "median_line_length", "std_line_length")
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.squares = 0
+        self.sketch = QuantileSketch()
+
+    def update(self, chunk: Chunk) -> None:
+        lengths = [len(s) for s in chunk.cells]
+        counts = chunk.counts()
+        self.n += chunk.rows
+        self.total += sum(x * n for x, n in zip(lengths, counts))
+        self.squares += sum(x * x * n for x, n in zip(lengths, counts))
+        self.sketch.update(lengths, chunk.weights)
+
+    def merge(self, other: "ApproxLineLengths") -> None:
+        self.n += other.n
+        self.total += other.total
+        self.squares += other.squares
+        self.sketch.merge(other.sketch)
+
+    def finalize(self) -> Dict[str, float]:
+        if not self.n:
+            return {f: np.nan for f in self.features}
+        mean = self.total / self.n
+        return {
+            "mean_line_length": mean,
+            "median_line_length": self.sketch.quantile(0.5),
+            "std_line_length": np.sqrt(max(self.squares / self.n - mean * mean, 0)),
+        }
+
+
+class UniqueChars(Accumulator):
+    """number of distinct characters in the column"""
+
+    features = ("unq_char_count",)
+
+    def __init__(self):
+        self.chars = set()
+        # codepoint 0 is padding in the codepoint arrays, so real NULs are tracked apart
+        self.nul = False
+
+    def update(self, chunk: Chunk) -> None:
+        for cps in chunk.codepoints:
+            self.chars.update(np.unique(cps).tolist())
+        self.chars.discard(0)
+        self.nul = self.nul or any("\x00" in s for s in chunk.cells)
+
+    def merge(self, other: "UniqueChars") -> None:
+        self.chars |= other.chars
+        self.nul = self.nul or other.nul
+
+    def finalize(self) -> Dict[str, float]:
+        return {"unq_char_count": len(self.chars) + self.nul}
+
+
+class UniqueTokens(Accumulator):
+    """number of distinct whitespace tokens in the column"""
+
+    features = ("unq_token_count",)
+
+    def __init__(self):
+        self.tokens = set()
+
+    def update(self, chunk: Chunk) -> None:
+        for tokens in chunk.tokens:
+            self.tokens.update(tokens)
+
+    def merge(self, other: "UniqueTokens") -> None:
+        self.tokens |= other.tokens
+
+    def finalize(self) -> Dict[str, float]:
+        return {"unq_token_count": len(self.tokens)}
+
+
+class ApproxUniqueTokens(Accumulator):
+    """HyperLogLog estimate of the distinct whitespace tokens (approximate mode)"""
+
+    features = ("unq_token_count",)
+
+    def __init__(self):
+        self.sketch = HyperLogLog()
+
+    def update(self, chunk: Chunk) -> None:
+        self.sketch.update(t for tokens in chunk.tokens for t in tokens)
+
+    def merge(self, other: "ApproxUniqueTokens") -> None:
+        self.sketch.merge(other.sketch)
+
+    def finalize(self) -> Dict[str, float]:
+        return {"unq_token_count": self.sketch.count()}
+
+
+class Gazetteers(Accumulator):
+    """fraction of tokens covered by an entry of each asset list, in one scan"""
+
+    features = tuple(g[0] for g in GAZETTEERS)
+    # 2: multi-word entries match, list entries are whitespace-normalized
+    version = 2
+
+    def __init__(self):
+        self.masks = Counter()
+        self.total = 0
+
+    def update(self, chunk: Chunk) -> None:
+        cells, counts = chunk.distinct
+        tokens = chunk.distinct_tokens
+        self.total += int(sum(len(t) * n for t, n in zip(tokens, counts)))
+        # every value occurring once needs no weights, and takes the quicker path
+        weights = None if len(cells) == chunk.rows else counts
+        self.masks.update(gazetteer_matcher().count(tokens, weights))
+
+    def merge(self, other: "Gazetteers") -> None:
+        self.masks.update(other.masks)
+        self.total += other.total
+
+    def finalize(self) -> Dict[str, float]:
+        if not self.total:
+            return {f: -1 for f in self.features}
+        matches = gazetteer_matcher().matches(self.masks)
+        return {f: matches[f] / self.total for f in self.features}
+
+
+class Patterns(Accumulator):
+    """fraction of pipe separated tokens that match each pattern, all in one scan"""
+
+    features = tuple(p[0] for p in PATTERNS)
+    # 2: empty columns give -1 like every other fraction, more patterns
+    # 3: empty tokens aren't counted, so blank columns give -1 too
+    # 4: apn no longer matches phone numbers and dates
+    version = 4
+    matcher = PatternMatcher(PATTERNS)
+
+    def __init__(self):
+        self.masks = Counter()
+        self.total = 0
+
+    def update(self, chunk: Chunk) -> None:
+        # cells are always strings here (see Chunk), so they're split directly. The
+        # matcher tallies distinct tokens itself (in C, for an unweighted chunk),
+        # which is quicker than going through Chunk.distinct first
+        if chunk.weights is None:
+            masks = self.matcher.count(
+                t for s in chunk.cells for t in s.split(SEP) if t
+            )
+        else:
+            split = [[t for t in s.split(SEP) if t] for s in chunk.cells]
+            masks = self.matcher.count(
+                (t for tokens in split for t in tokens),
+                (n for tokens, n in zip(split, chunk.counts()) for _ in tokens),
+            )
+        self.total += sum(masks.values())
+        self.masks.update(masks)
+
+    def merge(self, other: "Patterns") -> None:
+        self.masks.update(other.masks)
+        self.total += other.total
+
+    def finalize(self) -> Dict[str, float]:
+        if not self.total:
+            return {f: -1 for f in self.features}
+        matches = self.matcher.matches(self.masks)
+        return {f: matches[f] / self.total for f in self.features}
+
+
+class RowCount(Accumulator):
+    """number of rows in the column"""
+
+    features = ("row_count",)
+
+    def __init__(self):
+        self.rows = 0
+
+    def update(self, chunk: Chunk) -> None:
+        self.rows += chunk.rows
+
+    def merge(self, other: "RowCount") -> None:
+        self.rows += other.rows
+
+    def finalize(self) -> Dict[str, float]:
+        return {"row_count": self.rows}
+
+
+ACCUMULATORS = (
+    TokenStats,
+    CharClasses,
+    LineLengths,
+    UniqueChars,
+    UniqueTokens,
+    Gazetteers,
+    Patterns,
+    RowCount,
+)
+
+FEATURE_VERSIONS = {f: a.version for a in ACCUMULATORS for f in a.features}
+
+# bounded-memory stand-ins used in approximate mode. The distinct character set is
+# bounded by the alphabet, so unq_char_count always stays exact.
+APPROXIMATE = {LineLengths: ApproxLineLengths, UniqueTokens: ApproxUniqueTokens}
+
+
+class ColumnProfile:
+    """
+    every accumulator for one column, updated side by side from a single walk
+
+    With approximate=True the unique token count and line length median come from
+    sketches (see classifier.sketches) whose memory doesn't grow with the column.
+    """
+
+    def __init__(
+        self,
+        features: Sequence[str] = None,
+        approximate: bool = False,
+        timed: bool = False,
+    ):
+        self.features = tuple(f for f in FEATURES if features is None or f in features)
+        self.approximate = approximate
+        self.rows = 0
+        self.accumulators = [
+            APPROXIMATE.get(a, a)() if approximate else a()
+            for a in ACCUMULATORS
+            if set(a.features) & set(self.features)
+        ]
+        # seconds per accumulator class and SHARED_TIMINGS entry, when timed
+        self.timings = defaultdict(float) if timed else None
+
+    def update(self, rows: Iterable) -> None:
+        """feed a batch of cells to every accumulator"""
+        if not self.accumulators:
+            # nothing to compute (ie. a column skipped by a profile_cascade pass)
+            self.rows += len(rows)
+            return
+        if self.timings is not None:
+            return self._timed_update(rows)
+        chunk = Chunk(rows)
+        self.rows += chunk.rows
+        for accumulator in self.accumulators:
+            accumulator.update(chunk)
+
+    def _timed_update(self, rows: Iterable) -> None:
+        timings = self.timings
+        chunk = TimedChunk(rows, timings)
+        self.rows += chunk.rows
+        for accumulator in self.accumulators:
+            shared = sum(timings[k] for k in SHARED_TIMINGS[1:])
+            start = time.perf_counter()
+            accumulator.update(chunk)
+            elapsed = time.perf_counter() - start
+            # less any tokenizing, decoding or factorizing this accumulator set off
+            shared = sum(timings[k] for k in SHARED_TIMINGS[1:]) - shared
+            timings[type(accumulator).__name__] += elapsed - shared
+
+    def merge(self, other: "ColumnProfile") -> "ColumnProfile":
+        """fold another profile of the same column (ie. a later chunk) into this one"""
+        if other.approximate != self.approximate or other.features != self.features:
+            raise ValueError("can only merge profiles built with the same settings")
+        for mine, theirs in zip(self.accumulators, other.accumulators):
+            mine.merge(theirs)
+        self.rows += other.rows
+        if self.timings is not None and other.timings is not None:
+            for key, seconds in other.timings.items():
+                self.timings[key] += seconds
+        return self
+
+    def finalize(self) -> Dict[str, float]:
+        """compute the feature values from the accumulated state"""
+        results = {}
+        for accumulator in self.accumulators:
+            if self.timings is None:
+                results.update(accumulator.finalize())
+                continue
+            start = time.perf_counter()
+            results.update(accumulator.finalize())
+            self.timings[type(accumulator).__name__] += time.perf_counter() - start
+        return {f: results[f] for f in self.features}
+
+    def margins(self, z: float = 1.96) -> Dict[str, float]:
+        """
+        confidence interval half-widths of the fraction features seen so far
+
+        Agresti-Coull intervals, counting every row - not every character or token -
+        as one draw. Characters in a cell are far from independent, so this is the
+        conservative choice.
+        """
+        results = self.finalize()
+        margins = {}
+        for f in FRACTIONS:
+            if f not in results:
+                continue
+            n = self.rows + z * z
+            p = (max(results[f], 0) * self.rows + z * z / 2) / n
+            margins[f] = z * math.sqrt(p * (1 - p) / n)
+        return margins
+
+
+def profile_chunks(
+    chunks: Iterable[pd.DataFrame],
+    features: Sequence[str] = None,
+    approximate: bool = False,
+    timed: bool = False,
+    plan: Sequence[Sequence[str]] = None,
+) -> List[ColumnProfile]:
+    """
+    build one ColumnProfile per column from a stream of DataFrame chunks
+
+    Only one chunk is held at a time - memory is bounded by the chunk size plus the
+    accumulated state, which for everything but the unique sets is constant. `plan`
+    gives the features of each column instead of `features` for all of them.
+    """
+    profiles = None
+    for df in chunks:
+        if profiles is None:
+            plan = plan or [features] * len(df.columns)
+            profiles = [ColumnProfile(f, approximate, timed) for f in plan]
+        for profile, (_, rows) in zip(profiles, df.items()):
+            profile.update(rows)
+    return profiles or []
+
+
+def profile_dataframe(
+    df: pd.DataFrame,
+    features: Sequence[str] = None,
+    approximate: bool = False,
+    timed: bool = False,
+) -> List[ColumnProfile]:
+    """build one ColumnProfile per column of a DataFrame"""
+    return profile_chunks([df], features, approximate, timed)
+
+
+def feature_timings(profile: ColumnProfile) -> Dict[str, float]:
+    """
+    seconds per feature of a timed profile
+
+    The features of an accumulator come out of one pass over the column, so its
+    time is split evenly between the ones this profile computes. The shared Chunk
+    work (SHARED_TIMINGS) isn't charged to any feature.
+    """
+    timings = profile.timings or {}
+    seconds = {}
+    for accumulator in profile.accumulators:
+        features = [f for f in accumulator.features if f in profile.features]
+        share = timings.get(type(accumulator).__name__, 0.0) / len(features)
+        seconds.update((f, share) for f in features)
+    return seconds
+
+
+def timing_report(profiles: Sequence[ColumnProfile]) -> dict:
+    """
+    where the time went in a set of timed, finalized profiles - seconds per column,
+    per feature (see feature_timings) and per accumulator (with the features each
+    computes), and rows per second
+    """
+    accumulators = {}
+    features = defaultdict(float)
+    columns = []
+    for index, profile in enumerate(profiles):
+        timings = profile.timings or {}
+        seconds = sum(timings.values())
+        column_features = feature_timings(profile)
+        columns.append(
+            {
+                "index": index,
+                "rows": profile.rows,
+                "seconds": seconds,
+                "rows_per_second": profile.rows / seconds if seconds else None,
+                "timings": dict(timings),
+                "features": column_features,
+            }
+        )
+        for feature, feature_seconds in column_features.items():
+            features[feature] += feature_seconds
+        for accumulator in profile.accumulators:
+            name = type(accumulator).__name__
+            entry = accumulators.setdefault(
+                name, {"features": list(accumulator.features), "seconds": 0.0}
+            )
+            entry["seconds"] += timings.get(name, 0.0)
+    for name in SHARED_TIMINGS:
+        accumulators[name] = {
+            "features": [],
+            "seconds": sum((p.timings or {}).get(name, 0.0) for p in profiles),
+        }
+    rows = max((p.rows for p in profiles), default=0)
+    seconds = sum(c["seconds"] for c in columns)
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else None,
+        "columns": columns,
+        "features": dict(features),
+        "accumulators": accumulators,
+    }
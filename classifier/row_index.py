@@ -0,0 +1,340 @@
+"""
+Byte offsets of every row of an uploaded CSV, for reading any rows without parsing
+the file from the start
+
+    uploads/data.csv        the document
+    row_index/data.npy      int64 offsets: the header line, each data row, then EOF
+
+The offsets are found once per Source by index_source - a quote-aware scan, so a
+newline inside a quoted cell doesn't start a row - along with the file's encoding
+and CSV dialect (see detect_csv, which utils.load_csv reads files with as well).
+RowIndex memory-maps them, so a page, a sampler or each of several workers can seek
+straight to the rows it wants.
+"""
+import codecs
+import csv
+import io
+import json
+import tempfile
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+# bytes read at a time while scanning, and sniffed for the encoding and dialect
+BLOCK = 2**20
+SAMPLE = 2**16
+
+NEWLINE = ord("\n")
+CARRIAGE_RETURN = ord("\r")
+# what a line pandas skips as blank may hold, besides a delimiter among them
+BLANKS = b" \t\r\n"
+
+
+def detect_encoding(sample: bytes) -> str:
+    """utf-8 (with or without a BOM) if the sample decodes as such, else latin-1"""
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # the sample may end part way through a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return "latin-1"
+    return "utf-8"
+
+
+def detect_dialect(text: str) -> dict:
+    """
+    the delimiter of a CSV sample (a comma unless it's clearly something else)
+
+    The quote character is always a double quote, as for load_csv - guessing it
+    from a sample tends to pick the apostrophe in a name like O'Brien.
+    """
+    try:
+        delimiter = csv.Sniffer().sniff(text, delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimiter = ","
+    return {"delimiter": delimiter, "quotechar": '"'}
+
+
+def detect_csv(f) -> Tuple[dict, Optional[str]]:
+    """
+    the dialect and encoding of an open CSV, from its first SAMPLE bytes - the file
+    is rewound after. A text file is already decoded, so its encoding is None.
+    """
+    sample = f.read(SAMPLE)
+    f.seek(0)
+    if isinstance(sample, str):
+        return detect_dialect(sample), None
+    encoding = detect_encoding(sample)
+    return detect_dialect(sample.decode(encoding, "ignore")), encoding
+
+
+def read_options(dialect: dict, encoding: Optional[str]) -> dict:
+    """the pd.read_csv arguments for a CSV's dialect and encoding, with string cells"""
+    return {
+        "sep": dialect["delimiter"],
+        "quotechar": dialect["quotechar"],
+        "encoding": encoding,
+        "keep_default_na": False,
+    }
+
+
+class RowScanner:
+    """
+    the offset of every line of a file fed to it a block at a time
+
+    A newline only ends a line when it's outside quotes. As in pandas' parser, a
+    quote only opens a quoted cell as the first character of the cell - one in the
+    middle of a cell, like 5'10", is just a character. Blank lines - empty, or only
+    spaces and tabs (unless one is the delimiter) - are dropped, as pandas skips
+    them too.
+    """
+
+    def __init__(self, quotechar: str = '"', start: int = 0, delimiter: str = ","):
+        self.quote = ord(quotechar)
+        # the bytes a cell starts after
+        self.cell_starts = (ord(delimiter), NEWLINE, CARRIAGE_RETURN)
+        self.blank = np.zeros(256, dtype=bool)
+        self.blank[[b for b in BLANKS if b != ord(delimiter)]] = True
+        self.position = start
+        # where the line that hasn't ended yet starts, and whether it has anything
+        # but blanks so far
+        self.line_start = start
+        self.filled = False
+        self.quoted = 0
+        # the byte before the next block, and whether it was a quote closing a cell
+        self.last = NEWLINE
+        self.closed = False
+
+    def _toggles(self, arr: np.ndarray) -> np.ndarray:
+        """where in `arr` quoting starts or stops"""
+        quotes = np.flatnonzero(arr == self.quote)
+        if not len(quotes):
+            return quotes
+        # usually every quote toggles - each opening one then starts a cell, or is
+        # the second of a doubled quote in a quoted cell (right after a closing one)
+        opening = np.flatnonzero((np.arange(len(quotes)) + self.quoted) % 2 == 0)
+        opens = quotes[opening]
+        before = np.where(opens > 0, arr[opens - 1], self.last)
+        doubled = np.where(
+            opening > 0,
+            quotes[opening - 1] == opens - 1,
+            (opens == 0) & self.closed,
+        )
+        if (np.isin(before, self.cell_starts) | doubled).all():
+            return quotes
+        # otherwise a quote at a time
+        toggles, starts = [], set(self.cell_starts)
+        quoted, closed_at = self.quoted, -1 if self.closed else -2
+        for q in quotes.tolist():
+            if quoted:
+                quoted, closed_at = 0, q
+                toggles.append(q)
+            elif closed_at == q - 1 or (arr[q - 1] if q else self.last) in starts:
+                quoted = 1
+                toggles.append(q)
+        return np.array(toggles, dtype=np.int64)
+
+    def feed(self, data: bytes) -> np.ndarray:
+        """the offsets of the lines that end in `data`"""
+        if not data:
+            return np.empty(0, dtype=np.int64)
+        arr = np.frombuffer(data, dtype=np.uint8)
+        toggles = self._toggles(arr)
+        newlines = np.flatnonzero(arr == NEWLINE)
+        quoted = (np.searchsorted(toggles, newlines) + self.quoted) & 1
+        ends = newlines[quoted == 0] + self.position
+        self.quoted = (len(toggles) + self.quoted) & 1
+        self.closed = bool(
+            len(toggles) and toggles[-1] == len(arr) - 1 and not self.quoted
+        )
+        self.last = arr[-1]
+        starts = np.concatenate(([self.line_start], ends[:-1] + 1))[: len(ends)]
+        lo, hi = np.maximum(starts - self.position, 0), ends - self.position
+        # only a line that starts with a blank can be blank - look closer at those
+        blank = self.blank[arr[lo]]
+        if len(ends) and self.filled:
+            blank[0] = False
+        if blank.any():
+            filled = np.flatnonzero(~self.blank[arr])
+            blank &= np.searchsorted(filled, hi) == np.searchsorted(filled, lo)
+        if len(ends):
+            self.line_start = int(ends[-1]) + 1
+            self.filled = False
+        tail = arr[max(self.line_start - self.position, 0) :]
+        self.filled = self.filled or not self.blank[tail].all()
+        self.position += len(arr)
+        return starts[~blank]
+
+    def finish(self) -> np.ndarray:
+        """the offset of a last line without a newline, if any, then of the end"""
+        last = [self.line_start] if self.filled else []
+        return np.array(last + [self.position], dtype=np.int64)
+
+
+def scan_rows(
+    f, quotechar: str = '"', start: int = 0, delimiter: str = ","
+) -> np.ndarray:
+    """the offset of every line in an open binary file, and of its end"""
+    f.seek(start)
+    scanner = RowScanner(quotechar, start, delimiter)
+    offsets = []
+    while True:
+        data = f.read(BLOCK)
+        if not data:
+            break
+        offsets.append(scanner.feed(data))
+    offsets.append(scanner.finish())
+    return np.concatenate(offsets)
+
+
+def parse_rows(data: bytes, dialect: dict, encoding: str, **kwargs) -> pd.DataFrame:
+    """
+    whole CSV rows read from bytes, with the string cells of utils.load_csv
+    """
+    return pd.read_csv(
+        io.BytesIO(data), dtype=object, **read_options(dialect, encoding), **kwargs
+    )
+
+
+class RowIndex:
+    """
+    read rows of a document by number through its memory-mapped row offsets
+
+        index = RowIndex.for_source(source)
+        len(index)                  # data rows, not counting the header
+        index.read(1000, 2000)      # rows 1000-1999 as a DataFrame
+        index.take([5, 17, 4242])   # those rows, in that order
+
+    Frames have the same column names and string cells as utils.load_csv. Only the
+    storage names are pickled, so a RowIndex can be handed to worker processes.
+    """
+
+    def __init__(self, name: str, index_name: str, dialect: dict, encoding: str):
+        self.name = name
+        self.index_name = index_name
+        self.dialect = dialect
+        self.encoding = encoding
+        self._offsets = None
+        self._columns = None
+
+    @classmethod
+    def for_source(cls, source) -> Optional["RowIndex"]:
+        """the Source's index, or None if it hasn't been built yet"""
+        if not source.row_index:
+            return None
+        return cls(
+            source.document.name,
+            source.row_index.name,
+            json.loads(source.dialect),
+            source.encoding,
+        )
+
+    def __getstate__(self) -> dict:
+        return dict(self.__dict__, _offsets=None)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        if self._offsets is None:
+            try:
+                path = default_storage.path(self.index_name)
+            except NotImplementedError:
+                # storage without local files - read the whole index instead
+                with default_storage.open(self.index_name, "rb") as f:
+                    self._offsets = np.load(f)
+            else:
+                self._offsets = np.load(path, mmap_mode="r")
+        return self._offsets
+
+    def __len__(self) -> int:
+        return max(len(self.offsets) - 2, 0)
+
+    @property
+    def columns(self) -> List[str]:
+        if self._columns is None and len(self.offsets) < 2:
+            # an empty file
+            self._columns = []
+        if self._columns is None:
+            lo, hi = self.offsets[0], self.offsets[1]
+            header = self._parse(self._bytes(lo, hi), header=0, nrows=0)
+            self._columns = list(header.columns)
+        return self._columns
+
+    def byte_range(self, start: int, stop: int) -> Tuple[int, int]:
+        """where data rows start to stop (exclusive) lie in the document"""
+        start, stop = max(start, 0) + 1, min(stop, len(self)) + 1
+        return int(self.offsets[start]), int(self.offsets[max(start, stop)])
+
+    def _bytes(self, lo: int, hi: int) -> bytes:
+        with default_storage.open(self.name, "rb") as f:
+            f.seek(int(lo))
+            return f.read(int(hi - lo))
+
+    def _parse(self, data: bytes, **kwargs) -> pd.DataFrame:
+        if not data:
+            return pd.DataFrame(columns=self.columns, dtype=object)
+        return parse_rows(data, self.dialect, self.encoding, **kwargs)
+
+    def read(self, start: int, stop: int) -> pd.DataFrame:
+        """data rows start to stop (exclusive)"""
+        data = self._bytes(*self.byte_range(start, stop))
+        return self._parse(data, header=None, names=self.columns)
+
+    def take(self, rows: Sequence[int]) -> pd.DataFrame:
+        """the given data rows, read with one seek each"""
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.unique(rows)
+        lines = []
+        with default_storage.open(self.name, "rb") as f:
+            for row in order:
+                lo, hi = self.byte_range(int(row), int(row) + 1)
+                f.seek(lo)
+                line = f.read(hi - lo)
+                lines.append(line if line.endswith(b"\n") else line + b"\n")
+        df = self._parse(b"".join(lines), header=None, names=self.columns)
+        return df.iloc[np.searchsorted(order, rows)].reset_index(drop=True)
+
+    def ranges(self, parts: int) -> List[Tuple[int, int]]:
+        """split the data rows into `parts` contiguous (start, stop) ranges"""
+        bounds = np.linspace(0, len(self), max(parts, 1) + 1).astype(int)
+        return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def index_source(source) -> RowIndex:
+    """build and store a Source's row index, encoding and dialect"""
+    with source.document.open("rb") as f:
+        dialect, encoding = detect_csv(f)
+        offsets = scan_rows(
+            f, dialect["quotechar"], bom_length(encoding), dialect["delimiter"]
+        )
+    return save_row_index(source, offsets, dialect, encoding)
+
+
+def bom_length(encoding: str) -> int:
+    """bytes at the start of a file in `encoding` that come before the header"""
+    return len(codecs.BOM_UTF8) if encoding == "utf-8-sig" else 0
+
+
+def save_row_index(
+    source, offsets: np.ndarray, dialect: dict, encoding: str
+) -> RowIndex:
+    """store a Source's row offsets (see scan_rows), encoding and dialect"""
+    with tempfile.TemporaryFile() as tmp:
+        np.save(tmp, offsets)
+        tmp.seek(0)
+        source.row_index.save(
+            source.document.name.split("/")[-1] + ".npy", File(tmp), save=False
+        )
+    source.dialect = json.dumps(dialect)
+    source.encoding = encoding
+    source.row_count = max(len(offsets) - 2, 0)
+    type(source).objects.filter(id=source.id).update(
+        row_index=source.row_index.name,
+        dialect=source.dialect,
+        encoding=source.encoding,
+        row_count=source.row_count,
+    )
+    return RowIndex.for_source(source)
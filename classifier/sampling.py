@@ -0,0 +1,187 @@
+"""Profile a sample of a CSV's rows instead of all of them"""
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from django.core.files import File
+
+from classifier.profiler import ColumnProfile
+from classifier.row_index import RowIndex
+from classifier.utils import iter_csv, results_frame
+
+RESERVOIR = "reservoir"
+STRATIFIED = "stratified"
+
+# rows profiled between checks of whether the fractions have settled
+ADAPTIVE_BATCH = 1000
+
+
+def reservoir_sample(
+    document: File, size: int, seed: int = None, chunksize: int = None
+) -> Tuple[pd.DataFrame, int]:
+    """
+    a uniform sample of `size` rows from one streaming pass (Algorithm R)
+
+    Returns the sample and the number of rows in the file.
+    """
+    rng = np.random.default_rng(seed)
+    reservoir, columns, seen = None, None, 0
+    for chunk in iter_csv(document, chunksize):
+        values = chunk.to_numpy(dtype=object)
+        if reservoir is None:
+            columns = chunk.columns
+            reservoir = np.empty((size, len(columns)), dtype=object)
+        fill = max(min(size - seen, len(values)), 0)
+        reservoir[seen : seen + fill] = values[:fill]
+        # row i (0-based, file wide) replaces a random slot with probability size/(i+1)
+        positions = np.arange(seen + fill, seen + len(values))
+        slots = rng.integers(0, positions + 1)
+        keep = slots < size
+        # later rows win when two land in the same slot, as in the sequential algorithm
+        reservoir[slots[keep]] = values[fill:][keep]
+        seen += len(values)
+    if reservoir is None:
+        return pd.DataFrame(), 0
+    return pd.DataFrame(reservoir[: min(size, seen)], columns=columns), seen
+
+
+def indexed_sample(
+    index: RowIndex, size: int, seed: int = None
+) -> Tuple[pd.DataFrame, int]:
+    """
+    a uniform sample of `size` rows, read by seeking to each through a row index
+
+    Returns the sample and the number of rows in the file, like reservoir_sample -
+    but only the sampled rows are read.
+    """
+    rng = np.random.default_rng(seed)
+    rows = len(index)
+    picked = np.sort(rng.choice(rows, size=min(size, rows), replace=False))
+    return index.take(picked), rows
+
+
+def stratified_sample(
+    document: File, rate: float, seed: int = None, chunksize: int = None
+) -> Tuple[pd.DataFrame, int]:
+    """
+    the same fraction of rows from every chunk, so each part of the file is covered
+
+    Returns the sample and the number of rows in the file.
+    """
+    rng = np.random.default_rng(seed)
+    parts, seen = [], 0
+    for chunk in iter_csv(document, chunksize):
+        k = int(round(rate * len(chunk)))
+        picked = np.sort(rng.choice(len(chunk), size=k, replace=False))
+        parts.append(chunk.iloc[picked])
+        seen += len(chunk)
+    if not parts:
+        return pd.DataFrame(), 0
+    return pd.concat(parts, ignore_index=True), seen
+
+
+def analyze_sample(
+    document: File,
+    labels: Dict[str, List[str]],
+    method: str = RESERVOIR,
+    size: int = 10000,
+    rate: float = 0.1,
+    seed: int = None,
+    row_index: RowIndex = None,
+) -> pd.DataFrame:
+    """
+    analyze a reservoir sample of `size` rows or a stratified sample at `rate`
+
+    Given the document's row index, the reservoir sample is drawn without reading
+    the rest of the file (see indexed_sample).
+    """
+    if method == RESERVOIR and row_index is not None:
+        df, rows = indexed_sample(row_index, size, seed)
+    elif method == RESERVOIR:
+        df, rows = reservoir_sample(document, size, seed)
+    elif method == STRATIFIED:
+        df, rows = stratified_sample(document, rate, seed)
+    else:
+        raise ValueError(f"unknown sampling method {method!r}")
+    results = []
+    for _, column in df.items():
+        profile = ColumnProfile()
+        profile.update(column)
+        results.append(
+            dict(profile.finalize(), row_count=rows, sample_size=profile.rows)
+        )
+    return results_frame(results, labels)
+
+
+def profile_adaptive(
+    chunks: Iterable[pd.DataFrame],
+    tolerance: float = 0.02,
+    min_rows: int = 1000,
+    max_rows: int = None,
+    features: Sequence[str] = None,
+    approximate: bool = False,
+    timed: bool = False,
+    row_count: int = None,
+) -> Tuple[List[ColumnProfile], int]:
+    """
+    profile chunks until the fractions are settled, and count the rest of the rows
+
+    Profiling stops when every fraction feature of every column has a 95%
+    confidence interval half-width of at most `tolerance` (see
+    ColumnProfile.margins), after at least `min_rows` rows. The remaining chunks
+    are only counted - unless `row_count` (ie. the length of a row index) is given,
+    in which case they aren't read at all. Returns the profiles and the number of
+    rows in the file.
+    """
+    profiles = None
+    chunks = iter(chunks)
+    try:
+        for chunk in chunks:
+            if profiles is None:
+                profiles = [
+                    ColumnProfile(features, approximate, timed) for _ in chunk.columns
+                ]
+            for profile, (_, rows) in zip(profiles, chunk.items()):
+                profile.update(rows)
+            read = profiles[0].rows if profiles else 0
+            if max_rows is not None and read >= max_rows:
+                break
+            if read >= min_rows and all(
+                m <= tolerance for p in profiles for m in p.margins().values()
+            ):
+                break
+        read = profiles[0].rows if profiles else 0
+        if row_count is None:
+            row_count = read + sum(len(chunk) for chunk in chunks)
+    finally:
+        # stop the reader and close the file
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return profiles or [], row_count
+
+
+def analyze_adaptive(
+    document: File,
+    labels: Dict[str, List[str]],
+    tolerance: float = 0.02,
+    min_rows: int = 1000,
+    max_rows: int = None,
+    batch: int = ADAPTIVE_BATCH,
+    row_index: RowIndex = None,
+) -> pd.DataFrame:
+    """
+    profile rows in batches and stop profiling once the fractions are settled
+
+    See profile_adaptive - row_count is the number of rows in the file, and
+    sample_size the number profiled. Given the document's row index, the rows past
+    the sample aren't read at all.
+    """
+    profiles, rows = profile_adaptive(
+        iter_csv(document, batch),
+        tolerance,
+        min_rows,
+        max_rows,
+        row_count=None if row_index is None else len(row_index),
+    )
+    results = [dict(p.finalize(), row_count=rows, sample_size=p.rows) for p in profiles]
+    return results_frame(results, labels)
@@ -0,0 +1,9 @@
+"""Keep in-process caches in step with the database"""
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from classifier.models import Classification
+from classifier.tree import invalidate_tree
+
+post_save.connect(invalidate_tree, sender=Classification)
+post_delete.connect(invalidate_tree, sender=Classification)
+m2m_changed.connect(invalidate_tree, sender=Classification.subclasses.through)
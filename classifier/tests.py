@@ -1,3 +1,1299 @@
-from django.test import TestCase
+import codecs
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from classifier.apps import LOCAL_CACHES, check_shared_cache
+from classifier.assets import AssetHolder
+from classifier.batch import _profile_range
+from classifier.dedup import create_sources
+from classifier.feature_store import hash_chunks, load_payload, stale_features
+from classifier.gazetteer import GazetteerMatcher
+from classifier.header_index import (
+    CHEAP_FEATURES,
+    CHECKED_FEATURES,
+    HeaderIndex,
+    get_header_index,
+    normalize_header,
+    profile_cascade,
+    remaining_plan,
+)
+from classifier.predictor import ColumnModel, get_model
+from classifier.patterns import PATTERNS, SEP, PatternMatcher
+from classifier import profile_jobs
+from classifier.matrix_store import FeatureMatrix
+from classifier.models import Classification, Column, ProfileJob, Source
+from classifier.pd_operations import (
+    mean_token_count,
+    mean_token_length,
+    avg_len,
+    unq_char_count,
+    unq_token_count,
+    count_digits,
+    count_letters,
+    count_spaces,
+    count_other_text,
+    frac_fxn,
+    frac_token,
+    frac_regex,
+    frac_chars,
+)
+from classifier.profiler import (
+    FEATURES,
+    Chunk,
+    ColumnProfile,
+    assets,
+    profile_dataframe,
+)
+from classifier.row_index import RowIndex, RowScanner, index_source, scan_rows
+from classifier.sampling import (
+    analyze_adaptive,
+    analyze_sample,
+    indexed_sample,
+    reservoir_sample,
+    stratified_sample,
+)
+from classifier.sketches import HyperLogLog, QuantileSketch
+from classifier.tree import VERSION_KEY, classification_tree, invalidate_tree
+from classifier.uploads import UploadScan
+from classifier.utils import (
+    analyze_chunks,
+    analyze_dataframe,
+    batch_analysis,
+    load_all_labels,
+    load_labels,
+    iter_csv,
+    load_csv,
+    read_preview,
+)
+from classifier.work_queue import claim_source, invalidate_progress, progress
+
+SAMPLE = pd.DataFrame(
+    {
+        "first": ["Mary", "james", "PATRICIA ann", "", "José"],
+        "last": ["Smith", "Johnson", "o'brien", "Brown-Jones", "Ñúñez"],
+        "street": [
+            "636 Wilbur Court",
+            "12 Main St Apt 4",
+            "",
+            "1 Rock Island Rd",
+            "9½ Elm",
+        ],
+        "city": ["Gurnee", "Palmdale", "Wautoma", "Machiasport", "Colony"],
+        "state": ["IL", "ca", "New Mexico", "OH", "bc"],
+        "zip": ["60031", "00601-1234", "K1A 0B1", "h0h0h0", "12345"],
+        "phone": ["(555) 555-1234", "555.555.1234", "  ", "\t5551234", "n/a"],
+    }
+)
+
+
+def legacy_features(df: pd.DataFrame) -> pd.DataFrame:
+    """the one-pass-per-metric implementation the fused profiler replaces"""
+    _df = pd.DataFrame()
+    _df["mean_token_count"] = df.apply(mean_token_count).values
+    _df["mean_token_length"] = df.apply(mean_token_length).values
+    _df["frac_digit"] = df.apply(lambda rows: frac_fxn(count_digits, rows)).values
+    _df["frac_alpha"] = df.apply(lambda rows: frac_fxn(count_letters, rows)).values
+    _df["frac_space"] = df.apply(lambda rows: frac_fxn(count_spaces, rows)).values
+    _df["frac_other"] = df.apply(lambda rows: frac_fxn(count_other_text, rows)).values
+    _df["mean_line_length"] = df.apply(lambda rows: avg_len(np.mean, rows)).values
+    _df["median_line_length"] = df.apply(lambda rows: avg_len(np.median, rows)).values
+    _df["std_line_length"] = df.apply(lambda rows: avg_len(np.std, rows)).values
+    _df["unq_char_count"] = df.apply(unq_char_count).values
+    _df["unq_token_count"] = df.apply(unq_token_count).values
+    for feature, asset, left in (
+        ("frac_given", assets.given, None),
+        ("frac_surnames", assets.surnames, None),
+        ("frac_states", assets.states, None),
+        ("frac_canada", assets.canada, None),
+        ("frac_cities", assets.cities, None),
+        ("frac_counties", assets.counties, None),
+        ("frac_us_zip", assets.zipcodes, 5),
+        ("frac_fips", assets.fips, None),
+    ):
+        _df[feature] = df.apply(lambda rows: frac_token(rows, asset, left=left)).values
+    _df["frac_can_zip_patt"] = df.apply(
+        lambda rows: frac_regex(rows, r"^\w\d\w *\d\w\d$", sep="|")
+    ).values
+    _df["row_count"] = df.apply(lambda rows: len(rows)).values
+    return _df.transpose()
+
+
+MULTI_WORD_LISTS = (
+    "frac_states",
+    "frac_canada",
+    "frac_cities",
+    "frac_counties",
+    "frac_fips",
+)
+
+
+class AnalyzeDataFrameTest(SimpleTestCase):
+    def assertFramesMatch(self, expected: pd.DataFrame, actual: pd.DataFrame):
+        for feature in expected.index:
+            np.testing.assert_allclose(
+                actual.loc[feature].astype(float),
+                expected.loc[feature].astype(float),
+                err_msg=feature,
+            )
+
+    def test_fused_profiler_matches_legacy_metrics(self):
+        labels = {"main": [""] * 7, "sub": [""] * 7, "label": ["reject"] * 7}
+        result = analyze_dataframe(SAMPLE, labels)
+        self.assertEqual(
+            list(result.index), ["main", "sub", "label", *FEATURES, "sample_size"]
+        )
+        # lists with multi-word entries match more than frac_token could
+        legacy = legacy_features(SAMPLE)
+        unchanged = [f for f in legacy.index if f not in MULTI_WORD_LISTS]
+        self.assertFramesMatch(legacy.loc[unchanged], result.loc[unchanged])
+        self.assertEqual(result.loc["frac_states", 4], 1.0)
+
+    def test_timing_leaves_results_alone(self):
+        labels = {"main": [""] * 7, "sub": [""] * 7, "label": ["reject"] * 7}
+        with self.assertLogs("classifier.timing") as logs:
+            timed = analyze_dataframe(SAMPLE, labels, timed=True)
+        pd.testing.assert_frame_equal(timed, analyze_dataframe(SAMPLE, labels))
+        report = json.loads(logs.records[0].getMessage())
+        self.assertEqual(report["columns"][0]["rows"], len(SAMPLE))
+        self.assertIn("rss_delta_mb", report["memory"])
+
+    def test_single_row_and_blank_columns(self):
+        df = pd.DataFrame({"a": [""], "b": ["x"]})
+        labels = {"main": ["", ""], "sub": ["", ""], "label": ["reject", "reject"]}
+        result = analyze_dataframe(df, labels)
+        self.assertFramesMatch(legacy_features(df), result.loc[list(FEATURES)])
+
+    def test_chunked_analysis_matches_whole_file(self):
+        content = SAMPLE.to_csv(index=False)
+        labels = {"main": [""] * 7, "sub": [""] * 7, "label": ["reject"] * 7}
+        whole = analyze_dataframe(load_csv(File(io.StringIO(content))), labels)
+        chunks = iter_csv(File(io.StringIO(content)), chunksize=2)
+        chunked = analyze_chunks(chunks, labels)
+        self.assertFramesMatch(whole.loc[list(FEATURES)], chunked.loc[list(FEATURES)])
+
+    @override_settings(CLASSIFIER_CHUNKSIZE=12)
+    def test_compact_load_matches_object_columns(self):
+        repeated = pd.concat([SAMPLE] * 4, ignore_index=True)
+        repeated["unique"] = [f"row {i}" for i in range(len(repeated))]
+        content = repeated.to_csv(index=False)
+        df = load_csv(File(io.StringIO(content)))
+        compact = load_csv(File(io.StringIO(content)), compact=True)
+        self.assertEqual(
+            [isinstance(d, pd.CategoricalDtype) for d in compact.dtypes],
+            [True] * 7 + [False],
+        )
+        pd.testing.assert_frame_equal(compact.astype(object), df)
+        labels = {"main": [""] * 8, "sub": [""] * 8, "label": ["reject"] * 8}
+        self.assertFramesMatch(
+            analyze_dataframe(df, labels).loc[list(FEATURES)],
+            analyze_dataframe(compact, labels).loc[list(FEATURES)],
+        )
+        # and the one-metric-at-a-time operations read the categoricals directly
+        self.assertFramesMatch(legacy_features(df), legacy_features(compact))
+        # streamed chunks are parsed with the same dtypes, and come out the same
+        chunks = list(iter_csv(File(io.StringIO(content)), compact=True))
+        self.assertEqual(len(chunks), 2)
+        for chunk in chunks:
+            self.assertEqual(
+                [isinstance(d, pd.CategoricalDtype) for d in chunk.dtypes],
+                [True] * 7 + [False],
+            )
+        pd.testing.assert_frame_equal(
+            pd.concat(chunks, ignore_index=True).astype(object), df
+        )
+
+    def test_chunk_gives_each_distinct_value_once(self):
+        rows = pd.Series(["Gurnee IL", "60031", "Gurnee IL", "", "60031", "Gurnee IL"])
+        for chunk in (Chunk(rows), Chunk(rows.astype("category"))):
+            cells, counts = chunk.distinct
+            self.assertEqual(
+                dict(zip(cells, counts.tolist())),
+                {"Gurnee IL": 3, "60031": 2, "": 1},
+            )
+            self.assertEqual(
+                dict(zip(cells, chunk.distinct_tokens)),
+                {"Gurnee IL": ["Gurnee", "IL"], "60031": ["60031"], "": []},
+            )
+
+
+class GazetteerMatcherTest(SimpleTestCase):
+    def test_single_scan_covers_multi_word_and_prefix_entries(self):
+        matcher = GazetteerMatcher(
+            [
+                ("cities", ["rock island", "gurnee", "island park"], None),
+                ("states", ["il", "rhode island"], None),
+                ("zips", ["60031"], 5),
+                ("fips", ["01001 "], None),
+            ]
+        )
+        self.assertEqual(
+            matcher.cover(["Rock", "Island", "IL", "60031-1234", "01001"]),
+            [0b0001, 0b0001, 0b0010, 0b0100, 0b1000],
+        )
+        masks = matcher.count([["Rhode", "Island"], ["Island", "Park"], ["rock"]])
+        self.assertEqual(
+            matcher.matches(masks), {"cities": 2, "states": 2, "zips": 0, "fips": 0}
+        )
+
+
+class PatternMatcherTest(SimpleTestCase):
+    def test_one_scan_matches_each_pattern_like_frac_regex(self):
+        rows = pd.Series(
+            [
+                "(555) 555-1234",
+                "+1 555.555.1234 ext 12",
+                "jane.doe+tag@example.co.uk",
+                "60031-1234",
+                "123-456-789",
+                "Apt 4B",
+                "# 12",
+                "K1A 0B1|h0h 0h0",
+                "not a match",
+            ]
+        )
+        matcher = PatternMatcher()
+        masks = matcher.count(t for r in rows for t in r.split(SEP))
+        counts = matcher.matches(masks)
+        total = sum(masks.values())
+        for name, raw in PATTERNS:
+            self.assertEqual(counts[name] / total, frac_regex(rows, raw, sep=SEP), name)
+        self.assertEqual(counts["frac_unit_patt"], 2)
+        self.assertEqual(counts["frac_can_zip_patt"], 2)
+
+    def test_apn_leaves_phone_numbers_and_dates_alone(self):
+        matcher = PatternMatcher()
+        apn = 1 << matcher.names.index("frac_apn_patt")
+        for token in (
+            "123-456-789",
+            "5555-555-555",
+            "12-34-567-890-000",
+            "001.234.567",
+        ):
+            self.assertTrue(matcher.mask(token) & apn, token)
+        for token in (
+            "555-555-1234",
+            "555.555.1234",
+            "1555-555-1234",
+            "2020-01-15",
+            "01-15-2020",
+            "15.01.1999",
+        ):
+            self.assertFalse(matcher.mask(token) & apn, token)
+
+    def test_weighted_count_matches_each_distinct_token(self):
+        matcher = PatternMatcher()
+        tokens = ["60031-1234", "Apt 4B", "60031-1234", "Apt 4B", "Apt 4B", "x"]
+        self.assertEqual(
+            matcher.count(["60031-1234", "Apt 4B", "x"], [2, 3, 1]),
+            matcher.count(tokens),
+        )
+        self.assertEqual(sum(matcher.count(tokens).values()), len(tokens))
+
+    def test_empty_and_blank_columns(self):
+        for rows in ([], ["", ""]):
+            for sep in (None, SEP):
+                series = pd.Series(rows, dtype=object)
+                self.assertEqual(frac_regex(series, r"^\d+$", sep=sep), -1)
+            profile = ColumnProfile(features=["frac_email_patt", "frac_digit"])
+            profile.update(rows)
+            self.assertEqual(
+                profile.finalize(), {"frac_email_patt": -1, "frac_digit": -1}
+            )
+        self.assertEqual(frac_regex(pd.Series(["12||", ""]), r"^\d+$", sep=SEP), 1)
+
+
+class AssetHolderTest(SimpleTestCase):
+    def test_lists_load_lazily(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        with open(os.path.join(tmp, "states"), "w") as f:
+            f.write("oh\nil\n")
+        holder = AssetHolder(lists_dir=tmp)
+        self.assertNotIn("states", vars(holder))
+        self.assertEqual(holder.states, {"oh", "il"})
+        self.assertEqual(vars(holder)["states"], {"oh", "il"})
+        # only the list that was used has been read
+        self.assertNotIn("cities", vars(holder))
+        with self.assertRaises(AttributeError):
+            holder.not_a_list
+
+
+class SamplingTest(SimpleTestCase):
+    def document(self, rows: int) -> File:
+        df = pd.DataFrame(
+            {
+                "id": [str(i) for i in range(rows)],
+                "zip": ["60031" if i % 2 else "K1A 0B1" for i in range(rows)],
+            }
+        )
+        return File(io.StringIO(df.to_csv(index=False)))
+
+    def test_reservoir_sample(self):
+        sample, rows = reservoir_sample(self.document(5000), 300, seed=1, chunksize=700)
+        self.assertEqual(rows, 5000)
+        self.assertEqual(len(sample), 300)
+        self.assertEqual(sample["id"].nunique(), 300)
+        # rows from the whole file, not just the start
+        self.assertGreater(sample["id"].astype(int).max(), 4000)
+        small, rows = reservoir_sample(self.document(10), 300, chunksize=3)
+        self.assertEqual((len(small), rows), (10, 10))
+
+    def test_stratified_sample_covers_every_chunk(self):
+        sample, rows = stratified_sample(
+            self.document(5000), 0.1, seed=1, chunksize=1000
+        )
+        self.assertEqual((len(sample), rows), (500, 5000))
+        strata = (sample["id"].astype(int) // 1000).value_counts()
+        self.assertTrue((strata == 100).all())
+
+    def test_sampled_frame_records_sample_size_and_row_count(self):
+        labels = {"main": ["", ""], "sub": ["", ""], "label": ["reject", "reject"]}
+        result = analyze_sample(self.document(5000), labels, size=400, seed=1)
+        self.assertEqual(list(result.loc["row_count"]), [5000, 5000])
+        self.assertEqual(list(result.loc["sample_size"]), [400, 400])
+
+    def test_adaptive_stops_once_fractions_settle(self):
+        labels = {"main": ["", ""], "sub": ["", ""], "label": ["reject", "reject"]}
+        result = analyze_adaptive(
+            self.document(50000), labels, tolerance=0.05, min_rows=500, batch=500
+        )
+        self.assertLess(result.loc["sample_size", 1], 50000)
+        self.assertEqual(result.loc["row_count", 1], 50000)
+        self.assertAlmostEqual(result.loc["frac_can_zip_patt", 1], 0.5, delta=0.05)
+        self.assertAlmostEqual(result.loc["frac_us_zip", 1], 1 / 3, delta=0.05)
+
+
+class FracCharsTest(SimpleTestCase):
+    def test_matches_frac_fxn_on_non_ascii_text(self):
+        rows = pd.Series(
+            [
+                "Ωmega 12",
+                "١٢٣ arabic",
+                "\u3000wide\u00a0space",
+                "😀 x²",
+                "nul\x00",
+                "a" * 5000,
+                "",
+            ]
+        )
+        result = frac_chars(rows)
+        for key, fxn in (
+            ("digit", count_digits),
+            ("alpha", count_letters),
+            ("space", count_spaces),
+            ("other", count_other_text),
+        ):
+            self.assertAlmostEqual(result[key], frac_fxn(fxn, rows), msg=key)
+
+    def test_empty_column(self):
+        result = frac_chars(pd.Series([""]))
+        self.assertEqual(result, {"digit": -1, "alpha": -1, "space": -1, "other": -1})
+
+
+class SketchTest(SimpleTestCase):
+    def test_hyperloglog_error_and_merge(self):
+        left, right = HyperLogLog(), HyperLogLog()
+        left.update(str(i) for i in range(60000))
+        right.update(str(i) for i in range(40000, 100000))
+        left.merge(right)
+        # well within 5 standard errors of the 0.81% bound
+        self.assertAlmostEqual(left.count(), 100000, delta=100000 * 0.04)
+        small = HyperLogLog()
+        small.update(["a", "b", "a", "c"])
+        self.assertEqual(small.count(), 3)
+
+    def test_quantile_sketch_relative_error(self):
+        values = np.random.RandomState(0).randint(0, 500, 10001)
+        left, right = QuantileSketch(), QuantileSketch()
+        left.update(values[:5000])
+        right.update(values[5000:])
+        left.merge(right)
+        for q in (0.1, 0.5, 0.9):
+            exact = np.quantile(values, q, method="lower")
+            self.assertLessEqual(abs(left.quantile(q) - exact), exact * 0.01 + 1e-9)
+
+    def test_approximate_profile_merges_across_chunks(self):
+        exact, chunked = ColumnProfile(), ColumnProfile(approximate=True)
+        exact.update(SAMPLE["street"])
+        for i in range(len(SAMPLE)):
+            part = ColumnProfile(approximate=True)
+            part.update(SAMPLE["street"][i : i + 1])
+            chunked.merge(part)
+        expected, result = exact.finalize(), chunked.finalize()
+        self.assertEqual(result["unq_token_count"], expected["unq_token_count"])
+        self.assertAlmostEqual(result["std_line_length"], expected["std_line_length"])
+        self.assertAlmostEqual(
+            result["median_line_length"], expected["median_line_length"], delta=0.2
+        )
+
+
+class FeatureMatrixTest(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    @staticmethod
+    def labels(n: int) -> dict:
+        return {"main": ["m"] * n, "sub": [""] * n, "label": ["m"] * n}
+
+    def test_append_supersede_and_compact(self):
+        store = FeatureMatrix(self.tmp)
+        store.add(1, "a.csv", self.labels(2), [{"x": 1.0, "y": 2.0}, {"x": 3.0}])
+        store.add(2, "b.csv", self.labels(1), [{"x": 5.0, "y": 6.0}])
+        store.flush()
+        # source 1 again, with a feature the first block doesn't have
+        store.add(1, "a.csv", self.labels(1), [{"x": 7.0, "y": 8.0, "z": 9.0}])
+        store.flush()
+
+        reader = FeatureMatrix(self.tmp)
+        self.assertEqual(reader.features, ["x", "y", "z"])
+        frame = reader.frame(["z", "x"])
+        self.assertEqual(list(frame["source_id"]), [2, 1])
+        self.assertEqual(list(frame["x"]), [5.0, 7.0])
+        self.assertTrue(np.isnan(frame["z"][0]))
+        np.testing.assert_array_equal(reader.matrix(["y"]), [[6.0], [8.0]])
+
+        reader.compact()
+        self.assertEqual(len(os.listdir(self.tmp)), 2)
+        compacted = FeatureMatrix(self.tmp).frame()
+        pd.testing.assert_frame_equal(compacted, reader.frame())
+        self.assertEqual(list(compacted["name"]), ["b.csv", "a.csv"])
+
+    def test_relabel(self):
+        store = FeatureMatrix(self.tmp)
+        store.add(1, "a.csv", self.labels(2), [{"x": 1.0}, {"x": 2.0}])
+        store.add(2, "b.csv", self.labels(1), [{"x": 3.0}])
+        store.flush()
+        store.relabel({1: {"main": ["n"], "sub": ["s"], "label": ["ns"]}})
+        labels = FeatureMatrix(self.tmp).labels()
+        self.assertEqual(list(labels["main"]), ["n", "", ""])
+        self.assertEqual(list(labels["label"]), ["ns", "", ""])
+
+
+class MediaTestCase(TestCase):
+    """a TestCase with its own MEDIA_ROOT and working directory for analysis output"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        media = override_settings(MEDIA_ROOT=self.tmp)
+        media.enable()
+        self.addCleanup(media.disable)
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        self.addCleanup(os.chdir, cwd)
+
+    def make_source(self, name: str, content: str, classified: bool = True) -> Source:
+        source = Source(
+            time_classified=timezone.now() if classified else None,
+            status=Source.CLASSIFIED if classified else Source.PENDING,
+        )
+        source.document.save(name, ContentFile(content.encode("utf-8")))
+        columns = content.splitlines()[0].split(",")
+        for index in range(len(columns)):
+            Column.objects.create(source=source, index=index)
+        return source
+
+
+class BatchAnalysisTest(MediaTestCase):
+    def test_load_all_labels_in_one_query(self):
+        main = Classification.objects.create(label="test main", main=True)
+        sub = Classification.objects.create(label="test sub")
+        sources = [self.make_source(f"{i}.csv", "a,b,c\n1,2,3\n") for i in range(3)]
+        Column.objects.filter(source=sources[0], index=1).update(
+            main_class=main, sub_class=sub
+        )
+        Column.objects.filter(source=sources[1], index=0).update(main_class=main)
+        self.make_source("pending.csv", "a\n1\n", classified=False)
+        with self.assertNumQueries(1):
+            labels = load_all_labels()
+        self.assertEqual(set(labels), {s.id for s in sources})
+        for source in sources:
+            self.assertEqual(labels[source.id], load_labels(source))
+        self.assertEqual(
+            labels[sources[0].id]["label"], ["reject", "test maintest sub", "reject"]
+        )
+
+    def test_bad_source_does_not_stop_the_run(self):
+        self.make_source("good.csv", SAMPLE.to_csv(index=False))
+        self.make_source("bad.csv", "a,b\n1,2\n1,2,3,4\n")
+        for workers in (1, 2):
+            Column.objects.update(analysis="")
+            progress = []
+            results = batch_analysis(
+                workers=workers,
+                progress=lambda *a: progress.append(a),
+                write_json=True,
+            )
+            self.assertEqual(len(progress), 2)
+            by_name = {os.path.basename(r.name): r for r in results}
+            self.assertEqual(by_name["good.csv"].error, "")
+            self.assertEqual(by_name["good.csv"].rows, 5)
+            self.assertIn("ParserError", by_name["bad.csv"].error)
+            self.assertTrue(os.path.exists(os.path.join("analysis", "good.json")))
+            matrix = FeatureMatrix().frame(["row_count"])
+            self.assertEqual(list(matrix["row_count"]), [5.0] * len(SAMPLE.columns))
+
+    def test_adaptive_run_is_redone_in_full(self):
+        content = "zip\n" + "60031\n" * 5000
+        source = self.make_source("zips.csv", content)
+        result = batch_analysis(adaptive=True)[0]
+        self.assertTrue(result.sampled)
+        payload = load_payload(source.column_set.get().analysis)
+        self.assertTrue(payload["sampled"])
+        self.assertEqual(payload["features"]["row_count"], 5000)
+        # sampled features are current for another adaptive run, but not a full one
+        self.assertTrue(batch_analysis(adaptive=True)[0].skipped)
+        result = batch_analysis()[0]
+        self.assertFalse(result.skipped or result.sampled)
+        self.assertTrue(batch_analysis(adaptive=True)[0].skipped)
+
+    def test_timing_report(self):
+        self.make_source("good.csv", SAMPLE.to_csv(index=False))
+        result = batch_analysis(timed=True)[0]
+        with open(os.path.join("analysis", "good.timing.json")) as f:
+            report = json.load(f)
+        self.assertEqual(report, json.loads(json.dumps(result.timing)))
+        self.assertEqual(report["rows"], len(SAMPLE))
+        self.assertEqual(len(report["columns"]), len(SAMPLE.columns))
+        timed = set()
+        for entry in report["accumulators"].values():
+            timed.update(entry["features"])
+        self.assertEqual(timed, set(FEATURES))
+        self.assertIn("tokens", report["accumulators"])
+        # each feature's share of its accumulator adds back up to the accumulator
+        self.assertEqual(set(report["features"]), set(FEATURES))
+        gazetteers = report["accumulators"]["Gazetteers"]
+        self.assertAlmostEqual(
+            sum(report["features"][f] for f in gazetteers["features"]),
+            gazetteers["seconds"],
+        )
+        memory = report["memory"]
+        if memory["rss_start_mb"] is not None:
+            self.assertGreaterEqual(memory["rss_peak_mb"], memory["rss_start_mb"])
+
+    def test_reruns_only_compute_missing_or_stale_features(self):
+        source = self.make_source("good.csv", SAMPLE.to_csv(index=False))
+        first = batch_analysis()[0]
+        self.assertFalse(first.skipped)
+        source.refresh_from_db()
+        self.assertEqual(source.content_hash, first.content_hash)
+        column = source.column_set.get(index=2)
+        payload = load_payload(column.analysis)
+        self.assertEqual(payload["features"]["row_count"], 5)
+
+        self.assertTrue(batch_analysis()[0].skipped)
+
+        # a dropped feature is recomputed without touching the others
+        del payload["features"]["unq_token_count"]
+        payload["features"]["frac_digit"] = 0.5
+        column.analysis = json.dumps(payload)
+        column.save()
+        self.assertEqual(
+            stale_features([payload], source.content_hash, False), ("unq_token_count",)
+        )
+        second = batch_analysis()[0]
+        self.assertFalse(second.skipped)
+        self.assertEqual(
+            second.features[2]["unq_token_count"], first.features[2]["unq_token_count"]
+        )
+        self.assertEqual(second.features[2]["frac_digit"], 0.5)
+        # an unchanged source missing from the matrix store is added from Columns
+        shutil.rmtree(os.path.join("analysis", "matrix"))
+        self.assertTrue(batch_analysis()[0].skipped)
+        self.assertEqual(FeatureMatrix().frame(["frac_digit"])["frac_digit"][2], 0.5)
+
+    def test_unchanged_sources_are_relabelled_and_written(self):
+        source = self.make_source("good.csv", SAMPLE.to_csv(index=False))
+        batch_analysis()
+        self.assertEqual(FeatureMatrix().labels()["main"][0], "")
+        main = Classification.objects.create(label="test main", main=True)
+        source.column_set.filter(index=0).update(main_class=main)
+        self.assertTrue(batch_analysis(write_json=True)[0].skipped)
+        self.assertEqual(FeatureMatrix().labels()["main"][0], "test main")
+        with open(os.path.join("analysis", "good.json")) as f:
+            written = json.load(f)
+        self.assertEqual(written["0"]["main"], "test main")
+        self.assertEqual(written["0"]["row_count"], 5)
+
+
+class PreviewTest(MediaTestCase):
+    def upload(self, content: bytes):
+        upload = ContentFile(content, name="people.csv")
+        response = self.client.post(
+            reverse("classify:upload-files"), {"document": [upload]}
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_upload_is_profiled_as_it_arrives(self):
+        content = "name,city\n" + "".join(f'"Doe, J{i}",Gurnee\n' for i in range(50))
+        self.upload(content.encode("utf-8"))
+        # the upload handler did it all, there's nothing left to queue
+        self.assertFalse(ProfileJob.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "uploads")), ["people.csv"])
+        source = Source.objects.get()
+        self.assertEqual(len(source.content_hash), 64)
+        preview = json.loads(source.preview)
+        self.assertEqual(preview["headers"], ["name", "city"])
+        self.assertEqual(len(preview["rows"]), settings.CLASSIFIER_PREVIEW_ROWS)
+        self.assertEqual(preview["rows"][0], ["Doe, J0", "Gurnee"])
+        columns = source.column_set.order_by("index")
+        self.assertEqual(len(columns), 2)
+        features = load_payload(columns[1].analysis)["features"]
+        self.assertEqual(features["row_count"], 50)
+        self.assertEqual(features["unq_token_count"], 1)
+        self.assertEqual(source.row_count, 50)
+        self.assertEqual(
+            RowIndex.for_source(source).read(49, 50).iloc[0, 0], "Doe, J49"
+        )
+
+    def test_profile_sources_skips_uploads_profiled_on_arrival(self):
+        self.upload(b"name,city\nAnn,Gurnee\nBob,Wautoma\n")
+        older = self.make_source("old.csv", "name\nCy\n", classified=False)
+        self.assertEqual([j.source for j in profile_jobs.enqueue_unprofiled()], [older])
+        self.assertEqual(profile_jobs.drain(), 1)
+        # and now that it's profiled, the older one isn't queued again either
+        ProfileJob.objects.all().delete()
+        self.assertEqual(profile_jobs.enqueue_unprofiled(), [])
+
+    def test_unparseable_upload_queues_profile(self):
+        self.upload(b"a,b\n1,2\n" + b"1,2,3,4\n" * 10)
+        job = ProfileJob.objects.get()
+        self.assertEqual(job.status, ProfileJob.QUEUED)
+        self.assertEqual(profile_jobs.drain(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ProfileJob.QUEUED, 1))
+        self.assertIn("Error", job.error)
+        # the rest of the scan was still stored
+        source = Source.objects.get()
+        self.assertEqual(json.loads(source.preview)["headers"], ["a", "b"])
+        self.assertEqual(len(source.content_hash), 64)
+
+    def test_binary_upload_is_queued_not_an_error(self):
+        self.upload(
+            np.random.default_rng(0).integers(0, 256, 4096, dtype=np.uint8).tobytes()
+        )
+        self.assertEqual(ProfileJob.objects.get().status, ProfileJob.QUEUED)
+        self.assertEqual(Source.objects.get().preview, "")
+
+    def test_failing_profile_is_retried_then_given_up(self):
+        source = Source.objects.create(document="uploads/missing.csv")
+        profile_jobs.enqueue([source])
+        for attempt in range(1, settings.CLASSIFIER_PROFILE_ATTEMPTS + 1):
+            self.assertEqual(profile_jobs.drain(), 1)
+            job = ProfileJob.objects.get()
+            self.assertEqual(job.attempts, attempt)
+            self.assertIn("missing.csv", job.error)
+            # nothing to do until the retry delay is up
+            self.assertEqual(profile_jobs.drain(), 0)
+            ProfileJob.objects.update(lease_expires=timezone.now())
+        self.assertEqual(job.status, ProfileJob.FAILED)
+        self.assertEqual(profile_jobs.drain(), 0)
+
+    @override_settings(CLASSIFIER_PROFILE_LEASE_SECONDS=0.3)
+    def test_lease_is_renewed_while_job_runs(self):
+        source = Source.objects.create(document="uploads/slow.csv")
+        profile_jobs.enqueue([source])
+        job = profile_jobs.claim_job()
+        expires = job.lease_expires
+        stop = threading.Event()
+        threading.Timer(0.25, stop.set).start()
+        profile_jobs.renew_lease(job.id, stop)
+        job.refresh_from_db()
+        self.assertGreater(job.lease_expires, expires)
+        # nobody else can take it over meanwhile
+        self.assertIsNone(profile_jobs.claim_job())
+
+    def test_classify_page_backfills_preview_for_older_uploads(self):
+        source = self.make_source(
+            "old.csv", SAMPLE.to_csv(index=False), classified=False
+        )
+        self.assertEqual(source.preview, "")
+        response = self.client.get(reverse("classify:classify"))
+        self.assertEqual(response.context["headers"], list(SAMPLE.columns))
+        self.assertEqual(len(response.context["rows"]), len(SAMPLE))
+        source.refresh_from_db()
+        self.assertEqual(json.loads(source.preview)["headers"], list(SAMPLE.columns))
+
+
+class ProfilePoolTest(TransactionTestCase):
+    """the background pool itself, which needs its threads to see committed rows"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        media = override_settings(MEDIA_ROOT=self.tmp)
+        media.enable()
+        self.addCleanup(media.disable)
+        # don't hold read locks on the shared in-memory database the pool writes to
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA read_uncommitted = 1")
+
+    def wait_for(self, condition, timeout: float = 10):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "timed out")
+            time.sleep(0.05)
+
+    @override_settings(CLASSIFIER_PROFILE_WORKERS=1, CLASSIFIER_PROFILE_RETRY_SECONDS=1)
+    def test_failed_job_is_retried_without_another_upload(self):
+        source = Source.objects.create(document="uploads/late.csv")
+        profile_jobs.enqueue([source])
+        profile_jobs.start(1)
+        self.wait_for(lambda: ProfileJob.objects.get().attempts == 1)
+        self.wait_for(lambda: ProfileJob.objects.get().status == ProfileJob.QUEUED)
+        # the document turns up while the job waits out its retry delay
+        os.makedirs(os.path.join(self.tmp, "uploads"))
+        with open(os.path.join(self.tmp, "uploads", "late.csv"), "w") as f:
+            f.write(SAMPLE.to_csv(index=False))
+        self.wait_for(lambda: ProfileJob.objects.get().status == ProfileJob.DONE)
+        self.assertEqual(ProfileJob.objects.get().attempts, 2)
+        self.assertEqual(Column.objects.filter(source=source).count(), 7)
+
+
+class RowIndexTest(MediaTestCase):
+    CONTENT = (
+        "\ufeffname,note\r\n"
+        '"Doe, J","two\r\nlines"\r\n'
+        "\r\n"
+        'Roe,"a ""quoted"" word"\r\n'
+        "Poe,\r\n"
+        "Moe,last"
+    )
+
+    def test_quote_aware_offsets_and_random_access(self):
+        source = self.make_source("quoted.csv", self.CONTENT, classified=False)
+        index = index_source(source)
+        source.refresh_from_db()
+        self.assertEqual((source.row_count, source.encoding), (4, "utf-8-sig"))
+        self.assertEqual(json.loads(source.dialect)["delimiter"], ",")
+        expected = load_csv(File(io.StringIO(self.CONTENT.lstrip("\ufeff"))))
+        self.assertEqual(index.columns, list(expected.columns))
+        pd.testing.assert_frame_equal(index.read(0, 4), expected)
+        pd.testing.assert_frame_equal(
+            index.read(1, 3), expected.iloc[1:3].reset_index(drop=True)
+        )
+        pd.testing.assert_frame_equal(
+            index.take([3, 0, 3]), expected.iloc[[3, 0, 3]].reset_index(drop=True)
+        )
+        self.assertEqual(len(index.read(4, 10)), 0)
+
+    def test_rows_read_like_load_csv(self):
+        contents = {
+            # a delimiter the index and load_csv both have to detect
+            "semicolon.csv": "name;city\nDoe;Gurnee\nRoe;Colony\n",
+            # a quote that isn't at the start of a cell doesn't open one
+            "height.csv": 'name,height\nBob,5\'10"\nAl,6\nCy,5\nDi,"7\n"\n',
+            "quotes.csv": 'a,b\n"x""y",z"\n"p"q,"r\n"\n"",s\n"""t""",u\n',
+            # lines of only spaces and tabs are skipped like empty ones
+            "single.csv": " \nname\nann\n   \nbob\n \t\r\ncy\n  ",
+        }
+        for name, content in contents.items():
+            with self.subTest(name):
+                index = index_source(self.make_source(name, content))
+                expected = load_csv(File(io.StringIO(content)))
+                self.assertEqual(len(index), len(expected))
+                self.assertEqual(index.columns, list(expected.columns))
+                pd.testing.assert_frame_equal(index.read(0, len(index)), expected)
+                pd.testing.assert_frame_equal(index.take(range(len(index))), expected)
+                # and the same offsets come out however the file is split up
+                data = content.encode("utf-8")
+                scanner = RowScanner(start=0)
+                offsets = [scanner.feed(data[i : i + 1]) for i in range(len(data))]
+                np.testing.assert_array_equal(
+                    np.concatenate(offsets + [scanner.finish()]),
+                    index.offsets,
+                )
+        # unless the tab is the delimiter, then it's a row of empty cells
+        data = b"name\tcity\nDoe\tGurnee\n\t\n  \nRoe\tColony\n"
+        expected = pd.read_csv(io.BytesIO(data), sep="\t", keep_default_na=False)
+        offsets = scan_rows(io.BytesIO(data), delimiter="\t")
+        self.assertEqual(len(offsets) - 2, len(expected))
+
+    def test_ranges_profile_like_the_whole_file(self):
+        content = SAMPLE.to_csv(index=False)
+        index = index_source(self.make_source("sample.csv", content))
+        self.assertEqual(index.ranges(3), [(0, 1), (1, 3), (3, 5)])
+        parts = [
+            _profile_range(index, a, b, None, False, False) for a, b in index.ranges(3)
+        ]
+        for part in parts[1:]:
+            for profile, other in zip(parts[0], part):
+                profile.merge(other)
+        whole = [
+            p.finalize()
+            for p in profile_dataframe(load_csv(File(io.StringIO(content))))
+        ]
+        self.assertEqual([p.finalize() for p in parts[0]], whole)
+        # and a sample is drawn by seeking to the rows it picked
+        sample, rows = indexed_sample(index, 3, seed=0)
+        self.assertEqual((len(sample), rows), (3, len(SAMPLE)))
+        self.assertTrue(sample.isin(SAMPLE.to_dict("list")).all().all())
+
+
+class UploadScanTest(SimpleTestCase):
+    def test_chunked_scan_matches_reading_the_file(self):
+        df = pd.concat([SAMPLE] * 400, ignore_index=True)
+        df.loc[7, "street"] = "2 Elm\nSuite 4"
+        content = codecs.BOM_UTF8 + df.to_csv(index=False).encode("utf-8")
+        scan = UploadScan(block=4096)
+        for i in range(0, len(content), 1000):
+            scan.feed(content[i : i + 1000])
+        scan.finish()
+        f = io.BytesIO(content)
+        self.assertEqual(scan.content_hash, hash_chunks([content]))
+        self.assertEqual(scan.encoding, "utf-8-sig")
+        np.testing.assert_array_equal(scan.offsets, scan_rows(f, '"', 3))
+        self.assertEqual(scan.preview, read_preview(f))
+        expected = profile_dataframe(load_csv(File(io.BytesIO(content))))
+        for column, (features, profile) in enumerate(zip(scan.features, expected)):
+            for feature, value in profile.finalize().items():
+                self.assertAlmostEqual(features[feature], value, msg=(column, feature))
+
+    def test_small_and_empty_files(self):
+        for content, rows in ((b"a,b\n1,2", 1), (b"a,b\n", 0), (b"", None)):
+            scan = UploadScan()
+            scan.feed(content)
+            scan.finish()
+            self.assertEqual(scan.rows, rows or 0)
+            if rows is None:
+                self.assertIsNone(scan.features)
+            else:
+                self.assertEqual(scan.features[0]["row_count"], rows)
+
+    def scan(self, content: bytes, **kwargs) -> UploadScan:
+        scan = UploadScan(block=64, **kwargs)
+        for i in range(0, len(content), 10):
+            scan.feed(content[i : i + 10])
+        scan.finish()
+        return scan
+
+    def test_rows_read_like_load_csv(self):
+        for content in (
+            # a quote in the middle of a cell doesn't open one
+            b"name,height\nBob,5'10\"\nAl,6\nCy,5\nDi,7\n" * 3,
+            # and the preview is read in the detected dialect, like the rows
+            b"name;city\nDoe;Gurnee\nRoe;Colony\n",
+        ):
+            with self.subTest(content):
+                scan = self.scan(content)
+                expected = load_csv(File(io.BytesIO(content)))
+                self.assertEqual(scan.error, "")
+                self.assertEqual(scan.rows, len(expected))
+                self.assertEqual(scan.preview["headers"], list(expected.columns))
+                self.assertEqual(len(scan.features), len(expected.columns))
+                self.assertEqual(scan.features[0]["row_count"], len(expected))
+
+    def test_unreadable_uploads_are_left_to_a_profile_job(self):
+        # binary, and a quote that's never closed
+        rng = np.random.default_rng(0)
+        for content in (
+            rng.integers(0, 256, 4096, dtype=np.uint8).tobytes(),
+            b'a,b\n1,"' + b"x" * 4096,
+        ):
+            scan = self.scan(content, pending_limit=1024)
+            self.assertTrue(scan.error)
+            self.assertIsNone(scan.features)
+            self.assertFalse(scan.pending)
+
+
+class WorkQueueTest(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        invalidate_progress()
+        self.sources = [
+            self.make_source(f"{i}.csv", "a,b\n1,2\n", classified=False)
+            for i in range(3)
+        ]
+
+    def test_claimants_get_different_sources(self):
+        first, second = claim_source("a"), claim_source("b")
+        self.assertEqual(first, self.sources[0])
+        self.assertEqual(second, self.sources[1])
+        # holding a lease hands back the same source
+        self.assertEqual(claim_source("a"), first)
+
+    def test_expired_lease_is_reclaimed(self):
+        claim_source("a")
+        Source.objects.filter(id=self.sources[0].id).update(
+            lease_expires=timezone.now()
+        )
+        self.assertEqual(claim_source("b"), self.sources[0])
+
+    def test_classified_source_leaves_queue(self):
+        self.assertEqual(progress(), {"classified": 0, "total": 3})
+        response = self.client.get(reverse("classify:classify"))
+        source = response.context["source"]
+        self.assertEqual(source, self.sources[0])
+        self.client.post(
+            reverse("classify:classify"),
+            json.dumps({"sourceId": source.id}),
+            content_type="application/json",
+        )
+        source.refresh_from_db()
+        self.assertEqual(source.status, Source.CLASSIFIED)
+        self.assertEqual(source.claimed_by, "")
+        self.assertEqual(progress(), {"classified": 1, "total": 3})
+        self.assertEqual(
+            self.client.get(reverse("classify:classify")).context["source"],
+            self.sources[1],
+        )
+
+
+class ClassifySubmitTest(TestCase):
+    def setUp(self):
+        self.main = Classification.objects.create(label="test main", main=True)
+        self.sub = Classification.objects.create(label="test sub")
+
+    def claimed(self, document: str, claimant: str = "", seconds: int = 60) -> Source:
+        """a Source leased to `claimant`, the test client's session by default"""
+        return Source.objects.create(
+            document=document,
+            claimed_by=claimant or self.client.session.session_key,
+            lease_expires=timezone.now() + timedelta(seconds=seconds),
+        )
+
+    def post(self, source: Source, body: dict):
+        return self.client.post(
+            reverse("classify:classify"),
+            json.dumps({**body, "sourceId": source.id}),
+            content_type="application/json",
+        )
+
+    def submit(self, columns: int) -> int:
+        """classify a source with `columns` columns, returning the query count"""
+        source = self.claimed(f"{columns}.csv")
+        body = {i: {"main": str(self.main.id), "sub": ""} for i in range(columns)}
+        body[0]["sub"] = str(self.sub.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(source, body)
+        self.assertEqual(response.status_code, 200)
+        source.refresh_from_db()
+        self.assertEqual(source.status, Source.CLASSIFIED)
+        self.assertEqual(source.column_set.count(), columns)
+        self.assertEqual(source.column_set.get(index=0).sub_class, self.sub)
+        return len(queries)
+
+    def test_query_count_is_constant_up_to_a_batch(self):
+        # sqlite splits inserts into batches of 999 parameters (~140 columns), and
+        # each further batch is another query
+        self.assertEqual(self.submit(3), self.submit(120))
+        self.assertGreater(self.submit(300), self.submit(120))
+
+    def test_expired_lease_writes_nothing(self):
+        body = {0: {"main": str(self.main.id)}}
+        expired = self.claimed("expired.csv", seconds=-1)
+        stolen = self.claimed("stolen.csv", claimant="another labeler")
+        for source in (expired, stolen):
+            self.assertEqual(self.post(source, body).status_code, 409)
+            source.refresh_from_db()
+            self.assertEqual(source.status, Source.PENDING)
+            self.assertFalse(source.column_set.exists())
+        self.assertEqual(stolen.claimed_by, "another labeler")
+
+    def test_unknown_classification_writes_nothing(self):
+        source = self.claimed("bad.csv")
+        body = {0: {"main": str(self.main.id)}, 1: {"main": "999"}}
+        self.assertEqual(self.post(source, body).status_code, 400)
+        source.refresh_from_db()
+        self.assertEqual(source.status, Source.PENDING)
+        self.assertFalse(source.column_set.exists())
+
+
+class TreeTest(TestCase):
+    def setUp(self):
+        invalidate_tree()
+        self.main = Classification.objects.create(label="test main", main=True)
+        self.subs = [
+            Classification.objects.create(label=label) for label in ("zeta", "alpha")
+        ]
+        self.main.subclasses.add(*self.subs)
+
+    def test_tree_in_label_order(self):
+        response = self.client.get(reverse("classify:tree"))
+        tree = json.loads(response.content)
+        self.assertIn([self.main.id, "test main"], tree["mains"])
+        labels = [label for _, label in tree["mains"]]
+        self.assertEqual(labels, sorted(labels))
+        self.assertEqual(
+            tree["subs"][str(self.main.id)],
+            [[self.subs[1].id, "alpha"], [self.subs[0].id, "zeta"]],
+        )
+        self.assertIn("max-age", response["Cache-Control"])
+
+    def test_etag_and_invalidation(self):
+        etag = self.client.get(reverse("classify:tree"))["ETag"]
+        # just the shared version lookup (CACHES is the database), no rebuild
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse("classify:tree"), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        # editing the tree invalidates the cached copy and its ETag
+        self.main.subclasses.add(Classification.objects.create(label="beta"))
+        response = self.client.get(reverse("classify:tree"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(json.loads(response.content)["subs"][str(self.main.id)]), 3
+        )
+
+    def test_change_in_another_process_is_seen(self):
+        before = classification_tree()
+        # another process renames a main: its signal can't drop this process's copy,
+        # but it moves the shared version on
+        Classification.objects.filter(id=self.main.id).update(label="renamed")
+        self.assertIs(classification_tree(), before)
+        cache.set(VERSION_KEY, "from another process", None)
+        self.assertIn([self.main.id, "renamed"], classification_tree()["tree"]["mains"])
+
+    def test_cache_must_be_shared(self):
+        self.assertEqual(check_shared_cache(None), [])
+        local = {"default": {"BACKEND": LOCAL_CACHES[0]}}
+        with override_settings(CACHES=local):
+            self.assertEqual(
+                [e.id for e in check_shared_cache(None)], ["classifier.E001"]
+            )
+
+
+class PredictorTest(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.main = Classification.objects.create(label="test main", main=True)
+        self.sub = Classification.objects.create(label="test sub")
+        self.main.subclasses.add(self.sub)
+
+    def fit(self) -> ColumnModel:
+        """digits are the main/sub pair, anything else is rejected"""
+        rng = np.random.default_rng(0)
+        X = rng.random((200, len(FEATURES))) * 10
+        digits = FEATURES.index("frac_digit")
+        X[:, digits] = rng.random(200)
+        y = [("test main", "test sub") if d > 0.5 else ("", "") for d in X[:, digits]]
+        return ColumnModel.fit(X, y)
+
+    def test_fit_save_and_load(self):
+        model = self.fit()
+        X = np.full((2, len(FEATURES)), 5.0)
+        X[:, FEATURES.index("frac_digit")] = [0.95, 0.05]
+        predicted = model.predict(X)
+        self.assertEqual([p[:2] for p in predicted], [model.classes[1], ("", "")])
+        self.assertGreater(predicted[0][2], 0.5)
+
+        self.assertIsNone(get_model())
+        model.save(settings.CLASSIFIER_MODEL_PATH)
+        loaded = get_model()
+        self.assertIs(get_model(), loaded)
+        np.testing.assert_allclose(loaded.probabilities(X), model.probabilities(X))
+
+    def test_classify_page_suggests(self):
+        self.fit().save(settings.CLASSIFIER_MODEL_PATH)
+        source = self.make_source("s.csv", "id,name\n1,Mary\n22,Jo\n", False)
+        profile_jobs.enqueue([source])
+        profile_jobs.drain()
+        response = self.client.get(reverse("classify:classify"))
+        suggestions = response.context["suggestions"]
+        self.assertEqual(suggestions[0]["main"], self.main.id)
+        self.assertEqual(suggestions[0]["sub"], self.sub.id)
+        # rejects go to the blank main classification the page shows as "reject"
+        reject = Classification.objects.get(main=True, label="")
+        self.assertEqual(suggestions[1]["main"], reject.id)
+        self.assertContains(response, 'id="suggestions"')
+
+
+class DedupTest(MediaTestCase):
+    def upload(self, *contents: str):
+        files = [
+            ContentFile(c.encode("utf-8"), name=f"export{i}.csv")
+            for i, c in enumerate(contents)
+        ]
+        return self.client.post(reverse("classify:upload-files"), {"document": files})
+
+    def test_duplicates_are_linked_not_stored_or_queued(self):
+        content = SAMPLE.to_csv(index=False)
+        self.upload(content, content)
+        self.upload(content)
+        original = Source.objects.get(duplicate_of__isnull=True)
+        self.assertEqual(original.duplicates.count(), 2)
+        self.assertEqual(
+            {s.document.name for s in Source.objects.all()}, {original.document.name}
+        )
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "uploads")), ["export0.csv"])
+        # profiled as it was uploaded
+        self.assertFalse(ProfileJob.objects.exists())
+        self.assertEqual(
+            set(Column.objects.values_list("source", flat=True)), {original.id}
+        )
+        invalidate_progress()
+        self.assertEqual(progress(), {"classified": 0, "total": 1})
+        self.assertEqual(claim_source("a"), original)
+        self.assertIsNone(claim_source("b"))
+        # nor does profile_sources pick them up as never profiled
+        self.assertEqual(profile_jobs.enqueue_unprofiled(), [])
+        self.assertEqual(profile_jobs.enqueue(original.duplicates.all()), [])
+
+    def test_same_header_reuses_labels(self):
+        main = Classification.objects.create(label="test main", main=True)
+        sub = Classification.objects.create(label="test sub")
+        self.upload("Name,City\nMary,Gurnee\n")
+        labeled = Source.objects.get()
+        labeled.status = Source.CLASSIFIED
+        labeled.time_classified = timezone.now()
+        labeled.save()
+        labeled.column_set.filter(index=1).update(main_class=main, sub_class=sub)
+
+        self.upload(" name , city\nJo,Wautoma\n")
+        new = Source.objects.exclude(id=labeled.id).get()
+        self.assertIsNone(new.duplicate_of)
+        self.assertEqual(new.header_fingerprint, labeled.header_fingerprint)
+        profile_jobs.drain()
+        response = self.client.get(reverse("classify:classify"))
+        self.assertEqual(response.context["source"], new)
+        self.assertEqual(
+            response.context["suggestions"],
+            [None, {"main": main.id, "sub": sub.id, "reused": labeled.id}],
+        )
+
+    def test_unscanned_uploads_are_hashed_as_stored(self):
+        content = SAMPLE.to_csv(index=False).encode("utf-8")
+        files = [SimpleUploadedFile(f"plain{i}.csv", content) for i in range(2)]
+        created, duplicates = create_sources(files)
+        self.assertEqual(len(created), 1)
+        self.assertEqual(created[0].content_hash, hash_chunks([content]))
+        # the second copy was stored to hash it, then removed again
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "uploads")), ["plain0.csv"])
+        self.assertEqual(duplicates[0].duplicate_of, created[0])
+        # duplicates go with the original rather than outliving it
+        created[0].delete()
+        self.assertFalse(Source.objects.exists())
+
+
+class HeaderIndexTest(MediaTestCase):
+    def learn(self) -> HeaderIndex:
+        """ "city" is always one label and fits SAMPLE; "zip" is sure but never fits"""
+        city = profile_dataframe(SAMPLE[["city"]])[0].finalize()
+        far = {f: 100.0 for f in CHECKED_FEATURES}
+        return HeaderIndex.learn(
+            [("City", ("test main", "test sub"), city)] * 9
+            + [("zip", ("test main", "zip"), far)] * 9
+            + [("phone", ("test main", "phone"), None), ("Phone", ("", ""), None)]
+        )
+
+    def test_learn_match_and_fits(self):
+        index = self.learn()
+        self.assertEqual(normalize_header("ZipCode"), "zip code")
+        self.assertEqual(normalize_header(" zip_code "), "zip code")
+        self.assertEqual(index.match(" CITY"), ("test main", "test sub", 0.9))
+        self.assertIsNone(index.match("county"))
+        # a header seen with two labels is never confident
+        self.assertEqual(index.match("phone")[2], 1 / 3)
+        self.assertIsNone(index.confident("phone"))
+
+        city = profile_dataframe(SAMPLE[["city", "street"]])
+        self.assertTrue(index.fits(("test main", "test sub"), city[0].finalize()))
+        self.assertFalse(index.fits(("test main", "zip"), city[1].finalize()))
+        self.assertFalse(index.fits(("", ""), city[0].finalize()))
+
+        index.save(settings.CLASSIFIER_HEADER_INDEX_PATH)
+        loaded = get_header_index()
+        self.assertEqual(loaded.counts, index.counts)
+        self.assertEqual(loaded.ranges, index.ranges)
+
+    def test_cascade_profiles_only_what_headers_leave_open(self):
+        full = [p.finalize() for p in profile_dataframe(SAMPLE)]
+        reads = []
+
+        def read():
+            reads.append(1)
+            return [SAMPLE]
+
+        results, _ = profile_cascade(read, index=self.learn())
+        self.assertEqual(len(reads), 2)
+        city = list(SAMPLE.columns).index("city")
+        self.assertEqual(set(results[city]), set(CHEAP_FEATURES))
+        for f in CHEAP_FEATURES:
+            self.assertAlmostEqual(results[city][f], full[city][f])
+        # "zip" failed its check, the rest have no confident header
+        for i, column in enumerate(SAMPLE.columns):
+            if column != "city":
+                self.assertEqual(results[i], full[i])
+
+    def test_classify_page_suggests_confident_headers(self):
+        main = Classification.objects.create(label="test main", main=True)
+        sub = Classification.objects.create(label="test sub")
+        main.subclasses.add(sub)
+        self.learn().save(settings.CLASSIFIER_HEADER_INDEX_PATH)
+        source = self.make_source("s.csv", "id,city\n1,Palmdale\n2,Wautoma\n", False)
+        profile_jobs.enqueue([source])
+        profile_jobs.drain()
+        response = self.client.get(reverse("classify:classify"))
+        self.assertEqual(
+            response.context["suggestions"],
+            [
+                None,
+                {"main": main.id, "sub": sub.id, "probability": 0.9, "header": True},
+            ],
+        )
+        # the skipped features are filled in by the next batch analysis
+        source.refresh_from_db()
+        payloads = [load_payload(c.analysis) for c in source.column_set.all()]
+        self.assertIsNone(payloads[1]["features"]["frac_cities"])
+        self.assertEqual(
+            stale_features(payloads, source.content_hash, False),
+            tuple(f for f in FEATURES if f not in CHEAP_FEATURES),
+        )
+
+    def test_upload_profiles_only_misfits_later(self):
+        self.learn().save(settings.CLASSIFIER_HEADER_INDEX_PATH)
+        upload = ContentFile(SAMPLE.to_csv(index=False).encode("utf-8"), "s.csv")
+        self.client.post(reverse("classify:upload-files"), {"document": [upload]})
+        source = Source.objects.get()
+        full = [p.finalize() for p in profile_dataframe(SAMPLE)]
+        city = list(SAMPLE.columns).index("city")
+        zip_code = list(SAMPLE.columns).index("zip")
+
+        def stored():
+            return [
+                load_payload(c.analysis)["features"]
+                for c in source.column_set.order_by("index")
+            ]
+
+        # the confident headers only got the cheap features on the way in, and
+        # the file is queued for the one that didn't fit its label
+        self.assertIsNone(stored()[city]["frac_cities"])
+        self.assertIsNone(stored()[zip_code]["frac_us_zip"])
+        self.assertEqual(stored()[0]["frac_given"], full[0]["frac_given"])
+        self.assertEqual(ProfileJob.objects.get().status, ProfileJob.QUEUED)
+        plan = remaining_plan(SAMPLE.columns, stored())
+        self.assertEqual([bool(p) for p in plan], [i == zip_code for i in range(7)])
+        row_index = Source.objects.get().row_index.name
+        profile_jobs.drain()
+        self.assertEqual(ProfileJob.objects.get().status, ProfileJob.DONE)
+        # the scan's row index is kept, not built again next to it
+        self.assertEqual(Source.objects.get().row_index.name, row_index)
+        self.assertEqual(os.listdir(os.path.join(self.tmp, "row_index")), ["s.csv.npy"])
+        self.assertEqual(stored()[zip_code], full[zip_code])
+        self.assertIsNone(stored()[city]["frac_cities"])
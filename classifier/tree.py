@@ -0,0 +1,76 @@
+"""The main/sub Classification tree, built once per process and served as JSON"""
+import hashlib
+import json
+import uuid
+from typing import Optional
+
+from django.core.cache import cache
+
+from classifier.models import Classification
+
+# the cache key of the tree's current version - with a cache shared between
+# processes (CACHES), every process rebuilds its copy when this changes, not just
+# the one that saved the change
+VERSION_KEY = "classifier:tree-version"
+
+_tree: Optional[dict] = None
+
+
+def tree_version() -> str:
+    """the current version of the tree, as agreed through the cache"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # first use, or evicted - the first process to add one wins
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def classification_tree() -> dict:
+    """
+    every main Classification with its subclasses, both in label order
+
+        {"mains": [[id, label], ...], "subs": {main id: [[id, label], ...]}}
+
+    Lists rather than objects so the browser keeps the label order. Built with two
+    queries and kept until a Classification changes in any process (see
+    classifier.signals) - checking for that is one cache lookup.
+    """
+    global _tree
+    version = tree_version()
+    if _tree is None or _tree["version"] != version:
+        mains = list(
+            Classification.objects.filter(main=True)
+            .order_by("label")
+            .values_list("id", "label")
+        )
+        subs = {str(main_id): [] for main_id, _ in mains}
+        links = (
+            Classification.subclasses.through.objects.filter(
+                from_classification__main=True
+            )
+            .order_by("to_classification__label")
+            .values_list(
+                "from_classification_id",
+                "to_classification_id",
+                "to_classification__label",
+            )
+        )
+        for main_id, sub_id, label in links:
+            subs[str(main_id)].append([sub_id, label])
+        tree = {"mains": [list(m) for m in mains], "subs": subs}
+        body = json.dumps(tree)
+        _tree = {
+            "tree": tree,
+            "body": body,
+            "etag": hashlib.sha1(body.encode("utf-8")).hexdigest(),
+            "version": version,
+        }
+    return _tree
+
+
+def invalidate_tree(**kwargs) -> None:
+    """drop the cached tree everywhere - connected to Classification changes"""
+    global _tree
+    _tree = None
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
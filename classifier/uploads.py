@@ -0,0 +1,281 @@
+"""
+Scan uploads as they arrive, so their bytes are only read once
+
+StreamingUploadHandler (see FILE_UPLOAD_HANDLERS) writes each uploaded file to a
+temporary file next to the upload directory, so storing it as a Source's document
+is a rename rather than a copy. Each chunk is also fed to an UploadScan on its way
+past, which keeps
+
+    the sha256 of the file       (dedup.create_sources, without hashing it again)
+    its row offsets              (row_index.scan_rows, fed a chunk at a time)
+    its header and preview rows  (utils.read_preview of the first few rows)
+    a ColumnProfile per column   (the rows parsed a block at a time)
+
+The columns are profiled like header_index.profile_cascade's first pass: only the
+cheap features of those whose header the header index is confident about. The
+rows are parsed in the dialect and encoding detected from the first bytes, as
+utils.load_csv reads them later. store_scans saves all of that for the new
+Sources, so only those whose scan couldn't profile them (ie. a CSV pandas can't
+parse) or with columns that didn't fit their header's label still need a
+ProfileJob - which then profiles just those columns.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import traceback
+from typing import List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from classifier.batch import JobResult
+from classifier.feature_store import merge_features
+from classifier.header_index import first_pass, get_header_index, misfits
+from classifier.models import Source
+from classifier.profiler import ColumnProfile
+from classifier.row_index import (
+    BLOCK,
+    SAMPLE,
+    RowScanner,
+    bom_length,
+    detect_csv,
+    parse_rows,
+    save_row_index,
+)
+from classifier.utils import compact_frame, read_preview, store_analysis
+
+# bytes of rows parsed and profiled at a time - big enough for low-cardinality
+# columns to pay off as categoricals (see utils.compact_frame)
+PROFILE_BLOCK = 8 * BLOCK
+
+# bytes of rows that haven't ended yet (ie. after a quote that's never closed) held
+# for profiling or the preview before giving up on them
+PENDING_LIMIT = 8 * PROFILE_BLOCK
+
+
+class UploadScan:
+    """the hash, row offsets, preview and column profiles of a CSV fed in chunks"""
+
+    def __init__(
+        self,
+        approximate: bool = None,
+        preview_rows: int = None,
+        block: int = PROFILE_BLOCK,
+        pending_limit: int = PENDING_LIMIT,
+    ):
+        if approximate is None:
+            approximate = settings.CLASSIFIER_APPROXIMATE
+        if preview_rows is None:
+            preview_rows = settings.CLASSIFIER_PREVIEW_ROWS
+        self.approximate = approximate
+        self.preview_rows = preview_rows
+        self.block = block
+        self.pending_limit = pending_limit
+        self.digest = hashlib.sha256()
+        self.size = 0
+        # the first bytes, until there's enough to tell the encoding and dialect
+        self.sample = bytearray()
+        self.scanner: Optional[RowScanner] = None
+        self.encoding = self.dialect = None
+        self.offsets = []
+        self.lines = 0
+        # the start of the file, until it holds the preview rows
+        self.head = bytearray()
+        self.preview = None
+        # bytes since the last row that was profiled, and where they start
+        self.pending = bytearray()
+        self.pending_start = 0
+        self.columns = None
+        # the header index, and the label it's confident of for each column
+        self.index = self.labels = None
+        self.profiles: Optional[List[ColumnProfile]] = None
+        self.error = ""
+        # set by finish
+        self.content_hash = ""
+        self.features = None
+        # the columns whose cheap features didn't fit their header's label
+        self.misfits: List[int] = []
+
+    @property
+    def rows(self) -> int:
+        """data rows, not counting the header"""
+        return max(len(self.offsets) - 2, 0)
+
+    def feed(self, data: bytes) -> None:
+        self.digest.update(data)
+        self.size += len(data)
+        if self.head is not None:
+            self.head += data
+        if self.scanner is None:
+            self.sample += data
+            if len(self.sample) < SAMPLE:
+                return
+            data = self._start()
+        self._scan(data)
+
+    def _start(self) -> bytes:
+        """detect the encoding and dialect, and return the sample past any BOM"""
+        sample = bytes(self.sample)
+        self.sample = None
+        # from the same first bytes as for load_csv, so both read the same rows
+        self.dialect, self.encoding = detect_csv(io.BytesIO(sample))
+        start = bom_length(self.encoding)
+        self.scanner = RowScanner(
+            self.dialect["quotechar"], start, self.dialect["delimiter"]
+        )
+        self.pending_start = start
+        return sample[start:]
+
+    def _scan(self, data: bytes) -> None:
+        offsets = self.scanner.feed(data)
+        self.offsets.append(offsets)
+        self.lines += len(offsets)
+        if self.head is not None:
+            if self.lines > self.preview_rows + 1:
+                # the header and preview rows have all ended
+                end = np.concatenate(self.offsets)[self.preview_rows + 1]
+                self._preview(bytes(self.head[:end]))
+            elif len(self.head) > self.pending_limit:
+                # left to utils.source_preview
+                self.head = None
+        if self.error:
+            return
+        self.pending += data
+        if len(self.pending) >= self.block:
+            self._profile(self.scanner.line_start)
+        if len(self.pending) > self.pending_limit:
+            self._fail(f"a row is longer than {self.pending_limit} bytes")
+
+    def _fail(self, error: str) -> None:
+        """stop profiling, leaving the file to a ProfileJob"""
+        self.error = error
+        self.profiles = None
+        self.pending = bytearray()
+
+    def _preview(self, data: bytes) -> None:
+        try:
+            self.preview = read_preview(
+                io.BytesIO(data), self.preview_rows, self.dialect, self.encoding
+            )
+        except Exception:
+            self._fail(traceback.format_exc())
+        self.head = None
+
+    def _profile(self, end: int) -> None:
+        """feed the rows in the pending bytes before `end` to the column profiles"""
+        data = bytes(self.pending[: end - self.pending_start])
+        del self.pending[: end - self.pending_start]
+        self.pending_start = end
+        if self.error or not data.strip(b"\r\n"):
+            return
+        try:
+            if self.columns is None:
+                df = parse_rows(data, self.dialect, self.encoding, header=0)
+                self.columns = list(df.columns)
+                self.index = get_header_index()
+                self.labels, plan = first_pass(self.columns, index=self.index)
+                self.profiles = [ColumnProfile(f, self.approximate) for f in plan]
+            else:
+                df = parse_rows(
+                    data, self.dialect, self.encoding, header=None, names=self.columns
+                )
+            for profile, (_, rows) in zip(self.profiles, compact_frame(df).items()):
+                profile.update(rows)
+        except Exception:
+            self._fail(traceback.format_exc())
+
+    def finish(self) -> None:
+        """scan whatever's left once the whole file is in"""
+        if self.scanner is None:
+            # smaller than the sample
+            self._scan(self._start())
+        self.offsets = np.concatenate(self.offsets + [self.scanner.finish()])
+        self._profile(self.scanner.position)
+        if self.head is not None:
+            self._preview(bytes(self.head))
+        self.content_hash = self.digest.hexdigest()
+        if self.profiles is not None:
+            self.features = [p.finalize() for p in self.profiles]
+            self.misfits = misfits(self.index, self.labels, self.features)
+        self.profiles = None
+
+
+def upload_dir() -> Optional[str]:
+    """the upload directory, if the storage has one - else the usual temp dir"""
+    try:
+        path = default_storage.path(Source._meta.get_field("document").upload_to)
+    except NotImplementedError:
+        return settings.FILE_UPLOAD_TEMP_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class ScannedUploadedFile(TemporaryUploadedFile):
+    """a TemporaryUploadedFile in the upload directory, with the UploadScan of it"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix=".upload" + ext, dir=upload_dir())
+        UploadedFile.__init__(
+            self, file, name, content_type, size, charset, content_type_extra
+        )
+        self.scan = UploadScan()
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """write uploads to disk and scan them in the same pass"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = ScannedUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        self.file.scan.feed(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.scan.finish()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, "file"):
+            self.file.close()
+
+
+def store_scans(sources: List[Source], files: list) -> List[Source]:
+    """
+    store the row index and features scanned from each new Source's upload, and
+    return the Sources that still need profiling
+    """
+    scans = {
+        f.scan.content_hash: f.scan for f in files if isinstance(f, ScannedUploadedFile)
+    }
+    approximate = settings.CLASSIFIER_APPROXIMATE
+    unprofiled = []
+    for source in sources:
+        scan = scans.get(source.content_hash)
+        if scan is None or scan.features is None or scan.approximate != approximate:
+            unprofiled.append(source)
+            continue
+        save_row_index(source, scan.offsets, scan.dialect, scan.encoding)
+        store_analysis(
+            JobResult(
+                source.id,
+                source.document.name,
+                rows=scan.rows,
+                content_hash=scan.content_hash,
+                features=tuple(merge_features((), scan.features)),
+            ),
+            approximate,
+        )
+        if scan.misfits:
+            unprofiled.append(source)
+    return unprofiled
@@ -6,6 +6,7 @@ app_name = "classifier"
 
 urlpatterns = [
     path("", views.ClassifyView.as_view(), name="classify"),
+    path("tree/", views.TreeView.as_view(), name="tree"),
     path("load-subs/", views.LoadSubsView.as_view(), name="load-subs"),
     path("upload/", views.SourceUploadView.as_view(), name="upload-files"),
 ]
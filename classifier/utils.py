@@ -1,35 +1,146 @@
+import csv
+import itertools
+import json
+import logging
 import os
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 import numpy as np
 import pandas as pd
+from django.conf import settings
 from django.core.files import File
+from django.db import transaction
+from django.db.models import QuerySet
 
-from classifier.assets import AssetHolder
-from classifier.models import Source
-from classifier.pd_operations import (
-    mean_token_count,
-    mean_token_length,
-    avg_len,
-    unq_char_count,
-    unq_token_count,
-    count_digits,
-    count_letters,
-    count_spaces,
-    count_other_text,
-    frac_fxn,
-    frac_token,
-    frac_regex,
+from classifier.batch import Job, JobResult, MemorySampler, run_jobs
+from classifier.models import Column, Source
+from classifier.feature_store import (
+    column_payload,
+    load_payload,
+    merge_features,
+    stale_features,
 )
+from classifier.header_index import profile_cascade
+from classifier.matrix_store import FeatureMatrix
+from classifier.profiler import (
+    FEATURES,
+    assets,
+    profile_chunks,
+    profile_dataframe,
+    timing_report,
+)
+from classifier.row_index import RowIndex, detect_csv, read_options
+
+timing_log = logging.getLogger("classifier.timing")
+
+
+def load_csv(document: File, compact: bool = False) -> pd.DataFrame:
+    """
+    load a CSV from a Source.document field to a dataframe
+
+    The encoding and dialect are detected as for its row index (see
+    row_index.detect_csv), so both read the same rows. With compact=True
+    low-cardinality columns are parsed straight to categoricals (see
+    compact_dtypes), and the profiler and pd_operations read them without expanding
+    them back to strings. That makes profiling faster, not the frame smaller:
+    pandas' parser already shares one string between repeated cells, so a loaded
+    file's memory goes on its high-cardinality columns either way (see
+    benchmarks/load_memory). iter_csv is what keeps a large file's memory bounded.
+    """
+    with document.open("rb") as f:
+        options = read_options(*detect_csv(f))
+        dtype = compact_dtypes(f, options) if compact else object
+        return pd.read_csv(f, dtype=dtype, **options)
+
+
+def compact_dtypes(f, options: dict) -> Dict[int, object]:
+    """
+    the read_csv dtype of each column of an open CSV, by position - "category" for
+    those compact_frame converts in the first CLASSIFIER_CHUNKSIZE rows
+
+    Only those rows are parsed (with the read_csv `options`), and the file is
+    rewound to read it all with them.
+    """
+    head = pd.read_csv(f, dtype=object, nrows=settings.CLASSIFIER_CHUNKSIZE, **options)
+    f.seek(0)
+    # by position, as duplicate header names are renamed by read_csv
+    return {
+        i: "category" if isinstance(d, pd.CategoricalDtype) else object
+        for i, d in enumerate(compact_frame(head).dtypes)
+    }
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    convert a chunk's low-cardinality columns to categoricals
 
-assets = AssetHolder()
+    A column is converted when its distinct values are at most
+    CLASSIFIER_CATEGORY_RATIO of its rows.
+    """
+    ratio = settings.CLASSIFIER_CATEGORY_RATIO
+    columns = {}
+    for name, rows in df.items():
+        codes, uniques = pd.factorize(rows)
+        if len(rows) and len(uniques) <= ratio * len(rows):
+            rows = pd.Series(
+                pd.Categorical.from_codes(codes, uniques), index=rows.index, name=name
+            )
+        columns[name] = rows
+    return pd.DataFrame(columns, columns=df.columns)
 
 
-def load_csv(document: File) -> pd.DataFrame:
-    """load a CSV from a Source.document field to a dataframe"""
-    with document.open("r") as f:
-        df = pd.read_csv(f, keep_default_na=False, dtype=object)
-    return df
+def iter_csv(
+    document: File, chunksize: int = None, compact: bool = False
+) -> Iterator[pd.DataFrame]:
+    """
+    read a CSV from a Source.document field as DataFrames of `chunksize` rows
+
+    With compact=True the same columns of every chunk are parsed straight to
+    categoricals (see compact_dtypes).
+    """
+    if chunksize is None:
+        chunksize = settings.CLASSIFIER_CHUNKSIZE
+    with document.open("rb") as f:
+        options = read_options(*detect_csv(f))
+        dtype = compact_dtypes(f, options) if compact else object
+        yield from pd.read_csv(f, dtype=dtype, chunksize=chunksize, **options)
+
+
+def read_preview(
+    f: File, rows: int = None, dialect: dict = None, encoding: str = None
+) -> Dict[str, list]:
+    """
+    read the header and first `rows` rows from an open binary CSV file
+
+    The dialect and encoding are detected as for load_csv unless they're given.
+    Reading stops as soon as those rows are parsed, and the file is rewound so it
+    can still be saved (for uploads) or read again.
+    """
+    if rows is None:
+        rows = settings.CLASSIFIER_PREVIEW_ROWS
+    f.seek(0)
+    if dialect is None:
+        dialect, encoding = detect_csv(f)
+    # (utf-8-sig drops the BOM from the first line)
+    lines = (line.decode(encoding or "utf-8", "replace") for line in f)
+    reader = csv.reader(
+        lines, delimiter=dialect["delimiter"], quotechar=dialect["quotechar"]
+    )
+    headers = next(reader, [])
+    preview = {"headers": headers, "rows": list(itertools.islice(reader, rows))}
+    f.seek(0)
+    return preview
+
+
+def source_preview(source: Source) -> Dict[str, list]:
+    """a Source's stored preview, extracted (and stored) now for older uploads"""
+    if source.preview:
+        return json.loads(source.preview)
+    with source.document.open("rb") as f:
+        preview = read_preview(f)
+    source.preview = json.dumps(preview)
+    Source.objects.filter(id=source.id).update(preview=source.preview)
+    return preview
 
 
 def label_or_reject(label_set: Tuple[str, str]) -> str:
@@ -39,14 +150,44 @@ def label_or_reject(label_set: Tuple[str, str]) -> str:
 
 def load_labels(source: Source) -> Dict[str, List[str]]:
     """make the list of labels, where Column index maps to the position in each list"""
-    labels = [c.labels for c in source.column_set.all()]
-    main, sub = zip(*labels)
-    labels = {"main": main, "sub": sub, "label": [label_or_reject(x) for x in labels]}
-    return labels
+    columns = source.column_set.select_related("main_class", "sub_class")
+    return _labels_dict([c.labels for c in columns.order_by("index")])
+
+
+def _labels_dict(labels: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+    main, sub = zip(*labels) if labels else ((), ())
+    return {"main": main, "sub": sub, "label": [label_or_reject(x) for x in labels]}
+
 
+def classified_columns() -> QuerySet:
+    """Columns of every classified Source with a document, by source then index"""
+    return Column.objects.filter(
+        source__document__isnull=False, source__time_classified__isnull=False
+    ).order_by("source_id", "index")
 
-def analyze_dataframe(df: pd.DataFrame, labels: Dict[str, List[str]]) -> pd.DataFrame:
-    """analyze all columns in a DataFrame and return a DataFrame of results"""
+
+def load_all_labels() -> Dict[int, Dict[str, List[str]]]:
+    """
+    load_labels for every classified Source, keyed by Source id
+
+    One joined query, streamed from the database cursor, instead of a query per
+    source plus two per column for the classifications.
+    """
+    rows = (
+        classified_columns()
+        .values_list("source_id", "main_class__label", "sub_class__label")
+        .iterator()
+    )
+    return {
+        source_id: _labels_dict([(main or "", sub or "") for _, main, sub in group])
+        for source_id, group in itertools.groupby(rows, key=lambda r: r[0])
+    }
+
+
+def results_frame(
+    results: List[Dict[str, float]], labels: Dict[str, List[str]]
+) -> pd.DataFrame:
+    """make the DataFrame of results from each column's finalized features"""
     # Make a container for the results of our analysis
     _df = pd.DataFrame()
 
@@ -55,52 +196,64 @@ def analyze_dataframe(df: pd.DataFrame, labels: Dict[str, List[str]]) -> pd.Data
     _df["sub"] = labels["sub"]
     _df["label"] = labels["label"]
 
-    # mean token metrics aggregated across each column
-    _df["mean_token_count"] = df.apply(mean_token_count).values
-    _df["mean_token_length"] = df.apply(mean_token_length).values
-
-    # fraction metrics aggregated across each column
-    _df["frac_digit"] = df.apply(lambda rows: frac_fxn(count_digits, rows)).values
-    _df["frac_alpha"] = df.apply(lambda rows: frac_fxn(count_letters, rows)).values
-    _df["frac_space"] = df.apply(lambda rows: frac_fxn(count_spaces, rows)).values
-    _df["frac_other"] = df.apply(lambda rows: frac_fxn(count_other_text, rows)).values
-
-    # line length metrics
-    _df["mean_line_length"] = df.apply(lambda rows: avg_len(np.mean, rows)).values
-    _df["median_line_length"] = df.apply(lambda rows: avg_len(np.median, rows)).values
-    _df["std_line_length"] = df.apply(lambda rows: avg_len(np.std, rows)).values
-
-    # unique char / token metrics
-    _df["unq_char_count"] = df.apply(unq_char_count).values
-    _df["unq_token_count"] = df.apply(unq_token_count).values
-
-    # list-matching metrics - fractional token counts for exact matches
-    _df["frac_given"] = df.apply(lambda rows: frac_token(rows, assets.given)).values
-    _df["frac_surnames"] = df.apply(
-        lambda rows: frac_token(rows, assets.surnames)
-    ).values
-    _df["frac_states"] = df.apply(lambda rows: frac_token(rows, assets.states)).values
-    _df["frac_canada"] = df.apply(lambda rows: frac_token(rows, assets.canada)).values
-    _df["frac_cities"] = df.apply(lambda rows: frac_token(rows, assets.cities)).values
-    _df["frac_counties"] = df.apply(
-        lambda rows: frac_token(rows, assets.counties)
-    ).values
-    _df["frac_us_zip"] = df.apply(
-        lambda rows: frac_token(rows, assets.zipcodes, left=5)
-    ).values
-    _df["frac_fips"] = df.apply(lambda rows: frac_token(rows, assets.fips)).values
-
-    # Canadian zipcode pattern w/ pipe sep because of possible space in there
-    _df["frac_can_zip_patt"] = df.apply(
-        lambda rows: frac_regex(rows, r"^\w\d\w *\d\w\d$", sep="|")
-    ).values
-
-    # number of rows tagged on each column
-    _df["row_count"] = df.apply(lambda rows: len(rows)).values
+    for feature in FEATURES:
+        # (NaN for a feature profile_cascade skipped)
+        _df[feature] = [r.get(feature, np.nan) for r in results]
+
+    # rows the features were computed from - less than row_count when sampled
+    _df["sample_size"] = [r.get("sample_size", r["row_count"]) for r in results]
 
     return _df.transpose()
 
 
+def analyze_dataframe(
+    df: pd.DataFrame,
+    labels: Dict[str, List[str]],
+    approximate: bool = False,
+    timed: bool = None,
+    cascade: bool = False,
+) -> pd.DataFrame:
+    """
+    analyze all columns in a DataFrame and return a DataFrame of results
+
+    With `timed` (default: the CLASSIFIER_TIMING setting) a profiler.timing_report,
+    with the memory profiling took (see batch.MemorySampler), is logged to the
+    "classifier.timing" logger. With `cascade`, columns whose
+    header the header index is confident about skip the expensive features, which
+    are NaN in the results (see header_index.profile_cascade).
+    """
+    if timed is None:
+        timed = settings.CLASSIFIER_TIMING
+    memory = MemorySampler().start() if timed else None
+    try:
+        # every metric is accumulated side by side in a single walk over each column
+        if cascade:
+            features, profiles = profile_cascade(
+                lambda: [df], approximate=approximate, timed=timed
+            )
+        else:
+            profiles = profile_dataframe(df, approximate=approximate, timed=timed)
+            features = [p.finalize() for p in profiles]
+    finally:
+        if memory is not None:
+            memory.stop()
+    results = results_frame(features, labels)
+    if timed:
+        report = dict(timing_report(profiles), memory=memory.report())
+        timing_log.info(json.dumps(report))
+    return results
+
+
+def analyze_chunks(
+    chunks: Iterable[pd.DataFrame],
+    labels: Dict[str, List[str]],
+    approximate: bool = False,
+) -> pd.DataFrame:
+    """analyze a CSV streamed as DataFrame chunks (see iter_csv) without loading it"""
+    profiles = profile_chunks(chunks, approximate=approximate)
+    return results_frame([p.finalize() for p in profiles], labels)
+
+
 def json_fp(src_doc: File) -> str:
     """make a json filepath from a Source.document's path"""
     bn = os.path.basename(src_doc.name)
@@ -109,16 +262,145 @@ def json_fp(src_doc: File) -> str:
 
 def write_data(data: pd.DataFrame, filepath: str) -> None:
     """write some data to a file as json"""
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
     data.to_json(filepath)
 
 
-def batch_analysis() -> None:
-    """pull all applicable Source models and analyze the documents"""
+def timing_fp(src_doc: File) -> str:
+    """make a timing report filepath next to a Source.document's json_fp"""
+    return json_fp(src_doc)[: -len(".json")] + ".timing.json"
+
+
+def write_timing(report: dict, filepath: str) -> None:
+    """write a profiler.timing_report as json and log it"""
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    with open(filepath, "w") as f:
+        json.dump(report, f, indent=2)
+    timing_log.info(json.dumps(report))
+
+
+def store_analysis(result: JobResult, approximate: bool) -> None:
+    """persist a finished Job's content hash and column features"""
+    if result.error:
+        return
+    with transaction.atomic():
+        Source.objects.filter(id=result.source_id).update(
+            content_hash=result.content_hash
+        )
+        if result.skipped:
+            return
+        columns = Column.objects.filter(source_id=result.source_id)
+        existing = {c.index: c for c in columns}
+        # columns of a Source that hasn't been classified yet don't exist until now
+        created = []
+        for index, features in enumerate(result.features):
+            payload = column_payload(
+                features, result.content_hash, approximate, result.sampled
+            )
+            column = existing.get(index)
+            if column is None:
+                created.append(
+                    Column(source_id=result.source_id, index=index, analysis=payload)
+                )
+            else:
+                column.analysis = payload
+        Column.objects.bulk_update(existing.values(), ["analysis"])
+        Column.objects.bulk_create(created)
+
+
+def batch_analysis(
+    approximate: bool = None,
+    workers: int = 1,
+    progress: Callable[[JobResult, int, int], None] = None,
+    write_json: bool = False,
+    matrix: FeatureMatrix = None,
+    timed: bool = None,
+    split: int = 1,
+    adaptive: bool = False,
+) -> List[JobResult]:
+    """
+    pull all applicable Source models and analyze the documents
+
+    Features are kept per Column in Column.analysis - a Source whose stored
+    features are all current for its content hash is skipped without being read.
+    Every analyzed Source is appended to the feature matrix store (see
+    classifier.matrix_store), whose labels are brought up to date for every Source,
+    and with `write_json` to analysis/<name>.json as well.
+    With `timed` (default: the CLASSIFIER_TIMING setting) each profiled Source gets
+    a timing report in analysis/<name>.timing.json. With `split`, each document
+    with a row index is profiled over that many processes (see batch.analyze_job).
+    With `adaptive`, each changed Source is profiled only until its fractions settle
+    (see sampling.profile_adaptive) - a later run without it profiles them in full.
+    """
+    if approximate is None:
+        approximate = settings.CLASSIFIER_APPROXIMATE
+    if timed is None:
+        timed = settings.CLASSIFIER_TIMING
     sources = Source.objects.filter(
-        document__isnull=False, time_classified__isnull=False
+        document__isnull=False,
+        time_classified__isnull=False,
+        duplicate_of__isnull=True,
     )
+    # a fixed number of queries however many sources there are
+    labels = load_all_labels()
+    analyses = {
+        source_id: tuple(load_payload(a) for _, a in group)
+        for source_id, group in itertools.groupby(
+            classified_columns().values_list("source_id", "analysis").iterator(),
+            key=lambda r: r[0],
+        )
+    }
+    if matrix is None:
+        matrix = FeatureMatrix()
+    in_matrix = matrix.sources()
+    jobs, unchanged = [], []
     for source in sources:
-        df = load_csv(source.document)
-        labels = load_labels(source)
-        data = analyze_dataframe(df, labels)
-        write_data(data, json_fp(source.document))
+        stored = analyses.get(source.id, ())
+        source_labels = labels.get(source.id, _labels_dict([]))
+        if source.content_hash and not stale_features(
+            stored, source.content_hash, approximate, adaptive
+        ):
+            rows = max((p["features"]["row_count"] for p in stored), default=0)
+            unchanged.append(
+                JobResult(source.id, source.document.name, rows, skipped=True)
+            )
+            features = merge_features(stored, [{} for _ in stored])
+            if source.id not in in_matrix:
+                # analyzed before the matrix store existed (or it was deleted)
+                matrix.add(source.id, source.document.name, source_labels, features)
+            if write_json:
+                write_data(
+                    results_frame(features, source_labels), json_fp(source.document)
+                )
+            continue
+        jobs.append(
+            Job(
+                source.id,
+                source.document.name,
+                source_labels,
+                source.content_hash,
+                stored,
+                write_json,
+                RowIndex.for_source(source),
+                adaptive=adaptive,
+            )
+        )
+
+    def done(result: JobResult, count: int, total: int) -> None:
+        store_analysis(result, approximate)
+        if result.features:
+            matrix.add(
+                result.source_id,
+                result.name,
+                labels.get(result.source_id, _labels_dict([])),
+                result.features,
+            )
+        if progress is not None:
+            progress(result, count, total)
+
+    try:
+        return unchanged + run_jobs(jobs, workers, approximate, done, timed, split)
+    finally:
+        # rows already stored keep the labels they were added with until now
+        matrix.relabel(labels)
+        matrix.flush()
@@ -1,19 +1,81 @@
-import csv
 import json
-import random
+from typing import List, Optional
 
+from django.conf import settings
 from django.contrib import messages
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView
 from django.views.generic.edit import FormView
 
+from classifier.dedup import create_sources, reused_labels
 from classifier.forms import SourceUploadForm
+from classifier.feature_store import load_payload
+from classifier.header_index import get_header_index
 from classifier.models import Classification, Source, Column
+from classifier.predictor import predict_features
+from classifier.tree import classification_tree
+from classifier.uploads import store_scans
+from classifier import profile_jobs
+from classifier.utils import source_preview
+from classifier.work_queue import (
+    claim_source,
+    invalidate_progress,
+    progress,
+    release_source,
+)
+
+
+def suggest(source: Source, tree: dict, headers: List[str]) -> List[Optional[dict]]:
+    """
+    the trained model's main/sub Classification ids for each column, where it has one
+
+    Uses the features profiled when the Source was uploaded - until those are in,
+    there are no suggestions. A header name the header index is confident of
+    overrides the model (see header_index.HeaderIndex.confident). A classified
+    Source with the same header takes precedence over both: its labels are
+    suggested as they are (see dedup.reused_labels).
+    """
+    columns = len(headers)
+    reused = reused_labels(source, columns)
+    if reused is not None:
+        return reused
+    mains = {label: main_id for main_id, label in tree["mains"]}
+
+    def labeled(main_label: str, sub_label: str, **extra) -> Optional[dict]:
+        if main_label not in mains:
+            return None
+        main_id = mains[main_label]
+        subs = {label: sub_id for sub_id, label in tree["subs"][str(main_id)]}
+        return {"main": main_id, "sub": subs.get(sub_label), **extra}
+
+    analyses = source.column_set.order_by("index").values_list("analysis", flat=True)
+    features = [load_payload(a).get("features") for a in analyses]
+    suggestions = [None] * columns
+    if len(features) == columns and all(features):
+        suggestions = [
+            None
+            if prediction is None
+            else labeled(prediction[0], prediction[1], probability=prediction[2])
+            for prediction in predict_features(features)
+        ]
+    index = get_header_index()
+    for i, name in enumerate(headers if index else ()):
+        match = index.match(name)
+        if match and match[2] >= settings.CLASSIFIER_HEADER_CONFIDENCE:
+            suggestions[i] = (
+                labeled(match[0], match[1], probability=match[2], header=True)
+                or suggestions[i]
+            )
+    return suggestions
 
 
 class ClassifyView(TemplateView):
@@ -27,45 +89,104 @@ class ClassifyView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        src_id = random.choice(
-            Source.objects.filter(time_classified=None).values_list("id", flat=True)
-        )
-        source = Source.objects.get(id=src_id)
+        source = self.source
         context["source"] = source
-        with source.document.open("r") as f:
-            reader = csv.reader(f, delimiter=",")
-            lines = list(reader)
-            context["headers"] = lines.pop(0)
-            context["rows"] = lines[:9]
-        mains = Classification.objects.filter(main=True).values_list("id", "label")
-        context["mains"] = mains
-        context["completion"] = f"{Source.objects.filter(time_classified__isnull=False).count()} / {Source.objects.count()}"
+        preview = source_preview(source)
+        context["headers"] = preview["headers"]
+        context["rows"] = preview["rows"]
+        tree = classification_tree()["tree"]
+        context["mains"] = tree["mains"]
+        context["suggestions"] = suggest(source, tree, preview["headers"])
+        counts = progress()
+        context["completion"] = f"{counts['classified']} / {counts['total']}"
         return context
 
     def get(self, request, *args, **kwargs):
-        if Source.objects.filter(time_classified=None).count() > 0:
+        # each labeler's session holds a lease on the Source they're shown
+        if not request.session.session_key:
+            request.session.save()
+        self.source = claim_source(request.session.session_key)
+        if self.source is not None:
             return super().get(request, *args, **kwargs)
         else:
             messages.info(request, "Upload some files to get started!")
             return redirect(reverse_lazy("classify-home:upload-files"))
 
     def post(self, request, *args, **kwargs):
+        """
+        save a labeler's classifications for the Source they hold the lease on
+
+        The submission is written in a fixed number of queries up to about 140
+        columns; past that sqlite's 999-parameter limit splits the column inserts
+        and updates into batches, so it grows by a query per batch. A labeler whose
+        lease has expired (and may since have gone to someone else) is refused with a
+        409 and has to reload the page.
+        """
         body = json.loads(request.body.decode("utf-8"))
-        source = Source.objects.get(id=body.pop("sourceId"))
-        for k, v in body.items():
-            main = Classification.objects.get(id=v["main"]) if v.get("main") else None
-            sub = Classification.objects.get(id=v["sub"]) if v.get("sub") else None
-            Column.objects.create(
-                source=source, index=k, main_class=main, sub_class=sub
+        source_id = body.pop("sourceId")
+        # every classification named in the submission, resolved in one query
+        # (the page sends ids as strings)
+        ids = {int(v[k]) for v in body.values() for k in ("main", "sub") if v.get(k)}
+        classes = Classification.objects.in_bulk(ids)
+        missing = ids - set(classes)
+        if missing:
+            return JsonResponse(
+                status=400,
+                data={"error": f"unknown classifications {sorted(missing)}"},
             )
+        with transaction.atomic():
+            source = Source.objects.select_for_update().get(id=source_id)
+            if (
+                source.claimed_by != request.session.session_key
+                or source.lease_expires is None
+                or source.lease_expires <= timezone.now()
+            ):
+                return JsonResponse(
+                    status=409,
+                    data={"error": "your claim on this source has expired"},
+                )
+            # columns may already exist (ie. from an analysis) - fill those in
+            existing = {c.index: c for c in Column.objects.filter(source=source)}
+            created, updated = [], []
+            for k, v in body.items():
+                main = classes[int(v["main"])] if v.get("main") else None
+                sub = classes[int(v["sub"])] if v.get("sub") else None
+                column = existing.get(int(k))
+                if column is None:
+                    created.append(
+                        Column(source=source, index=k, main_class=main, sub_class=sub)
+                    )
+                else:
+                    column.main_class, column.sub_class = main, sub
+                    updated.append(column)
+            Column.objects.bulk_create(created)
+            Column.objects.bulk_update(updated, ["main_class", "sub_class"])
+            source.time_classified = timezone.now()
+            source.status = Source.CLASSIFIED
+            release_source(source)
+            source.save()
+        invalidate_progress()
         messages.success(request, "Classified successfully!")
-        source.time_classified = timezone.now()
-        source.save()
         return JsonResponse(
             status=200, data={"location": reverse_lazy("classify:classify")}
         )
 
 
+class TreeView(View):
+    """the whole Classification tree, so the classify page never asks per click"""
+
+    @method_decorator(
+        cache_control(private=True, max_age=settings.CLASSIFIER_TREE_SECONDS)
+    )
+    @method_decorator(
+        condition(etag_func=lambda request: classification_tree()["etag"])
+    )
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(
+            classification_tree()["body"], content_type="application/json"
+        )
+
+
 class LoadSubsView(View):
     """AJAX loader for subclassifications"""
 
@@ -97,10 +218,19 @@ class SourceUploadView(FormView):
         form = self.get_form(form_class)
         files = request.FILES.getlist("document")
         if form.is_valid():
-            sources = []
-            for f in files:
-                sources.append(Source(document=f))
-            Source.objects.bulk_create(sources)
+            sources, duplicates = create_sources(files)
+            # anything the upload handler couldn't profile on the way in is
+            # profiled off the request
+            unprofiled = store_scans(sources, files)
+            invalidate_progress()
+            if duplicates:
+                messages.info(
+                    request,
+                    f"{len(duplicates)} file(s) were already uploaded - "
+                    f"their earlier analysis and labels are reused.",
+                )
+            jobs = profile_jobs.enqueue(unprofiled)
+            transaction.on_commit(lambda: profile_jobs.start(len(jobs)))
             return self.form_valid(form)
         else:
             return self.form_invalid(form)
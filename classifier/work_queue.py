@@ -0,0 +1,81 @@
+"""Hand out pending Sources to labelers, one labeler per Source at a time"""
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from classifier.models import Source
+
+PROGRESS_KEY = "classifier:progress"
+
+
+def _claimable(now) -> Q:
+    """
+    pending, not a duplicate of another upload, and either never claimed or with an
+    expired lease
+    """
+    return Q(status=Source.PENDING, duplicate_of__isnull=True) & (
+        Q(lease_expires__isnull=True) | Q(lease_expires__lte=now)
+    )
+
+
+def claim_source(claimant: str, attempts: int = 5) -> Optional[Source]:
+    """
+    lease the oldest claimable Source to `claimant`, or None if the queue is empty
+
+    A labeler who still holds a live lease gets the same Source back. Claims are a
+    conditional UPDATE, so two labelers racing for the same row can't both win -
+    the loser just moves on to the next one.
+    """
+    now = timezone.now()
+    expires = now + timedelta(seconds=settings.CLASSIFIER_LEASE_SECONDS)
+    held = Source.objects.filter(
+        status=Source.PENDING, claimed_by=claimant, lease_expires__gt=now
+    )
+    if held.update(lease_expires=expires):
+        return held.first()
+    for _ in range(attempts):
+        candidate = (
+            Source.objects.filter(_claimable(now))
+            .order_by("id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if candidate is None:
+            return None
+        won = Source.objects.filter(_claimable(now), id=candidate).update(
+            claimed_by=claimant, lease_expires=expires
+        )
+        if won:
+            return Source.objects.get(id=candidate)
+    return None
+
+
+def release_source(source: Source) -> None:
+    """drop any lease on a Source (ie. once it's classified)"""
+    source.claimed_by = ""
+    source.lease_expires = None
+
+
+def progress() -> Dict[str, int]:
+    """
+    classified and total Source counts, cached for CLASSIFIER_PROGRESS_SECONDS -
+    duplicate uploads aren't counted, as they're never labeled
+    """
+    counts = cache.get(PROGRESS_KEY)
+    if counts is None:
+        sources = Source.objects.filter(duplicate_of__isnull=True)
+        counts = {
+            "classified": sources.filter(status=Source.CLASSIFIED).count(),
+            "total": sources.count(),
+        }
+        cache.set(PROGRESS_KEY, counts, settings.CLASSIFIER_PROGRESS_SECONDS)
+    return counts
+
+
+def invalidate_progress() -> None:
+    """forget the cached progress counts after Sources are added or classified"""
+    cache.delete(PROGRESS_KEY)
@@ -83,6 +83,16 @@ DATABASES = {
     }
 }
 
+# Shared by every web and worker process, so the classification tree's version and
+# the progress counts (classifier.tree, classifier.work_queue) are seen by all of
+# them - `python manage.py createcachetable` creates the table
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'classifier_cache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -122,4 +132,58 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
-STATICFILES_DIRS = (os.path.join(BASE_DIR, "assets"), )
\ No newline at end of file
+STATICFILES_DIRS = (os.path.join(BASE_DIR, "assets"), )
+
+# Uploads are written to disk and scanned (hashed, row indexed, previewed and
+# profiled) in a single pass as they arrive - see classifier/uploads.py. The
+# temporary file is moved into place, so give it the usual permissions.
+FILE_UPLOAD_HANDLERS = ["classifier.uploads.StreamingUploadHandler"]
+FILE_UPLOAD_PERMISSIONS = 0o644
+
+# Rows per chunk when streaming CSVs through the column profiler - this bounds the
+# memory a single file can take during batch analysis.
+CLASSIFIER_CHUNKSIZE = 50000
+
+# Columns whose distinct values are at most this fraction of their rows are held as
+# categoricals while profiling and by `load_csv(compact=True)` - each distinct value
+# is then profiled once, weighted by how often it occurs.
+CLASSIFIER_CATEGORY_RATIO = 0.5
+
+# Use bounded-memory sketches for unique token counts and line length medians
+# (see classifier/sketches.py for the error bounds).
+CLASSIFIER_APPROXIMATE = False
+
+# Time every accumulator while profiling and write a report per file next to the
+# analysis output (see profiler.timing_report) - `batch_analyze --timing` for one run
+CLASSIFIER_TIMING = False
+
+# Rows shown under the header on the classify page, stored with each upload
+CLASSIFIER_PREVIEW_ROWS = 9
+
+# How long a labeler holds the Source they were shown before it goes back in the queue
+CLASSIFIER_LEASE_SECONDS = 15 * 60
+
+# How long the "classified / total" progress counts are cached
+CLASSIFIER_PROGRESS_SECONDS = 60
+
+# How long browsers may reuse the classification tree before revalidating its ETag
+CLASSIFIER_TREE_SECONDS = 60 * 60
+
+# Background profiling of uploads (see classifier/profile_jobs.py): threads per web
+# process (0 leaves the queue to `manage.py profile_sources`), runs before a job is
+# given up on, the wait before the first retry (doubling after that), and how long
+# a run's lease lasts - it's renewed while the run goes on, so this is how soon
+# another worker takes over a job whose process died
+CLASSIFIER_PROFILE_WORKERS = 2
+CLASSIFIER_PROFILE_ATTEMPTS = 3
+CLASSIFIER_PROFILE_RETRY_SECONDS = 60
+CLASSIFIER_PROFILE_LEASE_SECONDS = 30 * 60
+
+# Where `manage.py train_classifier` saves the model the classify page suggests from
+CLASSIFIER_MODEL_PATH = os.path.join("analysis", "model.npz")
+
+# ...and the header name index it learns alongside (see classifier/header_index.py).
+# Uploaded columns whose header maps to one label at least this confidently are
+# suggested that label and get only a cheap profile at first.
+CLASSIFIER_HEADER_INDEX_PATH = os.path.join("analysis", "header_index.json")
+CLASSIFIER_HEADER_CONFIDENCE = 0.9